@@ -0,0 +1,248 @@
+# IMPORTS
+
+import asyncio
+from pymongo import ReturnDocument
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo_connector import load_settings, build_uri, client_options, PUBLISHER_COLLECTION, BOOK_COLLECTION
+from format import Format
+from isbn import normalize_isbn
+from book_dao import BookDAO, SEARCH_LIMIT, TEXT_SCORE_SORT, CASCADE_MODES
+from book_pager import BATCH_SIZE
+
+
+
+# ASYNC DAO CLASS
+
+class AsyncBookDAO:
+    """Class that contains all the methods to interact with the database, as coroutines."""
+    def __init__(self, settings: dict = None, validate_publishers: bool = True):
+        """Constructor method."""
+        # books must be published by an existing publisher, checked on the server since there is no in-memory registry here
+        self.validate_publishers = validate_publishers
+        # connect to the database (the client binds to the running event loop on first use)
+        self.settings = settings or load_settings()
+        self.client = AsyncIOMotorClient(build_uri(self.settings), **client_options(self.settings))
+        self.db = self.client[self.settings['dbname']]
+        # get the collection objects
+        self.publisherCollection = self.db[PUBLISHER_COLLECTION]
+        self.bookCollection = self.db[BOOK_COLLECTION]
+
+    async def add_publisher(self, name: str, phone: str, city: str) -> str:
+        """Method that adds a new publisher to the database."""
+        # create the document
+        publisher = {
+            'name': name,
+            'phone': phone,
+            'city': city,
+        }
+        # try inserting the publisher
+        try:
+            await self.publisherCollection.insert_one(publisher)
+            return Format.info(f'Publisher {name} added successfully.')
+        except Exception as e:
+            return Format.warning(str(e).split(' ', 2)[2])
+
+    async def add_book(self, ISBN: str, title: str, year: int, published_by: str, previous_edition: str, price: float) -> str:
+        """Method that adds a new book to the database."""
+        # validate the ISBNs and compute the canonical ISBN-13 key
+        try:
+            ISBN13 = normalize_isbn(ISBN)
+            previous_edition = normalize_isbn(previous_edition) if previous_edition else previous_edition
+        except ValueError as e:
+            return Format.warning(str(e))
+        # check that the publisher exists
+        if (message := await self._check_publisher(published_by)):
+            return message
+        # round the price to 2 decimal places
+        price = round(price, 2) if price else price
+        # create the document
+        book = {
+            'ISBN': ISBN,
+            'ISBN13': ISBN13,
+            'title': title,
+            'year': year,
+            'published_by': published_by,
+            'price': price,
+        }
+        # if the book has a previous edition, add it to the document
+        if previous_edition:
+            book['previous_edition'] = previous_edition
+        # try inserting the book
+        try:
+            await self.bookCollection.insert_one(book)
+            return Format.info(f'Book {title} added successfully.')
+        except Exception as e:
+            return Format.warning(str(e).split(' ', 2)[2])
+
+    async def edit_book(self, ISBN: str, title: str, year: int, published_by: str, previous_edition: str, price: float, version: int = None, return_book: bool = False) -> str or dict:
+        """Method that edits a book in the database, only if it is still at 'version' when one is given, and returns the edited book if 'return_book' is set."""
+        # if no changes were made, return a warning message
+        if not any([title, year, published_by, previous_edition, price]):
+            return Format.warning('No changes were made.')
+        # validate the ISBNs, a legacy ISBN that fails validation being looked up by its legacy key
+        ISBN13, invalid = BookDAO._lookup_key(ISBN)
+        try:
+            previous_edition = normalize_isbn(previous_edition) if previous_edition else previous_edition
+        except ValueError as e:
+            return Format.warning(str(e))
+        # check that the new publisher exists
+        if published_by and (message := await self._check_publisher(published_by)):
+            return message
+        # round the price to 2 decimal places
+        price = round(price, 2) if price else price
+        # create the filter, which only matches the expected version (books never edited have none, i.e. version 0)
+        fltr = {'ISBN13': ISBN13}
+        if version is not None:
+            fltr['version'] = int(version) if version else {'$in': [0, None]}
+        # create the document from the fields that were given
+        changes = {'title': title, 'year': year, 'published_by': published_by, 'previous_edition': previous_edition, 'price': price}
+        book = {field: value for field, value in changes.items() if value}
+        # try updating the book, every edit moving it to its next version like in BookDAO
+        try:
+            edited = await self.bookCollection.find_one_and_update(fltr, {'$set': book, '$inc': {'version': 1}}, {'_id': 0, 'ISBN13': 0}, return_document=ReturnDocument.AFTER)
+            if edited is None:
+                return await self._edit_failed(ISBN, ISBN13, version, invalid)
+            return edited if return_book else Format.info(f'Book {ISBN} edited successfully (version {edited["version"]}).')
+        except Exception as e:
+            return Format.warning(str(e).split(' ', 2)[2])
+
+    async def _edit_failed(self, ISBN: str, ISBN13: str, version: int or None, invalid: str = None) -> str:
+        """Method that tells whether an edit matched nothing because the book is missing or because it was edited by someone else."""
+        current = await self.bookCollection.find_one({'ISBN13': ISBN13}, {'_id': 0, 'version': 1}) if version is not None else None
+        if current is None:
+            return invalid or Format.warning(f'Book {ISBN} not found.')
+        return Format.warning(f'Book {ISBN} was edited by someone else (now at version {current.get("version", 0)}, expected {version}). Search it again and retry.')
+
+    async def delete_book(self, ISBN: str) -> str:
+        """Method that deletes a book from the database."""
+        # validate the ISBN, a legacy ISBN that fails validation being looked up by its legacy key
+        ISBN13, invalid = BookDAO._lookup_key(ISBN)
+        # try deleting the book
+        try:
+            if not (await self.bookCollection.delete_one({'ISBN13': ISBN13})).deleted_count and invalid:
+                return invalid
+            return Format.info(f'Book {ISBN} deleted successfully.')
+        except Exception as e:
+            return Format.warning(str(e).split(' ', 2)[2])
+
+    async def search_all_books(self, batch_size: int = BATCH_SIZE) -> list or str:
+        """Method that searches all books in the database."""
+        return await self._find({}, batch_size)
+
+    async def search_books_by_title(self, title: str, limit: int = SEARCH_LIMIT, batch_size: int = BATCH_SIZE) -> list or str:
+        """Method that searches books by title keywords in the database, best matches first."""
+        return await self._find({'$text': {'$search': title}}, batch_size, TEXT_SCORE_SORT, limit)
+
+    async def search_books_by_ISBN(self, ISBN: str) -> list or str:
+        """Method that searches books by ISBN-10 or ISBN-13 in the database."""
+        # validate the ISBN, a legacy ISBN that fails validation being looked up by its legacy key
+        ISBN13, invalid = BookDAO._lookup_key(ISBN)
+        # try executing the query
+        try:
+            book = await self.bookCollection.find_one({'ISBN13': ISBN13}, {'_id': 0, 'ISBN13': 0})
+            return [book] if book else invalid or []
+        except Exception as e:
+            return Format.warning(str(e).split(' ', 2)[2])
+
+    async def search_books_by_publisher(self, published_by: str, limit: int = SEARCH_LIMIT, batch_size: int = BATCH_SIZE) -> list or str:
+        """Method that searches books by publisher keywords in the database, best matches first."""
+        fltr = {'$text': {'$search': published_by}, 'published_by': BookDAO._keywords_regex(published_by)}
+        return await self._find(fltr, batch_size, TEXT_SCORE_SORT, limit)
+
+    async def search_books_by_price_range(self, min: float, max: float, batch_size: int = BATCH_SIZE) -> list or str:
+        """Method that searches books by price range in the database."""
+        return await self._find({'price': {'$gte': min, '$lte': max}}, batch_size)
+
+    async def search_books_by_year(self, year: int, batch_size: int = BATCH_SIZE) -> list or str:
+        """Method that searches books by year in the database."""
+        return await self._find({'year': year}, batch_size)
+
+    async def search_books_by_title_and_publisher(self, title: str, publisher: str, limit: int = SEARCH_LIMIT, batch_size: int = BATCH_SIZE) -> list or str:
+        """Method that searches books by title keywords and publisher in the database, best matches first."""
+        fltr = {'$text': {'$search': title}, 'published_by': BookDAO._keywords_regex(publisher)}
+        return await self._find(fltr, batch_size, TEXT_SCORE_SORT, limit)
+
+    async def search_books_by_ISBNs(self, ISBNs: list) -> list:
+        """Method that searches many ISBNs concurrently, returning one result per ISBN."""
+        return await asyncio.gather(*(self.search_books_by_ISBN(ISBN) for ISBN in ISBNs))
+
+    async def search_books_by_publishers(self, publishers: list, limit: int = SEARCH_LIMIT) -> list:
+        """Method that searches many publishers concurrently, returning one result per publisher."""
+        return await asyncio.gather(*(self.search_books_by_publisher(publisher, limit) for publisher in publishers))
+
+    async def iter_books(self, fltr: dict = None, batch_size: int = BATCH_SIZE):
+        """Method that streams the books matching a filter, fetching them in batches of 'batch_size'."""
+        async for book in self.bookCollection.find(fltr or {}, {'_id': 0, 'ISBN13': 0}, batch_size=batch_size):
+            yield book
+
+    async def _find(self, fltr: dict, batch_size: int, sort: list = None, limit: int = 0) -> list or str:
+        """Method that runs a book query and returns its results."""
+        # create the projection
+        prj = {'_id': 0, 'ISBN13': 0}
+        # try executing the query
+        try:
+            cursor = self.bookCollection.find(fltr, prj, batch_size=batch_size)
+            cursor = cursor.sort(sort) if sort else cursor
+            return await cursor.limit(limit).to_list(length=None)
+        except Exception as e:
+            return Format.warning(str(e).split(' ', 2)[2])
+
+    async def delete_publisher(self, name: str, cascade: str = None, reassign_to: str = None, transaction: bool = False) -> str:
+        """Method that deletes a publisher from the database, and optionally deletes its books or reassigns them to another publisher."""
+        # validate the cascade
+        if cascade is not None and cascade not in CASCADE_MODES:
+            return Format.warning(f'Unknown cascade mode: {cascade}.')
+        if cascade == 'reassign':
+            if not reassign_to or reassign_to == name:
+                return Format.warning('The books must be reassigned to another publisher.')
+            if (message := await self._check_publisher(reassign_to)):
+                return message
+        # create the filters
+        fltr = {'name': name}
+        books = {'published_by': name}
+        # the books are handled first, so a failure never leaves them without their publisher
+        async def delete(session = None) -> int:
+            moved = 0
+            if cascade == 'delete':
+                moved = (await self.bookCollection.delete_many(books, session=session)).deleted_count
+            elif cascade == 'reassign':
+                moved = (await self.bookCollection.update_many(books, {'$set': {'published_by': reassign_to}}, session=session)).modified_count
+            await self.publisherCollection.delete_one(fltr, session=session)
+            return moved
+        # try deleting the publisher, in one transaction if asked (which needs a replica set)
+        try:
+            if transaction:
+                async with await self.client.start_session() as session:
+                    moved = await session.with_transaction(delete)
+            else:
+                moved = await delete()
+        except Exception as e:
+            return Format.warning(str(e))
+        if cascade == 'delete':
+            return Format.info(f'Publisher {name} and its {moved} books deleted successfully.')
+        if cascade == 'reassign':
+            return Format.info(f'Publisher {name} deleted successfully, {moved} books reassigned to {reassign_to}.')
+        return Format.info(f'Publisher {name} deleted successfully.')
+
+    async def _check_publisher(self, published_by: str) -> str or None:
+        """Method that returns a warning if the publisher of a book does not exist."""
+        if not self.validate_publishers:
+            return None
+        try:
+            if await self.publisherCollection.find_one({'name': published_by}, {'_id': 1}) is not None:
+                return None
+        except Exception as e:
+            return Format.warning(str(e))
+        return Format.warning(f'Publisher {published_by} does not exist.')
+
+    async def get_fields(self) -> list or str:
+        """Method that describes the books collection."""
+        # try executing the query
+        try:
+            return list((await self.bookCollection.find_one({}, {'_id': 0, 'ISBN13': 0})).keys())
+        except Exception as e:
+            return Format.warning(str(e).split(' ', 2)[2])
+
+    def close(self) -> None:
+        """Method that closes the connection to the database."""
+        self.client.close()
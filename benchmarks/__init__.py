@@ -0,0 +1 @@
+"""Reproducible benchmarks of the BookDAO operations. Run with: python3 -m benchmarks.run --help"""
@@ -0,0 +1,76 @@
+# IMPORTS
+
+import random
+from isbn import isbn13_check_digit
+
+
+
+# CONSTANTS
+
+WORDS = [
+    'data', 'systems', 'python', 'modern', 'introduction', 'advanced', 'theory', 'practice', 'design', 'networks',
+    'algorithms', 'history', 'science', 'art', 'guide', 'principles', 'analysis', 'mongo', 'database', 'computing',
+    'physics', 'chemistry', 'biology', 'economics', 'language', 'music', 'ocean', 'garden', 'city', 'journey',
+]
+CITIES = ['Fort Worth', 'Dallas', 'Austin', 'Boston', 'London', 'Berlin', 'Toronto', 'Sydney', 'Chicago', 'Denver']
+EDITION_RATE = 0.2
+MIN_YEAR, MAX_YEAR = 1950, 2023
+
+
+
+# FUNCTIONS
+
+def make_isbn(number: int) -> str:
+    """Function that creates a valid ISBN-13 from a sequence number."""
+    body = f'978{number:09d}'
+    return body + isbn13_check_digit(body)
+
+def make_publishers(count: int, rng: random.Random) -> list:
+    """Function that creates publisher documents."""
+    return [
+        {'name': f'Publisher {i:05d}', 'phone': str(rng.randint(1000000000, 9999999999)), 'city': rng.choice(CITIES)}
+        for i in range(count)
+    ]
+
+def make_title(rng: random.Random) -> str:
+    """Function that creates a title of two to five words."""
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 5))).title()
+
+def make_price(rng: random.Random) -> float:
+    """Function that creates a right-skewed price, most books costing between 10 and 60."""
+    return round(min(rng.lognormvariate(3.3, 0.5), 500), 2)
+
+def make_year(rng: random.Random) -> int:
+    """Function that creates a publication year skewed towards recent years."""
+    return MAX_YEAR - min(int(rng.expovariate(1 / 12)), MAX_YEAR - MIN_YEAR)
+
+def make_books(count: int, publishers: list, rng: random.Random, start: int = 0) -> list:
+    """Function that creates book documents, some of them new editions of an earlier book."""
+    books = []
+    for i in range(count):
+        ISBN = make_isbn(start + i)
+        book = {
+            'ISBN': ISBN,
+            'ISBN13': ISBN,
+            'title': make_title(rng),
+            'year': make_year(rng),
+            'published_by': rng.choice(publishers)['name'],
+            'price': make_price(rng),
+        }
+        # a new edition keeps the title and publisher of the book it follows
+        if books and rng.random() < EDITION_RATE:
+            previous = books[-1]
+            book.update({
+                'title': previous['title'],
+                'published_by': previous['published_by'],
+                'year': min(previous['year'] + rng.randint(1, 5), MAX_YEAR),
+                'previous_edition': previous['ISBN13'],
+            })
+        books.append(book)
+    return books
+
+def generate(publishers: int, books: int, seed: int = 0) -> tuple:
+    """Function that creates a reproducible data set of publishers and books."""
+    rng = random.Random(seed)
+    publisher_documents = make_publishers(publishers, rng)
+    return publisher_documents, make_books(books, publisher_documents, rng)
@@ -0,0 +1,236 @@
+# IMPORTS
+
+import sys
+import json
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+from itertools import count
+from time import perf_counter
+from datetime import datetime, timezone
+from book_dao import BookDAO
+from pymongo_connector import load_settings
+from storage_backend import BACKENDS
+from format import Format
+from benchmarks.data import generate, make_isbn, make_title, make_price, make_year, WORDS, CITIES
+
+
+
+# CONSTANTS
+
+BENCH_DBNAME = 'bookmanager_bench'
+PUBLISHERS = 200
+BOOKS = 20000
+OPS = 200
+SEED = 0
+LOAD_BATCH_SIZE = 5000
+THRESHOLD = 0.2
+OUTPUT = 'bench_output.json'
+# rows per import call, and calls per bulk workload, which each handle far more books than a single operation
+IMPORT_ROWS = 500
+BULK_OPS = 10
+BULK_WORKLOADS = ('import_books', 'import_publishers', 'export_books', 'export_publishers', 'sweep_orphans')
+
+
+
+# WORKLOADS
+
+def workloads(dao: BookDAO, publishers: list, books: list, rng: random.Random, out_dir: str) -> dict:
+    """Function that returns one single-operation callable per BookDAO method, the exports writing to 'out_dir'."""
+    # ISBNs outside the generated range, added and then deleted by the write workloads
+    added = count(len(books))
+    added_isbns = []
+    # publisher names added and then deleted by the publisher workloads
+    publisher_numbers = count(len(publishers))
+    added_publishers = []
+    def add_book():
+        ISBN = make_isbn(next(added))
+        added_isbns.append(ISBN)
+        return dao.add_book(ISBN, make_title(rng), make_year(rng), rng.choice(publishers)['name'], None, make_price(rng))
+    def delete_book():
+        return dao.delete_book(added_isbns.pop()) if added_isbns else dao.delete_book(make_isbn(next(added)))
+    def add_publisher():
+        added_publishers.append(f'Publisher {next(publisher_numbers):05d}')
+        return dao.add_publisher(added_publishers[-1], '1234567890', 'Fort Worth')
+    def delete_publisher():
+        return dao.delete_publisher(added_publishers.pop() if added_publishers else 'Missing Publisher')
+    def search_price_range():
+        low = round(rng.uniform(5, 80), 2)
+        return dao.search_books_by_price_range(low, low + 5)
+    def search_books():
+        year = make_year(rng)
+        criteria = {'published_by': rng.choice(publishers)['name'], 'year_min': year - 10, 'year_max': year + 10}
+        return dao.search_books(criteria, sort=[('price', 1)])
+    def search_books_paged():
+        # walk the first pages of a sorted search, as the menu and the HTTP API do
+        pager = dao.search_books({'year_min': make_year(rng)}, sort=[('year', 1)], page_size=20)
+        return [book for _ in range(5) for book in pager.next_page()] if not isinstance(pager, str) else pager
+    def import_books():
+        rows = [
+            {'ISBN': make_isbn(next(added)), 'title': make_title(rng), 'year': make_year(rng), 'published_by': rng.choice(publishers)['name'], 'price': make_price(rng)}
+            for _ in range(IMPORT_ROWS)
+        ]
+        report = dao.import_books(rows)
+        return report['error'] and Format.warning(report['error'])
+    def import_publishers():
+        rows = [{'name': f'Publisher {next(publisher_numbers):05d}', 'phone': '1234567890', 'city': rng.choice(CITIES)} for _ in range(IMPORT_ROWS)]
+        report = dao.import_publishers(rows)
+        return report['error'] and Format.warning(report['error'])
+    return {
+        'add_publisher': add_publisher,
+        'delete_publisher': delete_publisher,
+        'add_book': add_book,
+        'edit_book': lambda: dao.edit_book(rng.choice(books)['ISBN'], None, None, None, None, make_price(rng)),
+        'delete_book': delete_book,
+        'search_all_books': lambda: dao.search_all_books(),
+        'search_books_by_title': lambda: dao.search_books_by_title(' '.join(rng.sample(WORDS, 2))),
+        'search_books_by_ISBN': lambda: dao.search_books_by_ISBN(rng.choice(books)['ISBN']),
+        'search_books_by_publisher': lambda: dao.search_books_by_publisher(rng.choice(publishers)['name']),
+        'search_books_by_price_range': search_price_range,
+        'search_books_by_year': lambda: dao.search_books_by_year(make_year(rng)),
+        'search_books_by_title_and_publisher': lambda: dao.search_books_by_title_and_publisher(rng.choice(WORDS), rng.choice(publishers)['name']),
+        'search_books': search_books,
+        'search_books_paged': search_books_paged,
+        'search_books_with_publishers': lambda: dao.search_books_with_publishers({'published_by': rng.choice(publishers)['name']}),
+        'search_books_by_publisher_details': lambda: dao.search_books_by_publisher_details(rng.choice(CITIES), limit=100),
+        'get_edition_chain': lambda: dao.get_edition_chain(rng.choice(books)['ISBN']),
+        'get_fields': lambda: dao.get_fields(),
+        'report_books_per_publisher': lambda: dao.report_books_per_publisher(),
+        'report_books_per_city': lambda: dao.report_books_per_city(),
+        'report_price_by_year': lambda: dao.report_price_by_year(),
+        'report_price_histogram': lambda: dao.report_price_histogram(),
+        'import_books': import_books,
+        'import_publishers': import_publishers,
+        'export_books': lambda: dao.export_books(out_dir),
+        'export_publishers': lambda: dao.export_publishers(out_dir),
+        'sweep_orphans': lambda: dao.sweep_orphans(),
+    }
+
+
+
+# FUNCTIONS
+
+def percentile(latencies: list, p: float) -> float:
+    """Function that returns the nearest-rank percentile of sorted latencies."""
+    if not latencies:
+        return 0.0
+    return latencies[min(len(latencies) - 1, max(0, round(p / 100 * len(latencies)) - 1))]
+
+def measure(operation, ops: int) -> dict:
+    """Function that times an operation 'ops' times and summarizes its latencies in milliseconds."""
+    latencies, errors = [], 0
+    start = perf_counter()
+    for _ in range(ops):
+        begin = perf_counter()
+        try:
+            result = operation()
+            errors += type(result) == str and Format.is_warning(result)
+        except Exception:
+            errors += 1
+        latencies.append((perf_counter() - begin) * 1000)
+    seconds = perf_counter() - start
+    latencies.sort()
+    return {
+        'ops': ops,
+        'errors': errors,
+        'seconds': round(seconds, 4),
+        'throughput': round(ops / seconds, 2) if seconds else 0.0,
+        'mean_ms': round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+        'p50_ms': round(percentile(latencies, 50), 4),
+        'p95_ms': round(percentile(latencies, 95), 4),
+        'p99_ms': round(percentile(latencies, 99), 4),
+    }
+
+def load(dao: BookDAO, publishers: list, books: list) -> float:
+    """Function that replaces the benchmark database contents with the generated data and returns the load time."""
+    start = perf_counter()
+    dao.bookCollection.drop()
+    dao.publisherCollection.drop()
+    dao.indexes.metaCollection.drop()
+    dao.publisherCollection.insert_many([dict(publisher) for publisher in publishers])
+    for i in range(0, len(books), LOAD_BATCH_SIZE):
+        dao.bookCollection.insert_many([dict(book) for book in books[i:i + LOAD_BATCH_SIZE]], ordered=False)
+    dao.create_indexes(force=True)
+    return perf_counter() - start
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Function that lists the workloads whose p95 latency grew or whose throughput fell by more than 'threshold'."""
+    regressions = []
+    for name, current in results['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base:
+            continue
+        if base['p95_ms'] and current['p95_ms'] > base['p95_ms'] * (1 + threshold):
+            regressions.append(f'{name}: p95 {base["p95_ms"]} ms -> {current["p95_ms"]} ms')
+        if base['throughput'] and current['throughput'] < base['throughput'] * (1 - threshold):
+            regressions.append(f'{name}: throughput {base["throughput"]} -> {current["throughput"]} ops/s')
+    return regressions
+
+def run(publishers: int = PUBLISHERS, books: int = BOOKS, ops: int = OPS, seed: int = SEED, dbname: str = BENCH_DBNAME, only: list = None, backend: str = None) -> dict:
+    """Function that loads a generated data set and times every workload against it."""
+    publisher_documents, book_documents = generate(publishers, books, seed)
+    settings = load_settings()
+    settings['dbname'] = dbname
+    # the backend setting is kept unless one is asked for
+    if backend:
+        settings['backend'] = backend
+    dao = BookDAO(verify_indexes=False, settings=settings)
+    out_dir = tempfile.mkdtemp(prefix='bookmanager_bench_')
+    try:
+        load_seconds = load(dao, publisher_documents, book_documents)
+        rng = random.Random(seed)
+        results = {}
+        for name, operation in workloads(dao, publisher_documents, book_documents, rng, out_dir).items():
+            if only and name not in only:
+                continue
+            results[name] = measure(operation, min(ops, BULK_OPS) if name in BULK_WORKLOADS else ops)
+    finally:
+        dao.close()
+        shutil.rmtree(out_dir, ignore_errors=True)
+    return {
+        'meta': {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'publishers': publishers,
+            'books': books,
+            'ops': ops,
+            'seed': seed,
+            'backend': settings['backend'],
+            'load_seconds': round(load_seconds, 4),
+        },
+        'results': results,
+    }
+
+def main(argv: list) -> None:
+    """Function that runs the benchmarks, writes the results and compares them with a baseline."""
+    parser = argparse.ArgumentParser(prog='python3 -m benchmarks.run', description='Benchmark every BookDAO operation against a generated catalog.')
+    parser.add_argument('--publishers', type=int, default=PUBLISHERS)
+    parser.add_argument('--books', type=int, default=BOOKS)
+    parser.add_argument('--ops', type=int, default=OPS, help='operations timed per workload')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--dbname', default=BENCH_DBNAME, help='database to (re)create; never point this at real data')
+    parser.add_argument('--backend', choices=BACKENDS, help='storage backend, the configured one by default')
+    parser.add_argument('--only', nargs='*', help='workloads to run, all by default')
+    parser.add_argument('--output', default=OUTPUT)
+    parser.add_argument('--baseline', help='results file to compare against')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD, help='relative change counted as a regression')
+    args = parser.parse_args(argv)
+    results = run(args.publishers, args.books, args.ops, args.seed, args.dbname, args.only, args.backend)
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(results, file, indent=4)
+    # print the summary
+    print(f'{"workload":<40}{"ops/s":>12}{"p50 ms":>12}{"p95 ms":>12}{"p99 ms":>12}{"errors":>8}')
+    for name, result in results['results'].items():
+        print(f'{name:<40}{result["throughput"]:>12}{result["p50_ms"]:>12}{result["p95_ms"]:>12}{result["p99_ms"]:>12}{result["errors"]:>8}')
+    # compare with the baseline
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for regression in regressions:
+            print(Format.warning(f'Regression: {regression}'))
+        sys.exit(1 if regressions else 0)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,8 +1,43 @@
 # IMPORTS
 
-from pymongo_connector import DBConnection
+import re
+from threading import Thread, Lock
+from pymongo_connector import load_settings
+from storage_backend import open_connection
 from bson.regex import Regex
 from format import Format
+from index_manager import IndexManager
+from isbn import normalize_isbn, isbn_key
+from book_pager import BookPager, ListPager, BATCH_SIZE
+from query_cache import QueryCache
+from bulk_import import validate_book, validate_publisher, parse_row, IMPORT_BATCH_SIZE
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, OperationFailure, ExecutionTimeout, WriteConcernError
+from pymongo.operations import InsertOne, UpdateOne, DeleteOne
+from concurrent.futures import Future
+from write_behind import WriteBehind
+from bulk_export import export_collection, EXPORT_WORKERS
+import timing
+from time import perf_counter
+from metrics import Metrics, instrumented
+from schema_catalog import SchemaCatalog
+from reports import books_per_publisher, books_per_city, price_by_year, price_histogram, format_buckets, PERCENTILES
+from query_builder import clean_criteria, build_filter, build_sort, build_projection, build_matcher, choose_index, build_edition_chain, order_edition_chain, EDITION_DEPTH, build_publisher_join, build_publisher_books, PUBLISHER_FIELDS
+from publisher_registry import PublisherRegistry
+from book_replica import BookReplica
+
+
+
+# CONSTANTS
+
+SEARCH_LIMIT = 100
+TEXT_SCORE_SORT = [('score', {'$meta': 'textScore'})]
+# what happens to the books of a deleted publisher, and to the books of a publisher that does not exist
+CASCADE_MODES = ('delete', 'reassign')
+SWEEP_MODES = ('report', 'delete', 'reassign')
+SWEEP_BATCH_SIZE = 100
+# attributes that only exist once the DAO is connected
+LAZY_ATTRIBUTES = ('connection', 'client', 'db', 'publisherCollection', 'bookCollection', 'indexes')
 
 
 
@@ -10,10 +45,46 @@ from format import Format
 
 class BookDAO:
     """Class that contains all the methods to interact with the database."""
-    def __init__(self):
+    def __init__(self, cache: QueryCache = None, verify_indexes: bool = True, settings: dict = None, metrics: Metrics = None, validate_publishers: bool = True, writer: WriteBehind = None, replica: BookReplica = None):
         """Constructor method."""
-        # connect to the database
-        self.connection = DBConnection()
+        # optional cache of search results, invalidated by the write methods
+        self.cache = cache
+        # optional latency metrics and slow query log
+        self.metrics = metrics
+        # fields of the books collection, sampled on first use and updated by the writes
+        self.schema = SchemaCatalog()
+        # names of the publishers, loaded on first use, that books must be published by
+        self.publishers = PublisherRegistry()
+        self.validate_publishers = validate_publishers
+        # optional write-behind batching, the writes then return futures of their messages
+        self.writer = writer
+        # optional in-memory copy of the books, kept current by a change stream, that answers the searches once loaded
+        self.replica = replica
+        # optional connection settings, loaded from the environment if not given
+        self.settings = settings
+        # the connection is only made on first use
+        self.verify_indexes = verify_indexes
+        # background index verification, which text and hinted queries wait for, and its warning if it failed
+        self.index_thread = None
+        self.index_warning = None
+        # names of the book indexes, listed by the first hinted query once the verification is over
+        self.index_names = None
+        self.connect_lock = Lock()
+
+    def __getattr__(self, name: str):
+        """Method that connects to the database the first time a connection attribute is used."""
+        if name not in LAZY_ATTRIBUTES:
+            raise AttributeError(name)
+        # only one thread connects, the others wait for it
+        with self.connect_lock:
+            if name not in self.__dict__:
+                self.connect()
+        return self.__dict__[name]
+
+    def connect(self) -> None:
+        """Method that connects to the database and starts the index verification in the background."""
+        # connect to the database through the configured backend
+        self.connection = open_connection(self.settings or load_settings())
         # get the client object
         self.client = self.connection.getClient()
         # get the database object
@@ -21,28 +92,56 @@ class BookDAO:
         # get the collection objects
         self.publisherCollection = self.connection.getPublisherCollection()
         self.bookCollection = self.connection.getBookCollection()
-        # create the indexes
-        self.create_indexes()
+        # create the index manager
+        self.indexes = IndexManager(self.db, self.bookCollection, self.publisherCollection)
+        timing.mark('connected')
+        # load the replica in the background, the searches using the server until it is ready
+        if self.replica:
+            self.replica.start(self.bookCollection)
+        # apply the index spec if it is out of date, without delaying the queries that do not need it
+        if self.verify_indexes:
+            self.index_thread = Thread(target=self._verify_indexes, daemon=True)
+            self.index_thread.start()
+
+    def _verify_indexes(self) -> None:
+        """Method that applies the index spec in the background, keeping its warning if it fails."""
+        result = self.create_indexes()
+        if Format.is_warning(result):
+            self.index_warning = result
+
+    def wait_for_indexes(self, timeout: float = None) -> str or None:
+        """Method that waits for the background index verification, at most 'timeout' seconds, and returns its warning once if it failed."""
+        if self.index_thread is not None:
+            self.index_thread.join(timeout)
+        warning, self.index_warning = self.index_warning, None
+        return warning
+
+    def _indexes_built(self) -> None:
+        """Method that waits for the background index verification before a query that needs the declared indexes."""
+        if self.index_thread is not None:
+            self.index_thread.join()
     
-    def create_indexes(self) -> None:
-        """Method that creates indexes for the database."""
-        # create the indexes
-        self.bookCollection.create_index('ISBN')
-        self.bookCollection.create_index('title')
-        self.bookCollection.create_index('published_by')
-        self.bookCollection.create_index('price')
-        self.bookCollection.create_index('year')
+    def _index_names(self) -> set:
+        """Method that returns the names of the book indexes, listed once and again after the indexes change."""
+        if self.index_names is None:
+            self.index_names = set(self.bookCollection.index_information())
+        return self.index_names
+
+    def create_indexes(self, force: bool = False, progress = None) -> str:
+        """Method that applies the declared indexes to the database if they are not applied yet."""
+        # apply the index spec (a no-op when the recorded version is current), listing the indexes again afterwards
+        result = self.indexes.apply(force, progress)
+        self.index_names = None
+        return result
     
     def delete_indexes(self) -> None:
         """Method that deletes indexes for the database."""
-        # delete the indexes
-        self.bookCollection.drop_index('ISBN_1')
-        self.bookCollection.drop_index('title_1')
-        self.bookCollection.drop_index('published_by_1')
-        self.bookCollection.drop_index('price_1')
-        self.bookCollection.drop_index('year_1')
+        # delete the declared indexes
+        self.indexes.drop()
+        self.index_names = None
     
-    def add_publisher(self, name: str, phone: str, city: str) -> str:
+    @instrumented
+    def add_publisher(self, name: str, phone: str, city: str) -> str or Future:
         """Method that adds a new publisher to the database."""
         # create the document
         publisher = {
@@ -50,20 +149,36 @@ class BookDAO:
             'phone': phone,
             'city': city,
         }
+        # queue the insert when writes are batched, counting the publisher as added until it fails
+        if self.writer:
+            self.publishers.add(name)
+            return self._submit(self.publisherCollection, InsertOne(publisher), Format.info(f'Publisher {name} added successfully.'), lambda ok: ok or self.publishers.invalidate())
         # try inserting the publisher
         try:
             self.publisherCollection.insert_one(publisher)
+            self.publishers.add(name)
             return Format.info(f'Publisher {name} added successfully.')
         except Exception as e:
-            return Format.warning(str(e).split(' ', 2)[2])
+            return self._failure(e, str(e).split(' ', 2)[2])
     
-    def add_book(self, ISBN: str, title: str, year: int, published_by: str, previous_edition: str, price: float) -> str:
+    @instrumented
+    def add_book(self, ISBN: str, title: str, year: int, published_by: str, previous_edition: str, price: float) -> str or Future:
         """Method that adds a new book to the database."""
+        # validate the ISBNs and compute the canonical ISBN-13 key
+        try:
+            ISBN13 = normalize_isbn(ISBN)
+            previous_edition = normalize_isbn(previous_edition) if previous_edition else previous_edition
+        except ValueError as e:
+            return Format.warning(str(e))
+        # check that the publisher exists
+        if (message := self._check_publisher(published_by)):
+            return message
         # round the price to 2 decimal places
         price = round(price, 2) if price else price
         # create the document
         book = {
             'ISBN': ISBN,
+            'ISBN13': ISBN13,
             'title': title,
             'year': year,
             'published_by': published_by,
@@ -72,22 +187,39 @@ class BookDAO:
         # if the book has a previous edition, add it to the document
         if previous_edition:
             book['previous_edition'] = previous_edition
+        # queue the insert when writes are batched
+        if self.writer:
+            return self._submit(self.bookCollection, InsertOne(book), Format.info(f'Book {title} added successfully.'), lambda ok: ok and self._written(book))
         # try inserting the book
         try:
             self.bookCollection.insert_one(book)
+            self._invalidate(book=book)
+            self.schema.observe(book)
             return Format.info(f'Book {title} added successfully.')
         except Exception as e:
-            return Format.warning(str(e).split(' ', 2)[2])
+            return self._failure(e, str(e).split(' ', 2)[2])
     
-    def edit_book(self, ISBN: str, title: str, year: int, published_by: str, previous_edition: str, price: float) -> str:
-        """Method that edits a book in the database."""
+    @instrumented
+    def edit_book(self, ISBN: str, title: str, year: int, published_by: str, previous_edition: str, price: float, version: int = None, return_book: bool = False) -> str or dict or Future:
+        """Method that edits a book in the database, only if it is still at 'version' when one is given, and returns the edited book if 'return_book' is set."""
         # if no changes were made, return a warning message
         if not any([title, year, published_by, previous_edition, price]):
             return Format.warning('No changes were made.')
+        # validate the ISBNs, a legacy ISBN that fails validation being looked up by its legacy key
+        ISBN13, invalid = self._lookup_key(ISBN)
+        try:
+            previous_edition = normalize_isbn(previous_edition) if previous_edition else previous_edition
+        except ValueError as e:
+            return Format.warning(str(e))
+        # check that the new publisher exists
+        if published_by and (message := self._check_publisher(published_by)):
+            return message
         # round the price to 2 decimal places
         price = round(price, 2) if price else price
-        # create the filter
-        fltr = {'ISBN': ISBN}
+        # create the filter, which only matches the expected version (books never edited have none, i.e. version 0)
+        fltr = {'ISBN13': ISBN13}
+        if version is not None:
+            fltr['version'] = int(version) if version else {'$in': [0, None]}
         # create the document
         book = {}
         # if the book has a title, add it to the document
@@ -105,147 +237,593 @@ class BookDAO:
         # if the book has a price, add it to the document
         if price:
             book['price'] = price
-        # create the action
-        action = {'$set': book}
-        # try updating the book
+        # create the action, every edit moving the book to its next version
+        action = {'$set': book, '$inc': {'version': 1}}
+        # queue the update when writes are batched, unless a version must be checked, which needs the edit's own result
+        if self.writer and version is None:
+            return self._submit(self.bookCollection, UpdateOne(fltr, action), Format.info(f'Book {ISBN} edited successfully.'), lambda ok: ok and self._written(book, ISBN13))
+        # try updating the book, getting the edited book back in the same round trip
         try:
-            self.bookCollection.update_one(fltr, action)
-            return Format.info(f'Book {ISBN} edited successfully.')
+            # a versioned edit comes after the writes queued before it
+            if self.writer:
+                self.writer.flush()
+            edited = self.bookCollection.find_one_and_update(fltr, action, {'_id': 0, 'ISBN13': 0}, return_document=ReturnDocument.AFTER)
+            if edited is None:
+                return self._edit_failed(ISBN, ISBN13, version, invalid)
+            self._invalidate(book=book, ISBN13=ISBN13)
+            self.schema.observe(edited)
+            return edited if return_book else Format.info(f'Book {ISBN} edited successfully (version {edited["version"]}).')
         except Exception as e:
-            return Format.warning(str(e).split(' ', 2)[2])
+            return self._failure(e, str(e).split(' ', 2)[2])
 
-    def delete_book(self, ISBN) -> str:
+    def _edit_failed(self, ISBN: str, ISBN13: str, version: int or None, invalid: str = None) -> str:
+        """Method that tells whether an edit matched nothing because the book is missing or because it was edited by someone else."""
+        # without a version the only reason is a missing book, so no query is needed
+        current = self.bookCollection.find_one({'ISBN13': ISBN13}, {'_id': 0, 'version': 1}) if version is not None else None
+        if current is None:
+            return invalid or Format.warning(f'Book {ISBN} not found.')
+        # a cached copy of the book is older than the version that won
+        self._invalidate(ISBN13=ISBN13)
+        return Format.warning(f'Book {ISBN} was edited by someone else (now at version {current.get("version", 0)}, expected {version}). Search it again and retry.')
+
+    @instrumented
+    def delete_book(self, ISBN) -> str or Future:
         """Method that deletes a book from the database."""
+        # validate the ISBN, a legacy ISBN that fails validation being looked up by its legacy key
+        ISBN13, invalid = self._lookup_key(ISBN)
         # create the filter
-        fltr = {'ISBN': ISBN}
+        fltr = {'ISBN13': ISBN13}
+        # queue the delete when writes are batched
+        if self.writer:
+            return self._submit(self.bookCollection, DeleteOne(fltr), Format.info(f'Book {ISBN} deleted successfully.'), lambda ok: ok and self._invalidate(ISBN13=ISBN13))
         # try deleting the book
         try:
-            self.bookCollection.delete_one(fltr)
+            if not self.bookCollection.delete_one(fltr).deleted_count and invalid:
+                return invalid
+            self._invalidate(ISBN13=ISBN13)
             return Format.info(f'Book {ISBN} deleted successfully.')
         except Exception as e:
-            return Format.warning(str(e).split(' ', 2)[2])
+            return self._failure(e, str(e).split(' ', 2)[2])
 
-    def search_all_books(self) -> list or str:
+    @instrumented
+    def search_all_books(self, page_size: int = 0, batch_size: int = BATCH_SIZE) -> list or BookPager or str:
         """Method that searches all books in the database."""
         # create the filter
         fltr = {}
         # create the projection
-        prj = {'_id': 0}
+        prj = {'_id': 0, 'ISBN13': 0}
+        # answer from the replica once it is loaded
+        if self.replica and (books := self.replica.all()) is not None:
+            return self._local(books, page_size)
         # try executing the query
         try:
-            return list(self.bookCollection.find(fltr, prj))
+            return self._find(fltr, prj, page_size, batch_size, cache_key=('all',), matcher=lambda book: True)
         except Exception as e:
-            return Format.warning(str(e).split(' ', 2)[2])
+            return self._failure(e, str(e).split(' ', 2)[2])
 
-    def search_books_by_title(self, title: str) -> list or str:
-        """Method that searches books by title in the database."""
-        # create the regex
-        regex = Regex(f'.*{title}.*', 'i')
+    @instrumented
+    def search_books_by_title(self, title: str, limit: int = SEARCH_LIMIT, page_size: int = 0, batch_size: int = BATCH_SIZE) -> list or BookPager or str:
+        """Method that searches books by title keywords in the database, best matches first."""
         # create the filter
-        fltr = {'title': regex}
+        fltr = {'$text': {'$search': title}}
         # create the projection
-        prj = {'_id': 0}
+        prj = {'_id': 0, 'ISBN13': 0}
         # try executing the query
         try:
-            # explain the query
-            print(self.bookCollection.find(fltr, prj).explain()['queryPlanner']['winningPlan'])
-            return list(self.bookCollection.find(fltr, prj))
+            key = ('title', self._keywords_key(title), limit)
+            return self._find(fltr, prj, page_size, batch_size, TEXT_SCORE_SORT, limit, key, self._text_matcher)
         except Exception as e:
-            return Format.warning(str(e).split(' ', 2)[2])
+            return self._failure(e, str(e).split(' ', 2)[2])
 
+    @instrumented
     def search_books_by_ISBN(self, ISBN: str) -> list or str:
-        """Method that searches books by ISBN in the database."""
-        # create the regex
-        regex = Regex(f'^{ISBN}$', 'i')
+        """Method that searches books by ISBN-10 or ISBN-13 in the database."""
+        # validate the ISBN, a legacy ISBN that fails validation being looked up by its legacy key
+        ISBN13, invalid = self._lookup_key(ISBN)
         # create the filter
-        fltr = {'ISBN': regex}
+        fltr = {'ISBN13': ISBN13}
         # create the projection
-        prj = {'_id': 0}
+        prj = {'_id': 0, 'ISBN13': 0}
+        # answer from the replica once it is loaded
+        if self.replica and (books := self.replica.by_isbn(ISBN13)) is not None:
+            return books or invalid or []
+        # try the cache first
+        key = ('ISBN', ISBN13)
+        if self.cache and (cached := self.cache.get(key)) is not None:
+            return cached
+        generation = self.cache.current_generation() if self.cache else None
         # try executing the query
         try:
-            return [self.bookCollection.find_one(fltr, prj)]
+            start = perf_counter()
+            book = self.bookCollection.find_one(fltr, prj)
+            if self.metrics:
+                self.metrics.record_query(self.bookCollection, fltr, None, 1, perf_counter() - start)
+            result = [book] if book else []
+            if invalid and not result:
+                return invalid
+            if self.cache:
+                self.cache.put(key, result, lambda book: book.get('ISBN13') == ISBN13, {ISBN13}, {book['published_by']} if book else set(), generation)
+            return result
         except Exception as e:
-            return Format.warning(str(e).split(' ', 2)[2])
+            return self._failure(e, str(e).split(' ', 2)[2])
 
-    def search_books_by_publisher(self, published_by: str) -> list or str:
-        """Method that searches books by publisher in the database."""
-        # create the regex
-        regex = Regex(f'.*{published_by}.*', 'i')
-        # create the filter
-        fltr = {'published_by': regex}
+    @instrumented
+    def search_books_by_publisher(self, published_by: str, limit: int = SEARCH_LIMIT, page_size: int = 0, batch_size: int = BATCH_SIZE) -> list or BookPager or str:
+        """Method that searches books by publisher keywords in the database, best matches first."""
+        # create the filter, keeping only text matches that come from the publisher field
+        fltr = {'$text': {'$search': published_by}, 'published_by': self._keywords_regex(published_by)}
         # create the projection
-        prj = {'_id': 0}
+        prj = {'_id': 0, 'ISBN13': 0}
         # try executing the query
         try:
-            return list(self.bookCollection.find(fltr, prj))
+            key = ('publisher', self._keywords_key(published_by), limit)
+            return self._find(fltr, prj, page_size, batch_size, TEXT_SCORE_SORT, limit, key, self._text_matcher)
         except Exception as e:
-            return Format.warning(str(e).split(' ', 2)[2])
+            return self._failure(e, str(e).split(' ', 2)[2])
 
-    def search_books_by_price_range(self, min: float, max: float) -> list or str:
+    @instrumented
+    def search_books_by_price_range(self, min: float, max: float, page_size: int = 0, batch_size: int = BATCH_SIZE) -> list or BookPager or str:
         """Method that searches books by price range in the database."""
         # create the filter
         fltr = {'price': {'$gte': min, '$lte': max}}
         # create the projection
-        prj = {'_id': 0}
+        prj = {'_id': 0, 'ISBN13': 0}
+        # answer from the replica once it is loaded
+        if self.replica and (books := self.replica.by_price(min, max)) is not None:
+            return self._local(books, page_size)
         # try executing the query
         try:
-            return list(self.bookCollection.find(fltr, prj))
+            key = ('price', round(min, 2), round(max, 2))
+            matcher = lambda book: book.get('price') is not None and min <= book['price'] <= max
+            return self._find(fltr, prj, page_size, batch_size, cache_key=key, matcher=matcher)
         except Exception as e:
-            return Format.warning(str(e).split(' ', 2)[2])
+            return self._failure(e, str(e).split(' ', 2)[2])
 
-    def search_books_by_year(self, year: int) -> list or str:
+    @instrumented
+    def search_books_by_year(self, year: int, page_size: int = 0, batch_size: int = BATCH_SIZE) -> list or BookPager or str:
         """Method that searches books by year in the database."""
         # create the filter
         fltr = {'year': year}
         # create the projection
-        prj = {'_id': 0}
+        prj = {'_id': 0, 'ISBN13': 0}
+        # answer from the replica once it is loaded
+        if self.replica and (books := self.replica.by_year(year, year)) is not None:
+            return self._local(books, page_size)
         # try executing the query
         try:
-            return list(self.bookCollection.find(fltr, prj))
+            return self._find(fltr, prj, page_size, batch_size, cache_key=('year', year), matcher=lambda book: book.get('year') == year)
         except Exception as e:
-            return Format.warning(str(e).split(' ', 2)[2])
+            return self._failure(e, str(e).split(' ', 2)[2])
 
-    def search_books_by_title_and_publisher(self, title: str, publisher: str) -> list or str:
-        """Method that searches books by title and publisher in the database."""
-        # create the regex
-        regex_title = Regex(f'.*{title}.*', 'i')
-        regex_publisher = Regex(f'.*{publisher}.*', 'i')
+    @instrumented
+    def search_books_by_title_and_publisher(self, title: str, publisher: str, limit: int = SEARCH_LIMIT, page_size: int = 0, batch_size: int = BATCH_SIZE) -> list or BookPager or str:
+        """Method that searches books by title keywords and publisher in the database, best matches first."""
         # create the filter
-        fltr = {'title': regex_title, 'published_by': regex_publisher}
+        fltr = {'$text': {'$search': title}, 'published_by': self._keywords_regex(publisher)}
         # create the projection
-        prj = {'_id': 0}
+        prj = {'_id': 0, 'ISBN13': 0}
         # try executing the query
         try:
-            return list(self.bookCollection.find(fltr, prj))
+            key = ('title_and_publisher', self._keywords_key(title), self._keywords_key(publisher), limit)
+            return self._find(fltr, prj, page_size, batch_size, TEXT_SCORE_SORT, limit, key, self._text_matcher)
         except Exception as e:
-            return Format.warning(str(e).split(' ', 2)[2])
+            return self._failure(e, str(e).split(' ', 2)[2])
 
-    def delete_publisher(self, name: str) -> str:
-        """Method that deletes a publisher from the database."""
-        # create the filter
+    @instrumented
+    def search_books(self, criteria: dict, sort: list = None, limit: int = 0, projection: list = None, page_size: int = 0, batch_size: int = BATCH_SIZE) -> list or BookPager or str:
+        """Method that searches books matching every given criterion in a single server-side query."""
+        # create the filter, sort and projection
+        try:
+            criteria = clean_criteria(criteria)
+            fltr = build_filter(criteria)
+            sort = build_sort(sort, criteria)
+            prj = build_projection(projection)
+        except ValueError as e:
+            return Format.warning(str(e))
+        # try executing the query on the index that serves the most criteria
+        try:
+            # answer from the replica once it is loaded, unless title keywords need the text index
+            if self.replica and (books := self.replica.find(fltr, sort, limit, projection)) is not None:
+                return self._local(books, page_size)
+            # projected results may lack the ISBN and publisher the invalidation relies on, so they are not cached
+            key = None if projection else ('criteria', tuple(sorted((field, str(value)) for field, value in criteria.items())), str(sort), limit)
+            return self._find(fltr, prj, page_size, batch_size, sort, limit, key, build_matcher(criteria, fltr), choose_index(criteria))
+        except Exception as e:
+            return self._failure(e, str(e).split(' ', 2)[2])
+
+    @instrumented
+    def search_books_with_publishers(self, criteria: dict = None, sort: list = None, limit: int = SEARCH_LIMIT) -> list or str:
+        """Method that searches books by any combination of criteria and returns each one with the details of its publisher."""
+        # validate the criteria and build the pipeline
+        try:
+            criteria = clean_criteria(criteria or {})
+            pipeline = build_publisher_join(build_filter(criteria), self.publisherCollection.name, build_sort(sort, criteria), limit)
+        except ValueError as e:
+            return Format.warning(str(e))
+        # title keywords need the text index
+        if 'title' in criteria:
+            self._indexes_built()
+        return self._aggregate(pipeline)
+
+    @instrumented
+    def search_books_by_publisher_details(self, city: str = None, phone: str = None, limit: int = 0) -> list or str:
+        """Method that searches the books of the publishers in a city and/or with a phone number, with the publisher details."""
+        # create the publisher filter
+        fltr = {field: value for field, value in zip(PUBLISHER_FIELDS, (city, phone)) if value}
+        if not fltr:
+            return Format.warning('A city or a phone number is needed.')
+        # start from the publishers, which use the city index, then join their books on the published_by index
+        try:
+            return list(self.publisherCollection.aggregate(build_publisher_books(fltr, self.bookCollection.name, limit), allowDiskUse=True))
+        except Exception as e:
+            return self._failure(e)
+
+    def _check_publisher(self, published_by: str) -> str or None:
+        """Method that returns a warning if the publisher of a book does not exist, using the in-memory publisher names."""
+        if not self.validate_publishers:
+            return None
+        try:
+            if self.publishers.exists(self.publisherCollection, published_by):
+                return None
+        except Exception as e:
+            return self._failure(e)
+        return Format.warning(f'Publisher {published_by} does not exist.')
+
+    @instrumented
+    def get_edition_chain(self, ISBN: str, depth: int = EDITION_DEPTH, direction: str = 'both') -> list or str:
+        """Method that returns the editions of a book, oldest first, following previous_edition in one query."""
+        # validate the ISBN and build the pipeline, a legacy ISBN that fails validation being looked up by its legacy key
+        ISBN13, invalid = self._lookup_key(ISBN)
+        try:
+            pipeline = build_edition_chain(ISBN13, self.bookCollection.name, depth, direction)
+        except ValueError as e:
+            return Format.warning(str(e))
+        # try executing the query
+        try:
+            result = list(self.bookCollection.aggregate(pipeline))
+        except Exception as e:
+            return self._failure(e)
+        return order_edition_chain(result[0]) if result else invalid or []
+
+    def _find(self, fltr: dict, prj: dict, page_size: int, batch_size: int, sort: list = None, limit: int = 0, cache_key: tuple = None, matcher = None, hint: str = None) -> list or BookPager:
+        """Method that runs a book query, returning a pager if 'page_size' is set and a (possibly cached) list otherwise."""
+        # text queries need the text index, and hinted queries the index they name
+        if '$text' in fltr or hint:
+            self._indexes_built()
+        # a hint naming a missing index fails the query, so the server picks the index then
+        if hint and hint not in self._index_names():
+            hint = None
+        # page through the results without materializing them
+        if page_size:
+            return BookPager(self.bookCollection, fltr, prj, page_size, batch_size, sort, limit, self.metrics)
+        # try the cache first
+        use_cache = self.cache is not None and cache_key is not None
+        if use_cache and (cached := self.cache.get(cache_key)) is not None:
+            return cached
+        generation = self.cache.current_generation() if use_cache else None
+        # text queries are sorted by the text score, which is never projected into the results
+        start = perf_counter()
+        cursor = self.bookCollection.find(fltr, prj, batch_size=batch_size)
+        cursor = cursor.sort(sort) if sort else cursor
+        cursor = cursor.hint(hint) if hint else cursor
+        # a limit of 0 returns every match
+        result = list(cursor.limit(limit))
+        if self.metrics:
+            self.metrics.record_query(self.bookCollection, fltr, sort, limit, perf_counter() - start)
+        # cache the result along with the books and publishers it holds
+        if use_cache:
+            isbns = {self._isbn_key(book.get('ISBN')) for book in result}
+            publishers = {book.get('published_by') for book in result}
+            self.cache.put(cache_key, result, matcher, isbns, publishers, generation)
+        return result
+
+    @staticmethod
+    def _local(books: list, page_size: int) -> list or ListPager:
+        """Method that returns results answered by the replica, paged in memory if 'page_size' is set."""
+        return ListPager(books, page_size) if page_size else books
+
+    def _submit(self, collection, operation, message: str, done) -> Future:
+        """Method that queues a write in the write-behind batch and calls 'done' with its success once it is written."""
+        future = self.writer.submit(collection, operation, message)
+        future.add_done_callback(lambda future: done(not Format.is_warning(future.result())))
+        return future
+
+    def _written(self, book: dict, ISBN13: str = None) -> None:
+        """Method that updates the cache and the schema catalog after a batched book write."""
+        self._invalidate(book=book, ISBN13=ISBN13)
+        self.schema.observe(book)
+
+    def flush(self) -> None:
+        """Method that writes the batched writes now."""
+        if self.writer:
+            self.writer.flush()
+
+    def _invalidate(self, book: dict = None, ISBN13: str = None, publisher: str = None) -> None:
+        """Method that drops the cached results a write could have changed."""
+        if self.cache:
+            self.cache.invalidate(book, ISBN13, publisher)
+
+    @staticmethod
+    def _isbn_key(ISBN: str) -> str or None:
+        """Method that returns the lookup key of a stored ISBN, or None if there is none."""
+        return isbn_key(ISBN) if ISBN is not None else None
+
+    @staticmethod
+    def _failure(e: Exception, message: str = None) -> str:
+        """Method that turns an exception into a warning if the database refused the operation, or an error if it failed to carry it out."""
+        # e.g. duplicate keys and invalid queries are refused, while lost connections, timeouts and bugs are failures
+        refused = isinstance(e, OperationFailure) and not isinstance(e, (ExecutionTimeout, WriteConcernError))
+        return (Format.warning if refused else Format.error)(message if message is not None else str(e))
+
+    @staticmethod
+    def _lookup_key(ISBN: str) -> tuple:
+        """Method that returns the key to look an ISBN up by and, if the ISBN fails validation, the warning returned when no legacy book has it."""
+        try:
+            return normalize_isbn(ISBN), None
+        except ValueError as e:
+            return isbn_key(ISBN), Format.warning(str(e))
+
+    @staticmethod
+    def _keywords_key(keywords: str) -> str:
+        """Method that normalizes search keywords for use in a cache key."""
+        return ' '.join(keywords.lower().split())
+
+    @staticmethod
+    def _text_matcher(book: dict) -> bool:
+        """Method that checks whether a written book could enter a text search result."""
+        # stemming makes an exact check impractical, so any write to an indexed field counts
+        return 'title' in book or 'published_by' in book
+
+    def iter_books(self, fltr: dict = None, batch_size: int = BATCH_SIZE):
+        """Method that streams the books matching a filter, fetching them in batches of 'batch_size'."""
+        return iter(BookPager(self.bookCollection, fltr or {}, {'_id': 0, 'ISBN13': 0}, batch_size=batch_size))
+
+    @staticmethod
+    def _keywords_regex(keywords: str) -> Regex:
+        """Method that creates a case-insensitive regex matching any of the keywords."""
+        # only applied to the documents the text index already matched
+        return Regex('|'.join(re.escape(word) for word in keywords.split()), 'i')
+
+    @instrumented
+    def delete_publisher(self, name: str, cascade: str = None, reassign_to: str = None, transaction: bool = False) -> str:
+        """Method that deletes a publisher from the database, and optionally deletes its books or reassigns them to another publisher."""
+        # the writes queued before are applied first, so the checks and the cascade see their books and publishers
+        try:
+            self.flush()
+        except Exception as e:
+            return self._failure(e)
+        # validate the cascade
+        if cascade is not None and cascade not in CASCADE_MODES:
+            return Format.warning(f'Unknown cascade mode: {cascade}.')
+        if cascade == 'reassign':
+            if not reassign_to or reassign_to == name:
+                return Format.warning('The books must be reassigned to another publisher.')
+            if (message := self._check_publisher(reassign_to)):
+                return message
+        # create the filters
         fltr = {'name': name}
-        # try deleting the publisher
+        books = {'published_by': name}
+        # the books are handled first, so a failure never leaves them without their publisher
+        def delete(session = None) -> int:
+            moved = 0
+            if cascade == 'delete':
+                moved = self.bookCollection.delete_many(books, session=session).deleted_count
+            elif cascade == 'reassign':
+                moved = self.bookCollection.update_many(books, {'$set': {'published_by': reassign_to}}, session=session).modified_count
+            self.publisherCollection.delete_one(fltr, session=session)
+            return moved
+        # try deleting the publisher, in one transaction if asked (which needs a replica set)
+        try:
+            if transaction:
+                with self.client.start_session() as session:
+                    moved = session.with_transaction(delete)
+            else:
+                moved = delete()
+        except Exception as e:
+            return self._failure(e)
+        self.publishers.remove(name)
+        self._invalidate(publisher=name)
+        if cascade == 'reassign':
+            self._invalidate(book={'published_by': reassign_to})
+        if cascade == 'delete':
+            return Format.info(f'Publisher {name} and its {moved} books deleted successfully.')
+        if cascade == 'reassign':
+            return Format.info(f'Publisher {name} deleted successfully, {moved} books reassigned to {reassign_to}.')
+        return Format.info(f'Publisher {name} deleted successfully.')
+
+    @instrumented
+    def sweep_orphans(self, mode: str = 'report', reassign_to: str = None, batch_size: int = SWEEP_BATCH_SIZE, progress = None) -> dict or str:
+        """Method that finds the books whose publisher does not exist and reports, deletes or reassigns them in batches of publisher names."""
+        # the writes queued before are applied first, so the checks and the sweep see their books and publishers
+        try:
+            self.flush()
+        except Exception as e:
+            return self._failure(e)
+        # validate the mode
+        if mode not in SWEEP_MODES:
+            return Format.warning(f'Unknown sweep mode: {mode}.')
+        if mode == 'reassign' and (message := self._check_publisher(reassign_to or '')):
+            return message
+        # find the missing publishers on the server: one group per publisher name, joined with the publishers
+        pipeline = [
+            {'$group': {'_id': '$published_by', 'books': {'$sum': 1}}},
+            {'$lookup': {'from': self.publisherCollection.name, 'localField': '_id', 'foreignField': 'name', 'as': 'publisher'}},
+            {'$match': {'publisher': {'$size': 0}}},
+            {'$project': {'publisher': 0}},
+            {'$sort': {'_id': 1}},
+        ]
+        report = {'mode': mode, 'publishers': {}, 'books': 0, 'fixed': 0}
+        try:
+            for orphan in self.bookCollection.aggregate(pipeline, allowDiskUse=True):
+                report['publishers'][orphan['_id']] = orphan['books']
+                report['books'] += orphan['books']
+            if mode == 'report':
+                return report
+            # fix the books of 'batch_size' missing publishers per write
+            names = list(report['publishers'])
+            for i in range(0, len(names), batch_size):
+                batch = names[i:i + batch_size]
+                books = {'published_by': {'$in': batch}}
+                if mode == 'delete':
+                    report['fixed'] += self.bookCollection.delete_many(books).deleted_count
+                else:
+                    report['fixed'] += self.bookCollection.update_many(books, {'$set': {'published_by': reassign_to}}).modified_count
+                for name in batch:
+                    self._invalidate(publisher=name)
+                if progress:
+                    progress(report)
+        except Exception as e:
+            return self._failure(e)
+        if mode == 'reassign':
+            self._invalidate(book={'published_by': reassign_to})
+        return report
+
+    @instrumented
+    def import_books(self, rows, batch_size: int = IMPORT_BATCH_SIZE, start: int = 0, progress = None) -> dict:
+        """Method that bulk inserts validated book rows, skipping the first 'start' rows."""
+        # the fields of every imported book are added to the schema catalog
+        def validate(row: dict) -> dict:
+            book = validate_book(row)
+            self.schema.observe(book)
+            return book
+        report = self._import(self.bookCollection, rows, validate, batch_size, start, progress)
+        # any cached result may now be missing books
+        if self.cache:
+            self.cache.clear()
+        return report
+
+    @instrumented
+    def import_publishers(self, rows, batch_size: int = IMPORT_BATCH_SIZE, start: int = 0, progress = None) -> dict:
+        """Method that bulk inserts validated publisher rows, skipping the first 'start' rows."""
+        report = self._import(self.publisherCollection, rows, validate_publisher, batch_size, start, progress)
+        # the imported names are loaded with the others on the next check
+        self.publishers.invalidate()
+        return report
+
+    def _import(self, collection, rows, validate, batch_size: int, start: int, progress) -> dict:
+        """Method that streams rows into a collection with unordered batched inserts and reports the rejected rows."""
+        # 'offset' counts the rows fully handled, so a failed import can resume from it
+        report = {'inserted': 0, 'rejected': [], 'offset': start, 'error': None}
+        batch, numbers, raw = [], [], []
+        last = start
         try:
-            self.publisherCollection.delete_one(fltr)
-            return Format.info(f'Publisher {name} deleted successfully.')
+            for number, row in enumerate(rows, 1):
+                if number <= start:
+                    continue
+                last = number
+                # parse and validate the row, recording the reason if it is rejected
+                try:
+                    batch.append(validate(parse_row(row)))
+                    numbers.append(number)
+                    raw.append(row)
+                except ValueError as e:
+                    report['rejected'].append((number, str(e), row))
+                if len(batch) == batch_size:
+                    self._insert_batch(collection, batch, numbers, raw, report)
+                    report['offset'] = number
+                    batch, numbers, raw = [], [], []
+                    if progress:
+                        progress(report)
+            if batch:
+                self._insert_batch(collection, batch, numbers, raw, report)
+            # every row was handled once the input is exhausted
+            report['offset'] = last
         except Exception as e:
-            return Format.warning(str(e).split(' ', 2)[2])
+            report['error'] = str(e)
+        if progress:
+            progress(report)
+        return report
 
+    @staticmethod
+    def _insert_batch(collection, batch: list, numbers: list, raw: list, report: dict) -> None:
+        """Method that inserts a batch without stopping at errors, recording the rows the server rejected."""
+        try:
+            report['inserted'] += len(collection.insert_many(batch, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            # duplicate keys and other per-document errors only reject their own rows
+            errors = e.details.get('writeErrors', [])
+            report['inserted'] += e.details.get('nInserted', len(batch) - len(errors))
+            for error in errors:
+                index = error['index']
+                report['rejected'].append((numbers[index], error.get('errmsg', 'Write error.'), raw[index]))
+
+    @instrumented
+    def export_books(self, out_dir: str, fmt: str = 'jsonl', partitions: int = 1, workers: int = EXPORT_WORKERS) -> dict or str:
+        """Method that exports the books collection to sharded files and returns the manifest."""
+        try:
+            return export_collection(self.bookCollection, out_dir, fmt, partitions, workers)
+        except Exception as e:
+            return self._failure(e)
+
+    @instrumented
+    def export_publishers(self, out_dir: str, fmt: str = 'jsonl', partitions: int = 1, workers: int = EXPORT_WORKERS) -> dict or str:
+        """Method that exports the publishers collection to sharded files and returns the manifest."""
+        try:
+            return export_collection(self.publisherCollection, out_dir, fmt, partitions, workers)
+        except Exception as e:
+            return self._failure(e)
+
+    @instrumented
+    def report_books_per_publisher(self, limit: int = 0) -> list or str:
+        """Method that counts the books and averages the prices of each publisher on the server."""
+        return self._aggregate(books_per_publisher(limit))
+
+    @instrumented
+    def report_books_per_city(self) -> list or str:
+        """Method that counts the books and publishers of each publisher city on the server."""
+        return self._aggregate(books_per_city(self.publisherCollection.name))
+
+    @instrumented
+    def report_price_by_year(self, percentiles: tuple = PERCENTILES) -> list or str:
+        """Method that computes the price statistics and percentiles of each year on the server."""
+        return self._aggregate(price_by_year(percentiles))
+
+    @instrumented
+    def report_price_histogram(self, boundaries: list = None) -> dict or str:
+        """Method that computes the overall price statistics and the number of books in each price range on the server."""
+        result = self._aggregate(price_histogram(boundaries))
+        if type(result) == str:
+            return result
+        facets = result[0]
+        return {'stats': facets['stats'][0] if facets['stats'] else {}, 'buckets': format_buckets(facets['buckets'], boundaries)}
+
+    def _aggregate(self, pipeline: list) -> list or str:
+        """Method that runs an aggregation on the books, letting big groups spill to disk on the server."""
+        try:
+            return list(self.bookCollection.aggregate(pipeline, allowDiskUse=True))
+        except Exception as e:
+            return self._failure(e)
+
+    @instrumented
     def get_fields(self) -> list or str:
-        """Method that describes the books collection."""
-        # create a filter
-        fltr = {}
-        # create a projection
-        prj = {'_id': 0}
-        # try executing the query
+        """Method that describes the books collection from the cached schema catalog."""
+        # sample the collection only the first time
         try:
-            return list(self.bookCollection.find_one(fltr, prj).keys())
+            if not self.schema.loaded:
+                self.schema.load(self.bookCollection)
+            return self.schema.fields()
         except Exception as e:
-            return Format.warning(str(e).split(' ', 2)[2])
+            return self._failure(e, str(e).split(' ', 2)[2])
+
+    def get_schema(self) -> dict or str:
+        """Method that returns the fields of the books collection with the types seen for each."""
+        fields = self.get_fields()
+        return fields if type(fields) == str else self.schema.describe()
+
+    def refresh_schema(self) -> None:
+        """Method that makes the next get_fields sample the collection again, after it was changed outside the DAO."""
+        self.schema.invalidate()
 
     def close(self) -> None:
         """Method that exits the program."""
-        # delete indexes
-        self.delete_indexes()
-        # close the connection to the database
-        self.connection.close()
+        # write the batched writes before the connection is released
+        if self.writer:
+            self.writer.close()
+        # stop tailing the change stream before the connection is released
+        if self.replica:
+            self.replica.stop()
+        # let the index verification finish, so a migration is never cut short
+        self._indexes_built()
+        # close the connection to the database, if one was made
+        if 'connection' in self.__dict__:
+            self.connection.close()
@@ -0,0 +1,270 @@
+# IMPORTS
+
+from base64 import urlsafe_b64encode, urlsafe_b64decode
+from time import perf_counter
+from bson import json_util
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, DESCENDING
+
+
+
+# CONSTANTS
+
+PAGE_SIZE = 20
+BATCH_SIZE = 500
+# name the page fetches are recorded under in the metrics
+PAGE_METRIC = 'BookPager.page'
+
+
+
+# PAGER CLASS
+
+class BookPager:
+    """Class that pages through the results of a book query without loading them all into memory."""
+    def __init__(self, collection, fltr: dict, prj: dict, page_size: int = PAGE_SIZE, batch_size: int = BATCH_SIZE, sort: list = None, limit: int = 0, metrics = None):
+        """Constructor method."""
+        # store the query, and the metrics the page fetches are timed in
+        self.collection = collection
+        self.metrics = metrics
+        self.fltr = fltr
+        self.page_size = page_size
+        self.batch_size = batch_size
+        # queries are paged by keyset, on _id without an explicit sort and on (sort fields, _id) with one,
+        # except text score sorts, which cannot be filtered on and are paged by offset
+        self.sort = sort
+        self.limit = limit
+        # _id and the sort fields are needed as the keyset, so they are fetched and stripped from the results if not asked for
+        self.hidden = {'_id'} if prj.get('_id', 1) == 0 else set()
+        self.prj = {key: value for key, value in prj.items() if key != '_id'}
+        if self._keyset_sort():
+            inclusive = any(value for value in self.prj.values())
+            for field, direction in sort:
+                if inclusive and field not in self.prj:
+                    self.prj[field] = 1
+                    self.hidden.add(field)
+                elif not inclusive and field in self.prj:
+                    del self.prj[field]
+                    self.hidden.add(field)
+        self.prj = self.prj or None
+        # state of the current page
+        self.first_id, self.last_id = None, None
+        self.first_key, self.last_key = None, None
+        self.offset = 0
+        self.page_number = 0
+        self.more = True
+
+    def __iter__(self):
+        """Method that streams every result of the query, fetching them in batches of 'batch_size'."""
+        cursor = self.collection.find(self.fltr, self.prj, batch_size=self.batch_size)
+        cursor = cursor.sort(self.sort) if self.sort else cursor
+        for book in cursor.limit(self.limit):
+            yield self._strip(book)
+
+    def has_next(self) -> bool:
+        """Method that checks whether there is a page after the current one."""
+        return self.more
+
+    def has_previous(self) -> bool:
+        """Method that checks whether there is a page before the current one."""
+        return self.page_number > 1
+
+    def next_page(self) -> list:
+        """Method that returns the page after the current one."""
+        # past the last page there is nothing left to fetch
+        if not self.more and self.page_number > 0:
+            return []
+        offset = self.offset + self.page_size * (self.page_number > 0)
+        if self._keyset_sort():
+            books = self._sorted_page(offset, self.last_key, ASCENDING)
+        elif self.sort:
+            books = self._offset_page(offset)
+        else:
+            books = self._keyset_page(self.last_id, '$gt', ASCENDING)
+        self.page_number += 1
+        return self._finish(books)
+
+    def previous_page(self) -> list:
+        """Method that returns the page before the current one."""
+        # on the first page there is nothing before it, so the first page is fetched again
+        if not self.has_previous():
+            self.first_id, self.last_id = None, None
+            self.first_key, self.last_key = None, None
+            self.offset = 0
+            self.page_number = 0
+            return self.next_page()
+        if self._keyset_sort():
+            # walk backwards from the first book of the current page
+            books = self._sorted_page(self.offset - self.page_size, self.first_key, DESCENDING)
+            self.more = True
+        elif self.sort:
+            books = self._offset_page(self.offset - self.page_size)
+        else:
+            # walk backwards from the first book of the current page, then restore ascending order
+            books = self._keyset_page(self.first_id, '$lt', DESCENDING)[::-1]
+            self.more = True
+        self.page_number -= 1
+        return self._finish(books)
+
+    def token(self) -> str or None:
+        """Method that returns a token from which another pager can resume after the current page, or None if it is the last page."""
+        if not self.more:
+            return None
+        if self._keyset_sort():
+            # the sort key of the last book, and the position of the next page for the query's limit
+            state = json_util.dumps({'offset': self.offset + self.page_size, 'after': list(self.last_key)})
+            return urlsafe_b64encode(state.encode('utf-8')).decode('ascii')
+        return str(self.offset + self.page_size) if self.sort else str(self.last_id)
+
+    def resume(self, token: str) -> None:
+        """Method that positions the pager so that the next page starts after the page the token was taken from."""
+        if self._keyset_sort():
+            state = json_util.loads(urlsafe_b64decode(token.encode('ascii')))
+            self.last_key = tuple(state['after'])
+            self.offset = int(state['offset']) - self.page_size
+        elif self.sort:
+            # offset pagination resumes at the offset of the next page
+            self.offset = int(token) - self.page_size
+        else:
+            self.last_id = ObjectId(token)
+        self.page_number = 1
+
+    def _keyset_sort(self) -> bool:
+        """Method that checks whether the query is sorted on fields, which can be paged by keyset."""
+        return bool(self.sort) and all(direction in (ASCENDING, DESCENDING) for field, direction in self.sort)
+
+    def _keyset_page(self, bound, operator: str, direction: int) -> list:
+        """Method that fetches a page of books whose _id lies past 'bound' in the given direction."""
+        # an extra book is fetched to find out whether another page follows
+        fltr = {'$and': [self.fltr, {'_id': {operator: bound}}]} if bound is not None else self.fltr
+        books = self._fetch(fltr, [('_id', direction)], self.page_size + 1)
+        if direction == ASCENDING:
+            self.more = len(books) > self.page_size
+        return books[:self.page_size]
+
+    def _sorted_page(self, offset: int, key: tuple or None, direction: int) -> list:
+        """Method that fetches the page of books starting at 'offset' in the query's sort order, right after the book whose (sort fields, _id) key is 'key', or right before it going back."""
+        self.offset = max(offset, 0)
+        # _id breaks the ties, and going back reverses every direction
+        sort = [(field, order * direction) for field, order in self.sort + [('_id', ASCENDING)]]
+        # never page past the query's own limit, and fetch an extra book to find out whether another page follows
+        size = self.page_size + 1
+        if self.limit and direction == ASCENDING:
+            size = min(size, self.limit - self.offset)
+        if size <= 0:
+            self.more = False
+            return []
+        fltr = {'$and': [self.fltr, self._past(sort, key)]} if key is not None else self.fltr
+        books = self._fetch(fltr, sort, size)
+        if direction == DESCENDING:
+            return books[:self.page_size][::-1]
+        self.more = len(books) > self.page_size and (not self.limit or self.offset + self.page_size < self.limit)
+        return books[:self.page_size]
+
+    @staticmethod
+    def _past(sort: list, key: tuple) -> dict:
+        """Method that creates the filter of the books that come after a (sort fields, _id) key in a sort order."""
+        # a book comes after the key if it ties on the first fields and comes after it on the next one
+        clauses = []
+        for i, (field, direction) in enumerate(sort):
+            value = key[i]
+            # like on the server, missing values come first in ascending order and last in descending order
+            if direction == ASCENDING:
+                after = {field: {'$ne': None}} if value is None else {field: {'$gt': value}}
+            elif value is None:
+                continue
+            else:
+                after = {'$or': [{field: {'$lt': value}}, {field: None}]}
+            clauses.append({**{tied: key[j] for j, (tied, _) in enumerate(sort[:i])}, **after})
+        return {'$or': clauses}
+
+    def _offset_page(self, offset: int) -> list:
+        """Method that fetches the page of books starting at 'offset' in the query's sort order."""
+        self.offset = max(offset, 0)
+        # never page past the query's own limit
+        size = self.page_size + 1
+        if self.limit:
+            size = min(size, self.limit - self.offset)
+        if size <= 0:
+            self.more = False
+            return []
+        books = self._fetch(self.fltr, self.sort, size, self.offset)
+        self.more = len(books) > self.page_size and (not self.limit or self.offset + self.page_size < self.limit)
+        return books[:self.page_size]
+
+    def _fetch(self, fltr: dict, sort: list, limit: int, skip: int = 0) -> list:
+        """Method that runs the query of a page, recording its latency and logging it if slow when metrics are enabled."""
+        start = perf_counter()
+        books = list(self.collection.find(fltr, self.prj).sort(sort).skip(skip).limit(limit))
+        if self.metrics:
+            seconds = perf_counter() - start
+            self.metrics.record(PAGE_METRIC, seconds, min(len(books), self.page_size), False)
+            self.metrics.record_query(self.collection, fltr, sort, limit, seconds)
+        return books
+
+    def _finish(self, books: list) -> list:
+        """Method that records the keyset bounds of a page and strips the fields only fetched for them."""
+        if books:
+            self.first_id, self.last_id = books[0]['_id'], books[-1]['_id']
+            if self._keyset_sort():
+                self.first_key, self.last_key = self._key(books[0]), self._key(books[-1])
+        return [self._strip(book) for book in books]
+
+    def _key(self, book: dict) -> tuple:
+        """Method that returns the (sort fields, _id) key of a book."""
+        return tuple(book.get(field) for field, direction in self.sort) + (book['_id'],)
+
+    def _strip(self, book: dict) -> dict:
+        """Method that removes the fields the query's projection excluded but the keyset needed."""
+        for field in self.hidden:
+            book.pop(field, None)
+        return book
+
+
+
+# LIST PAGER CLASS
+
+class ListPager(BookPager):
+    """Class that pages through results already in memory, with the methods of BookPager."""
+    def __init__(self, books: list, page_size: int = PAGE_SIZE):
+        """Constructor method."""
+        self.books = books
+        self.page_size = page_size
+        # state of the current page
+        self.offset = 0
+        self.page_number = 0
+        self.more = True
+
+    def __iter__(self):
+        """Method that iterates over every result."""
+        return iter(self.books)
+
+    def next_page(self) -> list:
+        """Method that returns the page after the current one."""
+        if not self.more and self.page_number > 0:
+            return []
+        return self._page(self.offset + self.page_size * (self.page_number > 0), 1)
+
+    def previous_page(self) -> list:
+        """Method that returns the page before the current one."""
+        # on the first page there is nothing before it, so the first page is returned again
+        if not self.has_previous():
+            self.offset = 0
+            self.page_number = 0
+            return self.next_page()
+        return self._page(self.offset - self.page_size, -1)
+
+    def token(self) -> str or None:
+        """Method that returns a token from which another pager can resume after the current page, or None if it is the last page."""
+        return str(self.offset + self.page_size) if self.more else None
+
+    def resume(self, token: str) -> None:
+        """Method that positions the pager so that the next page starts after the page the token was taken from."""
+        self.offset = int(token) - self.page_size
+        self.page_number = 1
+
+    def _page(self, offset: int, step: int) -> list:
+        """Method that returns the page starting at 'offset' and moves the page number by 'step'."""
+        self.offset = max(offset, 0)
+        self.page_number += step
+        self.more = self.offset + self.page_size < len(self.books)
+        return self.books[self.offset:self.offset + self.page_size]
@@ -0,0 +1,330 @@
+# IMPORTS
+
+import os
+from bisect import bisect_left, bisect_right, insort
+from itertools import count
+from threading import Thread, Lock, Event
+from time import monotonic
+from bson import json_util
+from pymongo.errors import PyMongoError, OperationFailure
+
+
+
+# CONSTANTS
+
+REPLICA_FILE = 'book_replica.jsonl'
+# how long a change stream read waits for a change on the server, so that stop is noticed
+AWAIT_MS = 500
+RETRY_INTERVAL = 5.0
+# fields returned by the searches, like the server-side projection {'_id': 0, 'ISBN13': 0}
+HIDDEN_FIELDS = ('_id', 'ISBN13')
+# change stream events after which the whole collection is loaded again
+RELOAD_EVENTS = ('drop', 'rename', 'dropDatabase', 'invalidate')
+
+
+
+# BOOK REPLICA CLASS
+
+class BookReplica:
+    """Class that keeps a copy of the books in memory, loaded once and kept current by a change stream, to answer searches locally."""
+    def __init__(self, path: str = None):
+        """Constructor method."""
+        # optional file the books and the resume token are saved to on stop, so a restart resumes instead of loading
+        self.path = path
+        self.lock = Lock()
+        self.stopping = Event()
+        self.thread = None
+        self.collection = None
+        self.token = None
+        self.ready = False
+        self.error = None
+        self.loaded_at = None
+        self.changes = 0
+        self.reloads = 0
+        self._clear()
+
+    def start(self, collection) -> None:
+        """Method that starts loading the books and tailing the change stream in the background."""
+        with self.lock:
+            if self.thread is not None:
+                return
+            self.collection = collection
+            self.thread = Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Method that stops tailing the change stream and saves the books if a file is given."""
+        self.stopping.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.save()
+
+    def save(self) -> None:
+        """Method that writes the books and the resume token to the replica file."""
+        with self.lock:
+            if not self.path or not self.ready or self.token is None:
+                return
+            temporary = f'{self.path}.tmp'
+            with open(temporary, 'w', encoding='utf-8') as file:
+                file.write(json_util.dumps({'token': self.token}) + '\n')
+                for book in self.books.values():
+                    file.write(json_util.dumps(book) + '\n')
+        os.replace(temporary, self.path)
+
+    def stats(self) -> dict:
+        """Method that returns the replica state and counters."""
+        with self.lock:
+            return {
+                'ready': self.ready,
+                'books': len(self.books),
+                'changes': self.changes,
+                'reloads': self.reloads,
+                'age_seconds': round(monotonic() - self.loaded_at, 1) if self.loaded_at else None,
+                'error': self.error,
+            }
+
+    # searches, each returning None while the replica is not ready so that the caller asks the server
+
+    def all(self) -> list or None:
+        """Method that returns every book."""
+        with self.lock:
+            if not self.ready:
+                return None
+            return [self._visible(book) for book in self.books.values()]
+
+    def by_isbn(self, ISBN13: str) -> list or None:
+        """Method that returns the book with an ISBN-13 key."""
+        with self.lock:
+            if not self.ready:
+                return None
+            seq = self.isbns.get(ISBN13)
+            return [self._visible(self.books[seq])] if seq is not None else []
+
+    def by_publisher(self, published_by: str) -> list or None:
+        """Method that returns the books of a publisher."""
+        with self.lock:
+            if not self.ready:
+                return None
+            return [self._visible(self.books[seq]) for seq in sorted(self.publishers.get(published_by, ()))]
+
+    def by_year(self, low: int = None, high: int = None) -> list or None:
+        """Method that returns the books published between two years, both included."""
+        with self.lock:
+            if not self.ready:
+                return None
+            return [self._visible(self.books[seq]) for seq in self._range(self.years, low, high)]
+
+    def by_price(self, low: float = None, high: float = None) -> list or None:
+        """Method that returns the books priced between two prices, both included, cheapest first."""
+        with self.lock:
+            if not self.ready:
+                return None
+            return [self._visible(self.books[seq]) for seq in self._range(self.prices, low, high)]
+
+    def find(self, fltr: dict, sort: list = None, limit: int = 0, fields: list = None) -> list or None:
+        """Method that returns the books matching an equality and range filter, as built by build_filter without title keywords."""
+        if '$text' in fltr:
+            return None
+        with self.lock:
+            if not self.ready:
+                return None
+            # start from the most selective index the filter can use
+            candidates = None
+            for field, condition in fltr.items():
+                if field == 'ISBN13':
+                    found = [self.isbns[condition]] if condition in self.isbns else []
+                elif field == 'published_by':
+                    found = sorted(self.publishers.get(condition, ()))
+                elif field in ('year', 'price'):
+                    entries = self.years if field == 'year' else self.prices
+                    low, high = (condition.get('$gte'), condition.get('$lte')) if isinstance(condition, dict) else (condition, condition)
+                    found = self._range(entries, low, high)
+                else:
+                    continue
+                if candidates is None or len(found) < len(candidates):
+                    candidates = found
+            books = [self.books[seq] for seq in (self.books if candidates is None else candidates)]
+            books = [book for book in books if self._matches(book, fltr)]
+        # sort like the server, missing values first in ascending order
+        for field, direction in reversed(sort or []):
+            books.sort(key=lambda book: (book.get(field) is not None, book.get(field) if book.get(field) is not None else 0), reverse=direction < 0)
+        books = books[:limit] if limit else books
+        if fields:
+            return [{field: book[field] for field in fields if field in book} for book in books]
+        return [self._visible(book) for book in books]
+
+    # internals
+
+    def _run(self) -> None:
+        """Method that loads the books and applies the changes until stopped, resuming or reloading after errors."""
+        # the embedded backend has no change streams, so the searches keep using it
+        if not hasattr(self.collection, 'watch'):
+            self._fail('The backend has no change streams.')
+            return
+        self._restore()
+        while not self.stopping.is_set():
+            try:
+                # the stream only ends without an error when the books must be loaded again
+                self._tail()
+                continue
+            except OperationFailure as e:
+                # the resume token is no longer in the oplog (or was rejected), so the books are loaded again
+                self._fail(e, reload=True)
+            except PyMongoError as e:
+                self._fail(e)
+            except Exception as e:
+                self._fail(e)
+                return
+            self.stopping.wait(RETRY_INTERVAL)
+
+    def _tail(self) -> None:
+        """Method that opens the change stream, loads the books if needed and applies the changes."""
+        options = {'full_document': 'updateLookup', 'max_await_time_ms': AWAIT_MS}
+        if self.token is not None:
+            options['resume_after'] = self.token
+        with self.collection.watch(**options) as stream:
+            # the stream is opened before the books are read, so no change made meanwhile is missed
+            if self.token is None:
+                self._load(stream.resume_token)
+            with self.lock:
+                self.ready = True
+                self.error = None
+            while not self.stopping.is_set() and stream.alive:
+                change = stream.try_next()
+                if change is not None and change['operationType'] in RELOAD_EVENTS:
+                    self._forget()
+                    return
+                with self.lock:
+                    if change is not None:
+                        self._apply(change)
+                        self.changes += 1
+                    self.token = stream.resume_token
+
+    def _load(self, token) -> None:
+        """Method that reads every book into the replica."""
+        books = list(self.collection.find({}))
+        with self.lock:
+            self._clear()
+            for book in books:
+                self._put(book)
+            self.token = token
+            self.loaded_at = monotonic()
+            self.reloads += 1
+
+    def _restore(self) -> None:
+        """Method that reads the books and the resume token saved by a previous run, if any."""
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding='utf-8') as file:
+                token = json_util.loads(file.readline())['token']
+                books = [json_util.loads(line) for line in file if line.strip()]
+        except (OSError, ValueError, KeyError) as e:
+            self.error = f'Could not read {self.path}: {e}'
+            return
+        with self.lock:
+            self._clear()
+            for book in books:
+                self._put(book)
+            self.token = token
+            self.loaded_at = monotonic()
+
+    def _fail(self, error: Exception or str, reload: bool = False) -> None:
+        """Method that records a change stream error and sends the searches to the server until the stream is back."""
+        with self.lock:
+            self.ready = False
+            self.error = str(error)
+            if reload:
+                self.token = None
+
+    def _forget(self) -> None:
+        """Method that drops the books so that they are loaded again."""
+        with self.lock:
+            self.ready = False
+            self.token = None
+            self._clear()
+
+    def _apply(self, change: dict) -> None:
+        """Method that applies a change stream event, to be called with the lock held."""
+        _id = change['documentKey']['_id']
+        if _id in self.ids:
+            self._remove(self.ids[_id])
+        # an updated book deleted before its lookup has no full document and is dropped
+        if change['operationType'] in ('insert', 'update', 'replace') and change.get('fullDocument'):
+            self._put(change['fullDocument'])
+
+    def _put(self, book: dict) -> None:
+        """Method that adds a book to the replica and its indexes, to be called with the lock held."""
+        if book['_id'] in self.ids:
+            self._remove(self.ids[book['_id']])
+        seq = next(self.sequence)
+        self.books[seq] = book
+        self.ids[book['_id']] = seq
+        if book.get('ISBN13') is not None:
+            self.isbns[book['ISBN13']] = seq
+        self.publishers.setdefault(book.get('published_by'), set()).add(seq)
+        if self._is_number(book.get('year')):
+            insort(self.years, (book['year'], seq))
+        if self._is_number(book.get('price')):
+            insort(self.prices, (book['price'], seq))
+
+    def _remove(self, seq: int) -> None:
+        """Method that removes a book from the replica and its indexes, to be called with the lock held."""
+        book = self.books.pop(seq)
+        del self.ids[book['_id']]
+        if self.isbns.get(book.get('ISBN13')) == seq:
+            del self.isbns[book['ISBN13']]
+        seqs = self.publishers.get(book.get('published_by'))
+        if seqs is not None:
+            seqs.discard(seq)
+            if not seqs:
+                del self.publishers[book.get('published_by')]
+        for field, entries in (('year', self.years), ('price', self.prices)):
+            if self._is_number(book.get(field)):
+                i = bisect_left(entries, (book[field], seq))
+                if i < len(entries) and entries[i] == (book[field], seq):
+                    del entries[i]
+
+    def _clear(self) -> None:
+        """Method that empties the replica and its indexes."""
+        # books by sequence number, in load order, and the _id, ISBN-13 and publisher maps
+        self.books = {}
+        self.ids = {}
+        self.isbns = {}
+        self.publishers = {}
+        # (value, sequence number) pairs in order, for the range searches
+        self.years = []
+        self.prices = []
+        self.sequence = count()
+
+    @staticmethod
+    def _range(entries: list, low, high) -> list:
+        """Method that returns the sequence numbers of the entries between two bounds, both included and both optional."""
+        # like on the server, a bound of another type matches no number
+        if any(bound is not None and not BookReplica._is_number(bound) for bound in (low, high)):
+            return []
+        start = 0 if low is None else bisect_left(entries, (low,))
+        end = len(entries) if high is None else bisect_right(entries, (high, float('inf')))
+        return [seq for _, seq in entries[start:end]]
+
+    @staticmethod
+    def _matches(book: dict, fltr: dict) -> bool:
+        """Method that checks whether a book matches an equality and inclusive range filter."""
+        for field, condition in fltr.items():
+            value = book.get(field)
+            if isinstance(condition, dict):
+                if not BookReplica._is_number(value) or ('$gte' in condition and value < condition['$gte']) or ('$lte' in condition and value > condition['$lte']):
+                    return False
+            elif value != condition:
+                return False
+        return True
+
+    @staticmethod
+    def _is_number(value) -> bool:
+        """Method that checks whether a value is a number, booleans excluded."""
+        return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+    @staticmethod
+    def _visible(book: dict) -> dict:
+        """Method that copies a book without its hidden fields."""
+        return {field: value for field, value in book.items() if field not in HIDDEN_FIELDS}
@@ -0,0 +1,111 @@
+# IMPORTS
+
+import os
+import csv
+import json
+import hashlib
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from pymongo import ASCENDING
+
+
+
+# CONSTANTS
+
+EXPORT_BATCH_SIZE = 1000
+EXPORT_WORKERS = 4
+EXPORT_FORMATS = ('jsonl', 'csv')
+MANIFEST_NAME = 'manifest.json'
+CSV_FIELDS = {
+    'Book': ['_id', 'ISBN', 'ISBN13', 'title', 'year', 'published_by', 'previous_edition', 'price'],
+    'Publisher': ['_id', 'name', 'phone', 'city'],
+}
+
+
+
+# HASHING WRITER CLASS
+
+class HashingWriter:
+    """Class that writes text to a binary file while counting its checksum."""
+    def __init__(self, file):
+        """Constructor method."""
+        self.file = file
+        self.sha256 = hashlib.sha256()
+
+    def write(self, text: str) -> None:
+        """Method that writes text to the file and adds it to the checksum."""
+        data = text.encode('utf-8')
+        self.sha256.update(data)
+        self.file.write(data)
+
+
+
+# FUNCTIONS
+
+def partition_bounds(collection, partitions: int) -> list:
+    """Function that splits a collection into '_id' ranges holding about the same number of documents."""
+    # the split points are read from the _id index only
+    total = collection.estimated_document_count()
+    partitions = max(1, min(partitions, total))
+    bounds = [None]
+    for i in range(1, partitions):
+        split = list(collection.find({}, {'_id': 1}).sort('_id', ASCENDING).skip(i * total // partitions).limit(1))
+        if split and split[0]['_id'] != bounds[-1]:
+            bounds.append(split[0]['_id'])
+    bounds.append(None)
+    # each range is [lower, upper) with None meaning unbounded
+    return list(zip(bounds[:-1], bounds[1:]))
+
+def export_range(collection, path: str, fmt: str, lower, upper, batch_size: int) -> dict:
+    """Function that streams the documents of an '_id' range to a JSONL or CSV file."""
+    # create the filter
+    fltr = {}
+    if lower is not None:
+        fltr.setdefault('_id', {})['$gte'] = lower
+    if upper is not None:
+        fltr.setdefault('_id', {})['$lt'] = upper
+    rows = 0
+    with open(path, 'wb') as file:
+        writer = HashingWriter(file)
+        csv_writer = None
+        if fmt == 'csv':
+            csv_writer = csv.DictWriter(writer, fieldnames=CSV_FIELDS.get(collection.name, ['_id']), extrasaction='ignore')
+            csv_writer.writeheader()
+        for document in collection.find(fltr, batch_size=batch_size).sort('_id', ASCENDING):
+            document['_id'] = str(document['_id'])
+            if csv_writer:
+                csv_writer.writerow(document)
+            else:
+                writer.write(json.dumps(document, default=str) + '\n')
+            rows += 1
+    return {
+        'file': os.path.basename(path),
+        'rows': rows,
+        'sha256': writer.sha256.hexdigest(),
+        'range': [None if lower is None else str(lower), None if upper is None else str(upper)],
+    }
+
+def export_collection(collection, out_dir: str, fmt: str = 'jsonl', partitions: int = 1, workers: int = EXPORT_WORKERS, batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+    """Function that exports a collection to sharded files in parallel and writes their manifest."""
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f'Export format must be one of {", ".join(EXPORT_FORMATS)}.')
+    os.makedirs(out_dir, exist_ok=True)
+    # export each range in its own worker
+    ranges = partition_bounds(collection, partitions)
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [
+            pool.submit(export_range, collection, os.path.join(out_dir, f'{collection.name}-{i:04d}.{fmt}'), fmt, lower, upper, batch_size)
+            for i, (lower, upper) in enumerate(ranges)
+        ]
+        shards = [future.result() for future in futures]
+    # write the manifest
+    manifest = {
+        'collection': collection.name,
+        'format': fmt,
+        'created': datetime.now(timezone.utc).isoformat(),
+        'rows': sum(shard['rows'] for shard in shards),
+        'shards': shards,
+    }
+    with open(os.path.join(out_dir, f'{collection.name}-{MANIFEST_NAME}'), 'w', encoding='utf-8') as file:
+        json.dump(manifest, file, indent=4)
+    return manifest
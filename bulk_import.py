@@ -0,0 +1,116 @@
+# IMPORTS
+
+import csv
+import json
+from isbn import normalize_isbn
+
+
+
+# CONSTANTS
+
+IMPORT_BATCH_SIZE = 1000
+BOOK_FIELDS = ['ISBN', 'title', 'year', 'published_by', 'previous_edition', 'price']
+PUBLISHER_FIELDS = ['name', 'phone', 'city']
+
+
+
+# FUNCTIONS
+
+def read_rows(path: str):
+    """Function that streams the rows of a CSV file as dictionaries, or the lines of a JSONL file to be parsed by parse_row."""
+    with open(path, newline='', encoding='utf-8') as file:
+        # JSONL files hold one JSON object per line, parsed with the row so that a bad line only rejects itself
+        if path.lower().endswith(('.jsonl', '.json')):
+            for line in file:
+                if line.strip():
+                    yield line.strip()
+        else:
+            yield from csv.DictReader(file)
+
+def parse_row(row) -> dict:
+    """Function that turns a JSONL line into a row dictionary, rejecting anything that is not a JSON object."""
+    if isinstance(row, str):
+        try:
+            row = json.loads(row)
+        except ValueError:
+            raise ValueError('Row must be valid JSON.')
+    if type(row) != dict:
+        raise ValueError('Row must be a JSON object.')
+    return row
+
+def clean(value) -> str:
+    """Function that turns a raw field value into a stripped string, mapping nulls to ''."""
+    value = '' if value is None else str(value).strip()
+    return '' if value.lower() in ('null', 'none') else value
+
+def validate_book(row: dict) -> dict:
+    """Function that validates a book row with the rules of the menu and returns the book document."""
+    ISBN, title, year = clean(row.get('ISBN')), clean(row.get('title')), clean(row.get('year'))
+    published_by, previous_edition, price = clean(row.get('published_by')), clean(row.get('previous_edition')), clean(row.get('price'))
+    # ISBN
+    if ISBN == '':
+        raise ValueError('Book ISBN cannot be empty.')
+    try:
+        ISBN13 = normalize_isbn(ISBN)
+    except ValueError:
+        raise ValueError('Book ISBN must be a valid ISBN-10 or ISBN-13.')
+    # title
+    if title == '':
+        raise ValueError('Book title cannot be empty.')
+    # year
+    try:
+        year = int(year)
+    except ValueError:
+        raise ValueError('Book year must be an integer.')
+    if len(f'{year}') != 4:
+        raise ValueError('Book year must be 4 digits long.')
+    # publisher
+    if published_by == '':
+        raise ValueError('Book publisher cannot be empty.')
+    # previous edition
+    if previous_edition:
+        try:
+            previous_edition = normalize_isbn(previous_edition)
+        except ValueError:
+            raise ValueError('Book previous edition must be a valid ISBN-10 or ISBN-13.')
+    # price
+    if price:
+        try:
+            price = round(float(price), 2)
+        except ValueError:
+            raise ValueError('Book price must be a float.')
+    # create the document
+    book = {
+        'ISBN': ISBN,
+        'ISBN13': ISBN13,
+        'title': title,
+        'year': year,
+        'published_by': published_by,
+        'price': price if price != '' else None,
+    }
+    if previous_edition:
+        book['previous_edition'] = previous_edition
+    return book
+
+def validate_publisher(row: dict) -> dict:
+    """Function that validates a publisher row with the rules of the menu and returns the publisher document."""
+    name, phone, city = clean(row.get('name')), clean(row.get('phone')), clean(row.get('city'))
+    if name == '':
+        raise ValueError('Publisher name cannot be empty.')
+    try:
+        int(phone)
+    except ValueError:
+        raise ValueError('Publisher phone number must be an integer.')
+    return {
+        'name': name,
+        'phone': phone,
+        'city': city,
+    }
+
+def write_rejections(path: str, rejected: list) -> None:
+    """Function that writes the rejected rows of an import to a CSV report."""
+    with open(path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        writer.writerow(['row', 'reason', 'data'])
+        for number, reason, row in rejected:
+            writer.writerow([number, reason, json.dumps(row, default=str)])
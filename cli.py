@@ -0,0 +1,238 @@
+# IMPORTS
+
+import sys
+import json
+import shlex
+import argparse
+from book_dao import BookDAO, CASCADE_MODES, SWEEP_MODES, SWEEP_BATCH_SIZE
+from write_behind import WriteBehind, WRITE_BATCH_SIZE, FLUSH_INTERVAL
+from concurrent.futures import Future
+from bulk_import import validate_book, validate_publisher, read_rows
+from bulk_export import EXPORT_FORMATS
+from server import parse_edit, search
+from reports import REPORTS
+from format import Format
+import timing
+
+
+
+# CONSTANTS
+
+COMMANDS = ('add-publisher', 'add-book', 'edit-book', 'delete-book', 'delete-publisher', 'sweep-orphans', 'search', 'report', 'import', 'export', 'batch')
+# commands that are queued when writes are batched
+WRITE_COMMANDS = ('add-publisher', 'add-book', 'edit-book', 'delete-book')
+BOOK_OPTIONS = ('ISBN', 'title', 'year', 'published_by', 'previous_edition', 'price')
+SEARCH_PAGE_SIZE = 1000
+
+
+
+# FUNCTIONS
+
+def build_parser() -> argparse.ArgumentParser:
+    """Function that builds the parser of the script mode commands."""
+    parser = argparse.ArgumentParser(prog='main.py', description='Book Manager script mode. Every command prints JSON lines.')
+    commands = parser.add_subparsers(dest='op', required=True)
+    # publishers
+    command = commands.add_parser('add-publisher', help='Add a new publisher.')
+    command.add_argument('--name', required=True)
+    command.add_argument('--phone', required=True)
+    command.add_argument('--city', default='')
+    command = commands.add_parser('delete-publisher', help='Delete a publisher.')
+    command.add_argument('--name', required=True)
+    command.add_argument('--cascade', choices=CASCADE_MODES, help='delete the books of the publisher or reassign them')
+    command.add_argument('--reassign-to', dest='reassign_to')
+    command.add_argument('--transaction', action='store_true', help='run the delete in a transaction (needs a replica set)')
+    command = commands.add_parser('sweep-orphans', help='Report, delete or reassign the books whose publisher does not exist.')
+    command.add_argument('--mode', choices=SWEEP_MODES, default='report')
+    command.add_argument('--reassign-to', dest='reassign_to')
+    command.add_argument('--batch-size', dest='batch_size', type=int, default=SWEEP_BATCH_SIZE, help='missing publishers fixed per write')
+    # books
+    for name, help in (('add-book', 'Add a new book.'), ('edit-book', 'Edit an existing book.')):
+        command = commands.add_parser(name, help=help)
+        command.add_argument('--ISBN', '--isbn', dest='ISBN', required=True)
+        for option in BOOK_OPTIONS[1:]:
+            command.add_argument(f'--{option.replace("_", "-")}', dest=option)
+    command.add_argument('--version', type=int, help='only edit the book if it is still at this version')
+    command = commands.add_parser('delete-book', help='Delete a book.')
+    command.add_argument('--ISBN', '--isbn', dest='ISBN', required=True)
+    # search
+    command = commands.add_parser('search', help='Search books, printing one JSON line per book.')
+    for option in ('title', 'isbn', 'publisher', 'published_by', 'year', 'year_min', 'year_max', 'min_price', 'max_price'):
+        command.add_argument(f'--{option.replace("_", "-")}', dest=option)
+    # reports
+    command = commands.add_parser('report', help='Run a server-side report, printing one JSON line per row.')
+    command.add_argument('name', choices=REPORTS)
+    # import and export
+    command = commands.add_parser('import', help='Bulk import books or publishers from a CSV or JSONL file.')
+    command.add_argument('kind', choices=('books', 'publishers'))
+    command.add_argument('path')
+    command.add_argument('--batch-size', dest='batch_size', type=int, default=1000)
+    command.add_argument('--start', type=int, default=0)
+    command = commands.add_parser('export', help='Export books and publishers to sharded files.')
+    command.add_argument('out_dir')
+    command.add_argument('--format', dest='fmt', choices=EXPORT_FORMATS, default=EXPORT_FORMATS[0])
+    command.add_argument('--partitions', type=int, default=1)
+    # batch
+    command = commands.add_parser('batch', help='Run one command per line (command line or JSON object) from a file or stdin.')
+    command.add_argument('path', nargs='?', default='-')
+    command.add_argument('--write-behind', dest='write_behind', action='store_true', help='batch the add, edit and delete commands into bulk writes')
+    command.add_argument('--write-batch-size', dest='write_batch_size', type=int, default=WRITE_BATCH_SIZE)
+    command.add_argument('--flush-interval', dest='flush_interval', type=float, default=FLUSH_INTERVAL, help='seconds before a partial batch is written')
+    command.add_argument('--write-concern', dest='write_concern', help='w of the batched writes, e.g. 1, 0 or majority')
+    return parser
+
+def emit(data: dict) -> None:
+    """Function that prints one JSON line."""
+    sys.stdout.write(json.dumps(data, default=str) + '\n')
+
+def message_result(op: str, message: str or Future) -> dict or Future:
+    """Function that turns a DAO message into a result line, or a batched write into the future of its result line."""
+    if type(message) == Future:
+        return message
+    return {'op': op, 'ok': not Format.is_warning(message), 'message': Format.plain(message)}
+
+def build_writer(args: dict) -> WriteBehind or None:
+    """Function that creates the write-behind batcher asked for by the batch options."""
+    if not args.get('write_behind'):
+        return None
+    w = args.get('write_concern')
+    write_concern = {'w': int(w) if w.isdigit() else w} if w else None
+    return WriteBehind(args['write_batch_size'], args['flush_interval'], write_concern)
+
+def run_command(dao: BookDAO, params: dict) -> dict:
+    """Function that runs one command against the DAO and returns its result line."""
+    op = params.get('op')
+    try:
+        if op == 'add-publisher':
+            publisher = validate_publisher(params)
+            return message_result(op, dao.add_publisher(publisher['name'], publisher['phone'], publisher['city']))
+        if op == 'delete-publisher':
+            return message_result(op, dao.delete_publisher(str(params['name']), params.get('cascade'), params.get('reassign_to'), bool(params.get('transaction'))))
+        if op == 'sweep-orphans':
+            report = dao.sweep_orphans(params.get('mode', 'report'), params.get('reassign_to'), int(params.get('batch_size', SWEEP_BATCH_SIZE)))
+            return message_result(op, report) if type(report) == str else {'op': op, 'ok': True, **report}
+        if op == 'add-book':
+            book = validate_book(params)
+            return message_result(op, dao.add_book(book['ISBN'], book['title'], book['year'], book['published_by'], book.get('previous_edition'), book['price']))
+        if op == 'edit-book':
+            result = dao.edit_book(str(params['ISBN']), **parse_edit(params), return_book=True)
+            return {'op': op, 'ok': True, 'book': result} if type(result) == dict else message_result(op, result)
+        if op == 'delete-book':
+            return message_result(op, dao.delete_book(str(params['ISBN'])))
+        if op == 'search':
+            query = {key: value for key, value in params.items() if value is not None}
+            result = search(dao, query, SEARCH_PAGE_SIZE)
+            if type(result) == str:
+                return message_result(op, result)
+            # stream the books before the summary line
+            count = 0
+            for book in result:
+                emit({'book': book})
+                count += 1
+            return {'op': op, 'ok': True, 'count': count}
+        if op == 'report':
+            if params['name'] == 'prices':
+                result = dao.report_price_histogram()
+                return message_result(op, result) if type(result) == str else {'op': op, 'ok': True, **result}
+            report = {'publishers': dao.report_books_per_publisher, 'cities': dao.report_books_per_city, 'years': dao.report_price_by_year}.get(params['name'])
+            if report is None:
+                raise ValueError(f'Unknown report {params["name"]}.')
+            result = report()
+            if type(result) == str:
+                return message_result(op, result)
+            for row in result:
+                emit({'row': row})
+            return {'op': op, 'ok': True, 'count': len(result)}
+        if op == 'import':
+            importer = dao.import_books if params['kind'] == 'books' else dao.import_publishers
+            report = importer(read_rows(params['path']), int(params.get('batch_size', 1000)), int(params.get('start', 0)))
+            rejected = [{'row': number, 'reason': reason} for number, reason, row in report['rejected']]
+            return {'op': op, 'ok': report['error'] is None, 'inserted': report['inserted'], 'rejected': rejected, 'offset': report['offset'], 'error': report['error']}
+        if op == 'export':
+            manifests = [dao.export_books(params['out_dir'], params.get('fmt', 'jsonl'), int(params.get('partitions', 1))), dao.export_publishers(params['out_dir'], params.get('fmt', 'jsonl'))]
+            errors = [Format.plain(manifest) for manifest in manifests if type(manifest) == str]
+            if errors:
+                return {'op': op, 'ok': False, 'message': ' '.join(errors)}
+            return {'op': op, 'ok': True, 'manifests': manifests}
+    except KeyError as e:
+        return {'op': op, 'ok': False, 'message': f'Missing argument {e}.'}
+    except (TypeError, ValueError) as e:
+        return {'op': op, 'ok': False, 'message': str(e)}
+    return {'op': op, 'ok': False, 'message': f'Unknown command {op}.'}
+
+def parse_line(parser: argparse.ArgumentParser, line: str) -> dict:
+    """Function that parses a batch line, either a JSON object or a command line."""
+    if line.startswith('{'):
+        return json.loads(line)
+    try:
+        return vars(parser.parse_args(shlex.split(line)))
+    except SystemExit:
+        raise ValueError(f'Invalid command: {line}')
+
+def run_batch(dao: BookDAO, parser: argparse.ArgumentParser, path: str) -> bool:
+    """Function that runs the commands of a batch file, or stdin, over one connection."""
+    ok = True
+    # batched writes, emitted in line order once they are written
+    pending = []
+    def emit_written(wait: bool = False) -> bool:
+        written_ok = True
+        while pending and (wait or pending[0][2].done()):
+            number, op, future = pending.pop(0)
+            result = message_result(op, future.result())
+            result['line'] = number
+            emit(result)
+            written_ok = written_ok and result['ok']
+        return written_ok
+    file = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    try:
+        for number, line in enumerate(file, 1):
+            line = line.strip()
+            # skip blank lines and comments
+            if not line or line.startswith('#'):
+                continue
+            try:
+                params = parse_line(parser, line)
+            except ValueError as e:
+                result = {'op': None, 'ok': False, 'message': str(e)}
+            else:
+                # the other commands see every write queued before them
+                if pending and params.get('op') not in WRITE_COMMANDS:
+                    dao.flush()
+                    ok = emit_written(wait=True) and ok
+                result = run_command(dao, params) if params.get('op') != 'batch' else {'op': 'batch', 'ok': False, 'message': 'Batches cannot be nested.'}
+            if type(result) == Future:
+                pending.append((number, params.get('op'), result))
+                continue
+            ok = emit_written() and ok
+            result['line'] = number
+            emit(result)
+            ok = ok and result['ok']
+    finally:
+        if file is not sys.stdin:
+            file.close()
+    # write what is left of the last batch
+    dao.flush()
+    return emit_written(wait=True) and ok
+
+def main(argv: list) -> None:
+    """Function that runs a script mode command and exits with 1 if any operation failed."""
+    parser = build_parser()
+    args = vars(parser.parse_args(argv))
+    dao = BookDAO(writer=build_writer(args))
+    timing.mark('ready')
+    try:
+        if args['op'] == 'batch':
+            ok = run_batch(dao, parser, args['path'])
+        else:
+            result = run_command(dao, args)
+            emit(result)
+            ok = result['ok']
+    finally:
+        # the index verification is finished before the connection is closed, and its failure reported on stderr
+        warning = dao.wait_for_indexes()
+        dao.close()
+    if warning:
+        print(warning, file=sys.stderr)
+    timing.mark('done')
+    timing.report()
+    sys.exit(0 if ok else 1)
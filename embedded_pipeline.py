@@ -0,0 +1,438 @@
+# IMPORTS
+
+import math
+import random
+from copy import deepcopy
+from embedded_query import MISSING, SCORE_FIELD, get_path, set_path, exclude, type_name, is_number, sort_key, freeze, matches, sort_documents
+
+
+
+# EXPRESSIONS
+
+def evaluate(expression, document: dict, variables: dict = None):
+    """Function that evaluates an aggregation expression against a document."""
+    if isinstance(expression, str) and expression.startswith('$$'):
+        name, _, path = expression[2:].partition('.')
+        value = document if name in ('ROOT', 'CURRENT') else (variables or {}).get(name, MISSING)
+        return get_path(value, path) if path and isinstance(value, (dict, list)) else value
+    if isinstance(expression, str) and expression.startswith('$'):
+        return get_path(document, expression[1:])
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            operator, argument = next(iter(expression.items()))
+            if operator.startswith('$'):
+                return evaluate_operator(operator, argument, document, variables)
+        # a document literal, whose missing fields are left out
+        result = {}
+        for key, item in expression.items():
+            value = evaluate(item, document, variables)
+            if value is not MISSING:
+                result[key] = value
+        return result
+    if isinstance(expression, list):
+        return [evaluate(item, document, variables) for item in expression]
+    return expression
+
+def arguments(argument, document: dict, variables: dict) -> list:
+    """Function that evaluates the arguments of an operator, given as a list or as a single expression."""
+    if isinstance(argument, list):
+        return [evaluate(item, document, variables) for item in argument]
+    return [evaluate(argument, document, variables)]
+
+def null(value) -> bool:
+    """Function that checks whether a value is null or missing."""
+    return value is None or value is MISSING
+
+def evaluate_operator(operator: str, argument, document: dict, variables: dict):
+    """Function that evaluates an expression operator."""
+    # operators whose arguments are not all evaluated up front
+    if operator == '$literal':
+        return argument
+    if operator == '$cond':
+        condition, then, otherwise = (argument['if'], argument['then'], argument['else']) if isinstance(argument, dict) else argument
+        return evaluate(then if truthy(evaluate(condition, document, variables)) else otherwise, document, variables)
+    if operator == '$filter':
+        items = evaluate(argument['input'], document, variables)
+        name = argument.get('as', 'this')
+        if null(items):
+            return None
+        return [item for item in items if truthy(evaluate(argument['cond'], document, {**(variables or {}), name: item}))]
+    if operator == '$map':
+        items = evaluate(argument['input'], document, variables)
+        name = argument.get('as', 'this')
+        if null(items):
+            return None
+        return [evaluate(argument['in'], document, {**(variables or {}), name: item}) for item in items]
+    if operator == '$sortArray':
+        items = evaluate(argument['input'], document, variables)
+        if null(items):
+            return None
+        sort_by = argument['sortBy']
+        if isinstance(sort_by, dict):
+            return sort_documents([deepcopy(item) for item in items], sort_by)
+        return sorted(items, key=sort_key, reverse=sort_by < 0)
+    if operator == '$type':
+        return type_name(evaluate(argument[0] if isinstance(argument, list) else argument, document, variables))
+    if operator == '$objectToArray':
+        value = evaluate(argument, document, variables)
+        return None if null(value) else [{'k': key, 'v': item} for key, item in value.items() if key != SCORE_FIELD]
+    if operator == '$arrayToObject':
+        value = evaluate(argument, document, variables)
+        return None if null(value) else {item['k']: item['v'] if isinstance(item, dict) else item[1] for item in value}
+    if operator == '$mergeObjects':
+        result = {}
+        for value in arguments(argument, document, variables):
+            if isinstance(value, dict):
+                result.update(value)
+        return result
+    if operator == '$meta':
+        return document.get(SCORE_FIELD, 0.0) if argument == 'textScore' else MISSING
+    values = arguments(argument, document, variables)
+    if operator in ('$first', '$last'):
+        items = values[0]
+        if null(items):
+            return None
+        return (items[0] if operator == '$first' else items[-1]) if items else MISSING
+    if operator == '$ifNull':
+        return next((value for value in values if not null(value)), values[-1])
+    if operator == '$size':
+        if not isinstance(values[0], list):
+            raise ValueError(f'The argument to $size must be an array, but was of type: {type_name(values[0])}')
+        return len(values[0])
+    if operator == '$arrayElemAt':
+        items, index = values
+        if null(items) or null(index):
+            return None
+        index = int(index)
+        return items[index] if -len(items) <= index < len(items) else MISSING
+    if operator == '$isNumber':
+        return is_number(values[0])
+    if operator == '$isArray':
+        return isinstance(values[0], list)
+    if operator in ('$max', '$min'):
+        # with one array argument the operator applies to its elements
+        items = values[0] if len(values) == 1 and isinstance(values[0], list) else values
+        items = [item for item in items if not null(item)]
+        if not items:
+            return None
+        return (max if operator == '$max' else min)(items, key=sort_key)
+    if operator in ('$sum', '$avg'):
+        items = values[0] if len(values) == 1 and isinstance(values[0], list) else values
+        numbers = [item for item in items if is_number(item)]
+        if operator == '$sum':
+            return sum(numbers)
+        return sum(numbers) / len(numbers) if numbers else None
+    if operator in ('$add', '$subtract', '$multiply', '$divide', '$mod', '$ceil', '$floor', '$abs', '$round', '$trunc'):
+        return arithmetic(operator, values)
+    if operator in ('$eq', '$ne', '$gt', '$gte', '$lt', '$lte', '$cmp'):
+        left, right = sort_key(values[0]), sort_key(values[1])
+        return {
+            '$eq': left == right, '$ne': left != right, '$gt': left > right, '$gte': left >= right,
+            '$lt': left < right, '$lte': left <= right, '$cmp': (left > right) - (left < right),
+        }[operator]
+    if operator == '$and':
+        return all(truthy(value) for value in values)
+    if operator == '$or':
+        return any(truthy(value) for value in values)
+    if operator == '$not':
+        return not truthy(values[0])
+    if operator == '$in':
+        return freeze(values[0]) in {freeze(item) for item in values[1]}
+    if operator == '$concat':
+        return None if any(null(value) for value in values) else ''.join(values)
+    if operator in ('$toLower', '$toUpper'):
+        value = '' if null(values[0]) else str(values[0])
+        return value.lower() if operator == '$toLower' else value.upper()
+    if operator == '$toString':
+        return None if null(values[0]) else str(values[0])
+    raise ValueError(f'Unrecognized expression \'{operator}\'')
+
+def arithmetic(operator: str, values: list):
+    """Function that evaluates an arithmetic operator, null if any argument is null."""
+    if any(null(value) for value in values[:1 if operator in ('$ceil', '$floor', '$abs') else None]):
+        return None
+    if operator == '$add':
+        return sum(values)
+    if operator == '$subtract':
+        return values[0] - values[1]
+    if operator == '$multiply':
+        return math.prod(values)
+    if operator == '$divide':
+        return values[0] / values[1]
+    if operator == '$mod':
+        return math.fmod(values[0], values[1])
+    if operator == '$ceil':
+        return math.ceil(values[0])
+    if operator == '$floor':
+        return math.floor(values[0])
+    if operator == '$abs':
+        return abs(values[0])
+    places = int(values[1]) if len(values) > 1 else 0
+    if operator == '$round':
+        return round(values[0], places)
+    return math.trunc(values[0] * 10 ** places) / 10 ** places
+
+def truthy(value) -> bool:
+    """Function that applies the truthiness of aggregation expressions: null, missing, false and 0 are false."""
+    return not (null(value) or value is False or (is_number(value) and value == 0))
+
+
+
+# ACCUMULATORS
+
+class Accumulator:
+    """Class that accumulates the values of one $group or $bucket output field."""
+    def __init__(self, spec: dict):
+        """Constructor method."""
+        (self.operator, self.expression), = spec.items()
+        self.values = []
+
+    def add(self, document: dict, variables: dict = None) -> None:
+        """Method that adds the value of a document."""
+        self.values.append(evaluate(self.expression, document, variables))
+
+    def result(self):
+        """Method that returns the accumulated value."""
+        values = self.values
+        if self.operator == '$sum':
+            return sum(value for value in values if is_number(value))
+        if self.operator == '$count':
+            return len(values)
+        if self.operator == '$avg':
+            numbers = [value for value in values if is_number(value)]
+            return sum(numbers) / len(numbers) if numbers else None
+        if self.operator in ('$min', '$max'):
+            present = [value for value in values if not null(value)]
+            if not present:
+                return None
+            return (min if self.operator == '$min' else max)(present, key=sort_key)
+        if self.operator == '$push':
+            return [value for value in values if value is not MISSING]
+        if self.operator == '$addToSet':
+            unique = {}
+            for value in values:
+                if value is not MISSING:
+                    unique.setdefault(freeze(value), value)
+            return list(unique.values())
+        if self.operator == '$first':
+            return None if not values or values[0] is MISSING else values[0]
+        if self.operator == '$last':
+            return None if not values or values[-1] is MISSING else values[-1]
+        raise ValueError(f'unknown group operator \'{self.operator}\'')
+
+
+
+# STAGES
+
+def stage_match(database, documents: list, spec: dict) -> list:
+    """Function that keeps the documents matching a filter."""
+    if '$text' in spec:
+        raise ValueError('$match with $text is only allowed as the first pipeline stage')
+    return [document for document in documents if matches(document, spec)]
+
+def stage_project(database, documents: list, spec: dict) -> list:
+    """Function that reshapes documents: exclusion of fields, or inclusion of fields and computed ones."""
+    flags = {field: value for field, value in spec.items() if isinstance(value, bool) or is_number(value)}
+    if len(flags) == len(spec) and not any(flags.values()):
+        # exclusion of fields, dotted paths reaching into arrays of documents
+        for document in documents:
+            for field in spec:
+                exclude(document, field)
+        return documents
+    result = []
+    for document in documents:
+        # _id is kept unless it is excluded or computed
+        projected = {'_id': document['_id']} if '_id' not in spec and '_id' in document else {}
+        for field, value in spec.items():
+            if field in flags:
+                item = get_path(document, field) if value else MISSING
+            else:
+                item = evaluate(value, document)
+            if item is not MISSING:
+                set_path(projected, field, item)
+        result.append(projected)
+    return result
+
+def stage_set(database, documents: list, spec: dict) -> list:
+    """Function that adds or replaces computed fields."""
+    for document in documents:
+        for field, expression in spec.items():
+            value = evaluate(expression, document)
+            if value is not MISSING:
+                set_path(document, field, value)
+    return documents
+
+def stage_unset(database, documents: list, spec) -> list:
+    """Function that removes fields."""
+    for document in documents:
+        for field in ([spec] if isinstance(spec, str) else spec):
+            exclude(document, field)
+    return documents
+
+def stage_unwind(database, documents: list, spec) -> list:
+    """Function that outputs one document per element of an array field."""
+    spec = {'path': spec} if isinstance(spec, str) else spec
+    field = spec['path'][1:]
+    keep = spec.get('preserveNullAndEmptyArrays', False)
+    result = []
+    for document in documents:
+        value = get_path(document, field)
+        if isinstance(value, list) and value:
+            for item in value:
+                unwound = deepcopy(document)
+                set_path(unwound, field, item)
+                result.append(unwound)
+        elif isinstance(value, list) or null(value):
+            if keep:
+                unwound = deepcopy(document)
+                exclude(unwound, field)
+                result.append(unwound)
+        else:
+            result.append(document)
+    return result
+
+def stage_group(database, documents: list, spec: dict) -> list:
+    """Function that groups documents by an expression and accumulates the other fields."""
+    groups = {}
+    for document in documents:
+        key = evaluate(spec['_id'], document)
+        key = None if key is MISSING else key
+        group = groups.get(freeze(key))
+        if group is None:
+            group = groups[freeze(key)] = (key, {field: Accumulator(accumulator) for field, accumulator in spec.items() if field != '_id'})
+        for accumulator in group[1].values():
+            accumulator.add(document)
+    return [{'_id': key, **{field: accumulator.result() for field, accumulator in accumulators.items()}} for key, accumulators in groups.values()]
+
+def stage_bucket(database, documents: list, spec: dict) -> list:
+    """Function that counts documents, or accumulates their fields, in ranges given by boundaries."""
+    boundaries = spec['boundaries']
+    output = spec.get('output', {'count': {'$sum': 1}})
+    buckets = {}
+    for document in documents:
+        value = evaluate(spec['groupBy'], document)
+        key = sort_key(value)
+        bucket = None
+        for low, high in zip(boundaries, boundaries[1:]):
+            if sort_key(low)[0] == key[0] and sort_key(low) <= key < sort_key(high):
+                bucket = low
+                break
+        if bucket is None:
+            if 'default' not in spec:
+                raise ValueError('$bucket could not find a matching branch for an input, and no default was specified.')
+            bucket = spec['default']
+        if freeze(bucket) not in buckets:
+            buckets[freeze(bucket)] = (bucket, {field: Accumulator(accumulator) for field, accumulator in output.items()})
+        for accumulator in buckets[freeze(bucket)][1].values():
+            accumulator.add(document)
+    # buckets in boundary order, the default one last
+    order = [freeze(low) for low in boundaries[:-1]] + [freeze(spec.get('default'))]
+    return [
+        {'_id': buckets[key][0], **{field: accumulator.result() for field, accumulator in buckets[key][1].items()}}
+        for key in order if key in buckets
+    ]
+
+def stage_sort(database, documents: list, spec: dict) -> list:
+    """Function that sorts the documents."""
+    return sort_documents(documents, spec)
+
+def stage_limit(database, documents: list, spec: int) -> list:
+    """Function that keeps the first documents."""
+    return documents[:spec]
+
+def stage_skip(database, documents: list, spec: int) -> list:
+    """Function that skips the first documents."""
+    return documents[spec:]
+
+def stage_sample(database, documents: list, spec: dict) -> list:
+    """Function that picks random documents."""
+    return random.sample(documents, min(spec['size'], len(documents)))
+
+def stage_count(database, documents: list, spec: str) -> list:
+    """Function that counts the documents."""
+    return [{spec: len(documents)}] if documents else []
+
+def stage_replace_root(database, documents: list, spec: dict) -> list:
+    """Function that replaces each document with an embedded or computed one."""
+    result = []
+    for document in documents:
+        root = evaluate(spec['newRoot'], document)
+        if not isinstance(root, dict):
+            raise ValueError(f'\'newRoot\' expression must evaluate to an object, but resulting value was of type: {type_name(root)}')
+        result.append(root)
+    return result
+
+def stage_lookup(database, documents: list, spec: dict) -> list:
+    """Function that joins the documents of another collection whose foreign field equals the local field."""
+    foreign = database[spec['from']]
+    joined = {}
+    for document in documents:
+        value = get_path(document, spec['localField'])
+        values = value if isinstance(value, list) else [None if value is MISSING else value]
+        # the same local values are only looked up once
+        key = freeze(values)
+        if key not in joined:
+            joined[key] = foreign.find_raw({spec['foreignField']: {'$in': values}})
+        set_path(document, spec['as'], deepcopy(joined[key]))
+    return documents
+
+def stage_graph_lookup(database, documents: list, spec: dict) -> list:
+    """Function that recursively joins the documents of a collection, breadth first and visiting each document once."""
+    foreign = database[spec['from']]
+    max_depth = spec.get('maxDepth')
+    for document in documents:
+        start = evaluate(spec['startWith'], document)
+        frontier = [item for item in (start if isinstance(start, list) else [start]) if not null(item)]
+        visited, found, depth = set(), [], 0
+        while frontier and (max_depth is None or depth <= max_depth):
+            following = []
+            for match in foreign.find_raw({spec['connectToField']: {'$in': frontier}}):
+                if match['_id'] in visited:
+                    continue
+                visited.add(match['_id'])
+                match = deepcopy(match)
+                if 'depthField' in spec:
+                    match[spec['depthField']] = depth
+                found.append(match)
+                value = get_path(match, spec['connectFromField'])
+                following += [item for item in (value if isinstance(value, list) else [value]) if not null(item)]
+            frontier, depth = following, depth + 1
+        document[spec['as']] = found
+    return documents
+
+def stage_facet(database, documents: list, spec: dict) -> list:
+    """Function that runs several pipelines on the same documents and returns their results in one document."""
+    return [{name: run_pipeline(database, deepcopy(documents), pipeline) for name, pipeline in spec.items()}]
+
+STAGES = {
+    '$match': stage_match,
+    '$project': stage_project,
+    '$set': stage_set,
+    '$addFields': stage_set,
+    '$unset': stage_unset,
+    '$unwind': stage_unwind,
+    '$group': stage_group,
+    '$bucket': stage_bucket,
+    '$sort': stage_sort,
+    '$limit': stage_limit,
+    '$skip': stage_skip,
+    '$sample': stage_sample,
+    '$count': stage_count,
+    '$replaceRoot': stage_replace_root,
+    '$lookup': stage_lookup,
+    '$graphLookup': stage_graph_lookup,
+    '$facet': stage_facet,
+}
+
+
+
+# FUNCTIONS
+
+def run_pipeline(database, documents: list, pipeline: list) -> list:
+    """Function that runs the stages of an aggregation pipeline on copies of the input documents."""
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name not in STAGES:
+            raise ValueError(f'Unrecognized pipeline stage name: \'{name}\'')
+        documents = STAGES[name](database, documents, spec)
+    return documents
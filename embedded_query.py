@@ -0,0 +1,399 @@
+# IMPORTS
+
+import re
+from copy import deepcopy
+from datetime import datetime
+from bson.objectid import ObjectId
+from bson.regex import Regex
+
+
+
+# CONSTANTS
+
+# value of a field a document does not have, which is not the same as null
+MISSING = object()
+# hidden field holding the text score of a document matched by $text
+SCORE_FIELD = '$textScore'
+# BSON type names by rank, in the MongoDB comparison order
+TYPE_RANKS = {'null': 1, 'number': 2, 'string': 3, 'object': 4, 'array': 5, 'objectId': 7, 'bool': 8, 'date': 9}
+NUMBER_TYPES = ('int', 'long', 'double', 'decimal')
+MAX_INT32 = 2 ** 31 - 1
+WORD = re.compile(r'\w+', re.UNICODE)
+# suffixes stripped by the stemmer, with the shortest stem each may leave
+SUFFIXES = (('ing', 3), ('ed', 3), ('er', 4), ('ly', 4))
+VOWELS = set('aeiouy')
+STOP_WORDS = {'a', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'for', 'from', 'in', 'is', 'it', 'of', 'on', 'or', 'the', 'to', 'with'}
+
+
+
+# VALUES
+
+def get_path(document: dict, path: str):
+    """Function that returns the value of a dotted path, mapped over the arrays on the way, or MISSING."""
+    value = document
+    for part in path.split('.'):
+        if isinstance(value, dict):
+            value = value.get(part, MISSING)
+        elif isinstance(value, list):
+            if part.isdigit():
+                value = value[int(part)] if int(part) < len(value) else MISSING
+            else:
+                values = [get_path(item, part) for item in value if isinstance(item, dict)]
+                value = [item for item in values if item is not MISSING]
+        else:
+            return MISSING
+        if value is MISSING:
+            return MISSING
+    return value
+
+def set_path(document: dict, path: str, value) -> None:
+    """Function that sets the value of a dotted path, creating the embedded documents on the way."""
+    parts = path.split('.')
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+def unset_path(document: dict, path: str) -> bool:
+    """Function that removes a dotted path from a document and returns whether it was there."""
+    parts = path.split('.')
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return False
+    return document.pop(parts[-1], MISSING) is not MISSING
+
+def type_name(value) -> str:
+    """Function that returns the BSON type name of a value."""
+    if value is MISSING:
+        return 'missing'
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int' if -MAX_INT32 - 1 <= value <= MAX_INT32 else 'long'
+    if isinstance(value, float):
+        return 'double'
+    if isinstance(value, str):
+        return 'string'
+    if isinstance(value, dict):
+        return 'object'
+    if isinstance(value, (list, tuple)):
+        return 'array'
+    if isinstance(value, ObjectId):
+        return 'objectId'
+    if isinstance(value, datetime):
+        return 'date'
+    if isinstance(value, (Regex, re.Pattern)):
+        return 'regex'
+    return type(value).__name__
+
+def is_number(value) -> bool:
+    """Function that checks whether a value is a number, booleans excluded."""
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def sort_key(value) -> tuple:
+    """Function that returns a key ordering values of any type like MongoDB does, null and missing first."""
+    if value is MISSING or value is None:
+        return (TYPE_RANKS['null'], 0)
+    if is_number(value):
+        return (TYPE_RANKS['number'], value)
+    if isinstance(value, str):
+        return (TYPE_RANKS['string'], value)
+    if isinstance(value, dict):
+        return (TYPE_RANKS['object'], tuple((key, sort_key(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return (TYPE_RANKS['array'], tuple(sort_key(item) for item in value))
+    if isinstance(value, ObjectId):
+        return (TYPE_RANKS['objectId'], value.binary)
+    if isinstance(value, bool):
+        return (TYPE_RANKS['bool'], value)
+    if isinstance(value, datetime):
+        return (TYPE_RANKS['date'], value)
+    return (10, repr(value))
+
+def freeze(value):
+    """Function that turns a value into a hashable one, equal values giving equal results."""
+    if value is MISSING or value is None:
+        return None
+    if isinstance(value, dict):
+        return ('object', tuple((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return ('array', tuple(freeze(item) for item in value))
+    if is_number(value):
+        # 1 and 1.0 are the same key
+        return ('number', value)
+    return (type_name(value), value)
+
+
+
+# MATCHING
+
+def matches(document: dict, fltr: dict) -> bool:
+    """Function that checks whether a document matches a query filter ($text being checked by the caller)."""
+    for key, condition in (fltr or {}).items():
+        if key == '$and':
+            if not all(matches(document, part) for part in condition):
+                return False
+        elif key == '$or':
+            if not any(matches(document, part) for part in condition):
+                return False
+        elif key == '$nor':
+            if any(matches(document, part) for part in condition):
+                return False
+        elif key == '$text':
+            continue
+        elif key.startswith('$'):
+            raise ValueError(f'unknown top level operator: {key}')
+        elif not match_condition(get_path(document, key), condition):
+            return False
+    return True
+
+def match_condition(value, condition) -> bool:
+    """Function that checks whether a field value matches a condition: a value, a regex or a document of operators."""
+    if isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition):
+        options = condition.get('$options', '')
+        return all(match_operator(value, operator, argument, options) for operator, argument in condition.items() if operator != '$options')
+    if isinstance(condition, (Regex, re.Pattern)):
+        return match_regex(value, compile_regex(condition))
+    return equals(value, condition)
+
+def match_operator(value, operator: str, argument, options: str = '') -> bool:
+    """Function that checks one query operator against a field value."""
+    if operator == '$eq':
+        return equals(value, argument)
+    if operator == '$ne':
+        return not equals(value, argument)
+    if operator in ('$gt', '$gte', '$lt', '$lte'):
+        return any(compare(item, operator, argument) for item in candidates(value))
+    if operator == '$in':
+        return any(match_condition(value, item) if isinstance(item, (Regex, re.Pattern)) else equals(value, item) for item in argument)
+    if operator == '$nin':
+        return not match_operator(value, '$in', argument)
+    if operator == '$exists':
+        return (value is not MISSING) == bool(argument)
+    if operator == '$type':
+        names = argument if isinstance(argument, list) else [argument]
+        return any(type_matches(item, name) for name in names for item in candidates(value))
+    if operator == '$regex':
+        return match_regex(value, compile_regex(argument, options))
+    if operator == '$size':
+        return isinstance(value, list) and len(value) == argument
+    if operator == '$all':
+        return isinstance(value, list) and all(equals(value, item) for item in argument)
+    if operator == '$not':
+        return not match_condition(value, argument)
+    if operator == '$elemMatch':
+        return isinstance(value, list) and any(matches(item, argument) if isinstance(item, dict) else match_condition(item, argument) for item in value)
+    raise ValueError(f'unknown operator: {operator}')
+
+def candidates(value) -> list:
+    """Function that returns the values an operator is checked against: the value and, for an array, its elements."""
+    if isinstance(value, list):
+        return [value] + value
+    return [value]
+
+def equals(value, target) -> bool:
+    """Function that checks query equality, null matching missing fields and arrays matching their elements."""
+    if target is None:
+        return value is MISSING or value is None or (isinstance(value, list) and None in value)
+    if value is MISSING:
+        return False
+    if isinstance(value, list) and not isinstance(target, list):
+        return any(freeze(item) == freeze(target) for item in value)
+    return freeze(value) == freeze(target)
+
+def compare(value, operator: str, argument) -> bool:
+    """Function that applies a comparison operator, values of different types never matching."""
+    if value is MISSING:
+        return argument is None and operator in ('$gte', '$lte')
+    left, right = sort_key(value), sort_key(argument)
+    if left[0] != right[0]:
+        return False
+    if operator == '$gt':
+        return left > right
+    if operator == '$gte':
+        return left >= right
+    if operator == '$lt':
+        return left < right
+    return left <= right
+
+def type_matches(value, name) -> bool:
+    """Function that checks whether a value has a BSON type, given by name or 'number'."""
+    if value is MISSING:
+        return False
+    actual = type_name(value)
+    return actual == name or (name == 'number' and actual in NUMBER_TYPES)
+
+def compile_regex(pattern, options: str = ''):
+    """Function that compiles a regex given as a string with options, a bson Regex or a compiled pattern."""
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    if isinstance(pattern, Regex):
+        return pattern.try_compile()
+    flags = 0
+    for option, flag in (('i', re.IGNORECASE), ('m', re.MULTILINE), ('s', re.DOTALL), ('x', re.VERBOSE)):
+        if option in options:
+            flags |= flag
+    return re.compile(pattern, flags)
+
+def match_regex(value, regex) -> bool:
+    """Function that checks whether a string, or a string in an array, matches a regex."""
+    return any(isinstance(item, str) and regex.search(item) is not None for item in candidates(value))
+
+
+
+# TEXT
+
+def stem(word: str) -> str:
+    """Function that reduces a word to a simple stem, so that plurals and the common English suffixes match their root (learning, learned and learns all become learn)."""
+    # plurals
+    if len(word) > 4 and word.endswith('ies'):
+        word = word[:-3] + 'y'
+    elif len(word) > 3 and word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        word = word[:-1]
+    # one suffix, if what is left is long enough and has a vowel
+    for suffix, shortest in SUFFIXES:
+        root = word[:-len(suffix)]
+        if word.endswith(suffix) and len(root) >= shortest and VOWELS & set(root):
+            word = root
+            # a doubled final consonant is undoubled, so that running becomes run
+            if len(word) > 3 and word[-1] == word[-2] and word[-1] not in 'aeioulsz':
+                word = word[:-1]
+            break
+    # a final e is dropped, so that hope and hoping share a stem
+    if len(word) > 3 and word.endswith('e'):
+        word = word[:-1]
+    return word
+
+def tokenize(text) -> list:
+    """Function that splits a text into lowercase stems, leaving out the stop words."""
+    if not isinstance(text, str):
+        return []
+    return [stem(word) for word in WORD.findall(text.lower()) if word not in STOP_WORDS]
+
+def text_score(document: dict, terms: set, weights: dict) -> float:
+    """Function that scores a document for a text search: the weighted number of matched terms in each field."""
+    score = 0.0
+    for field, weight in weights.items():
+        tokens = tokenize(get_path(document, field))
+        if tokens:
+            matched = sum(1 for token in tokens if token in terms)
+            # like MongoDB, repeated terms count less and longer fields weigh less
+            score += weight * matched / (0.5 * len(tokens) + 0.5) if matched else 0.0
+    return score
+
+
+
+# PROJECTION AND SORT
+
+def project(document: dict, projection: dict or None) -> dict:
+    """Function that returns a copy of a document with the fields of a find projection."""
+    if not projection:
+        result = deepcopy(document)
+        result.pop(SCORE_FIELD, None)
+        return result
+    meta = {field: value for field, value in projection.items() if isinstance(value, dict) and value.get('$meta') == 'textScore'}
+    fields = {field: value for field, value in projection.items() if field not in meta}
+    include_id = fields.pop('_id', 1)
+    if any(fields.values()):
+        # inclusion: only the listed fields, and _id unless excluded
+        result = {}
+        if include_id and '_id' in document:
+            result['_id'] = deepcopy(document['_id'])
+        for field in fields:
+            value = get_path(document, field)
+            if value is not MISSING:
+                set_path(result, field, deepcopy(value))
+    else:
+        # exclusion: every field but the listed ones
+        result = deepcopy(document)
+        result.pop(SCORE_FIELD, None)
+        for field in list(fields) + ([] if include_id else ['_id']):
+            exclude(result, field)
+    for field in meta:
+        result[field] = document.get(SCORE_FIELD, 0.0)
+    return result
+
+def exclude(document, path: str) -> None:
+    """Function that removes a dotted path from a document, and from every document of an array on the way."""
+    if isinstance(document, list):
+        for item in document:
+            exclude(item, path)
+        return
+    if not isinstance(document, dict):
+        return
+    head, _, rest = path.partition('.')
+    if not rest:
+        document.pop(head, None)
+    elif head in document:
+        exclude(document[head], rest)
+
+def normalize_sort(sort) -> list:
+    """Function that turns a sort given as a field, a list of pairs or a document into a list of pairs."""
+    if sort is None:
+        return []
+    if isinstance(sort, str):
+        return [(sort, 1)]
+    if isinstance(sort, dict):
+        return list(sort.items())
+    return [(field, direction) for field, direction in sort]
+
+def sort_documents(documents: list, sort) -> list:
+    """Function that sorts documents by several fields, text scores first if asked (highest first)."""
+    for field, direction in reversed(normalize_sort(sort)):
+        if isinstance(direction, dict) and direction.get('$meta') == 'textScore':
+            documents.sort(key=lambda document: document.get(SCORE_FIELD, 0.0), reverse=True)
+        else:
+            documents.sort(key=lambda document: sort_key(get_path(document, field)), reverse=direction < 0)
+    return documents
+
+
+
+# UPDATES
+
+def apply_update(document: dict, update: dict, inserting: bool = False) -> bool:
+    """Function that applies an update document (or replaces the fields) and returns whether the document changed."""
+    before = deepcopy(document)
+    if not any(key.startswith('$') for key in update):
+        # a replacement keeps only the _id
+        _id = document.get('_id', MISSING)
+        document.clear()
+        document.update(deepcopy(update))
+        if _id is not MISSING:
+            document['_id'] = _id
+        return document != before
+    for operator, fields in update.items():
+        for field, value in fields.items():
+            if operator == '$set' or (operator == '$setOnInsert' and inserting):
+                set_path(document, field, deepcopy(value))
+            elif operator == '$setOnInsert':
+                continue
+            elif operator == '$unset':
+                unset_path(document, field)
+            elif operator == '$inc':
+                current = get_path(document, field)
+                current = 0 if current is MISSING else current
+                if not is_number(current) or not is_number(value):
+                    raise ValueError(f'Cannot apply $inc to a value of non-numeric type. {field} is {type_name(current)}.')
+                set_path(document, field, current + value)
+            elif operator == '$push':
+                current = get_path(document, field)
+                set_path(document, field, ([] if current is MISSING else list(current)) + [deepcopy(value)])
+            else:
+                raise ValueError(f'Unknown modifier: {operator}.')
+    return document != before
+
+def upsert_document(fltr: dict, update: dict) -> dict:
+    """Function that creates the document inserted by an upsert: the equality fields of the filter with the update applied."""
+    document = {}
+    for field, condition in fltr.items():
+        if field.startswith('$'):
+            continue
+        if isinstance(condition, dict) and any(key.startswith('$') for key in condition):
+            if '$eq' in condition:
+                set_path(document, field, deepcopy(condition['$eq']))
+            continue
+        set_path(document, field, deepcopy(condition))
+    apply_update(document, update, inserting=True)
+    return document
@@ -0,0 +1,789 @@
+# IMPORTS
+
+import os
+from bisect import bisect_left, bisect_right, insort
+from copy import deepcopy
+from itertools import count
+from threading import RLock
+from bson import json_util
+from bson.objectid import ObjectId
+from pymongo.errors import DuplicateKeyError, BulkWriteError, OperationFailure
+from pymongo.operations import InsertOne, UpdateOne, UpdateMany, ReplaceOne, DeleteOne, DeleteMany
+from embedded_query import MISSING, SCORE_FIELD, get_path, freeze, sort_key, matches, tokenize, text_score, project, sort_documents, apply_update, upsert_document, normalize_sort
+from embedded_pipeline import run_pipeline
+from storage_backend import StorageBackend
+from pymongo_connector import PUBLISHER_COLLECTION, BOOK_COLLECTION
+
+
+
+# CONSTANTS
+
+ID_INDEX = '_id_'
+RANGE_OPERATORS = ('$gt', '$gte', '$lt', '$lte')
+# journal lines replayed before the journal is compacted on open
+COMPACT_THRESHOLD = 10000
+
+
+
+# RESULTS
+
+class WriteResult:
+    """Class that holds the result of a write, with the attributes of the pymongo result classes."""
+    def __init__(self, inserted_id = None, inserted_ids: list = None, matched_count: int = 0, modified_count: int = 0, deleted_count: int = 0, upserted_id = None, inserted_count: int = 0):
+        """Constructor method."""
+        self.acknowledged = True
+        self.inserted_id = inserted_id
+        self.inserted_ids = inserted_ids or []
+        self.inserted_count = inserted_count
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.deleted_count = deleted_count
+        self.upserted_id = upserted_id
+        self.upserted_count = int(upserted_id is not None)
+
+
+
+# INDEX CLASSES
+
+class HashIndex:
+    """Class that maps the values of a field to the documents holding them, for equality lookups."""
+    def __init__(self, field: str):
+        """Constructor method."""
+        self.field = field
+        self.entries = {}
+
+    def add(self, seq: int, document: dict) -> None:
+        """Method that indexes a document."""
+        self.entries.setdefault(freeze(get_path(document, self.field)), set()).add(seq)
+
+    def remove(self, seq: int, document: dict) -> None:
+        """Method that removes a document from the index."""
+        key = freeze(get_path(document, self.field))
+        seqs = self.entries.get(key)
+        if seqs is not None:
+            seqs.discard(seq)
+            if not seqs:
+                del self.entries[key]
+
+    def lookup(self, values: list) -> set:
+        """Method that returns the documents holding any of the values."""
+        found = set()
+        for value in values:
+            found |= self.entries.get(freeze(value), set())
+        return found
+
+
+class SortedIndex:
+    """Class that keeps the values of a field in order, for equality and range lookups."""
+    def __init__(self, field: str):
+        """Constructor method."""
+        self.field = field
+        # (sort key, document sequence number) pairs, in order
+        self.entries = []
+
+    def add(self, seq: int, document: dict) -> None:
+        """Method that indexes a document."""
+        insort(self.entries, (sort_key(get_path(document, self.field)), seq))
+
+    def remove(self, seq: int, document: dict) -> None:
+        """Method that removes a document from the index."""
+        entry = (sort_key(get_path(document, self.field)), seq)
+        i = bisect_left(self.entries, entry)
+        if i < len(self.entries) and self.entries[i] == entry:
+            del self.entries[i]
+
+    def lookup(self, values: list) -> set:
+        """Method that returns the documents holding any of the values."""
+        found = set()
+        for value in values:
+            key = sort_key(value)
+            low, high = bisect_left(self.entries, (key,)), bisect_right(self.entries, (key, float('inf')))
+            found.update(seq for _, seq in self.entries[low:high])
+        return found
+
+    def range(self, condition: dict) -> set:
+        """Method that returns the documents whose value is within the bounds of a range condition."""
+        # the bounds keep the type of the other bound, as comparisons never match across types
+        bound = next(condition[operator] for operator in RANGE_OPERATORS if operator in condition)
+        rank = sort_key(bound)[0]
+        low, high = bisect_left(self.entries, ((rank,),)), bisect_left(self.entries, ((rank + 1,),))
+        if '$gte' in condition:
+            low = max(low, bisect_left(self.entries, (sort_key(condition['$gte']),)))
+        if '$gt' in condition:
+            low = max(low, bisect_right(self.entries, (sort_key(condition['$gt']), float('inf'))))
+        if '$lte' in condition:
+            high = min(high, bisect_right(self.entries, (sort_key(condition['$lte']), float('inf'))))
+        if '$lt' in condition:
+            high = min(high, bisect_left(self.entries, (sort_key(condition['$lt']),)))
+        return {seq for _, seq in self.entries[low:high]}
+
+
+class TextIndex:
+    """Class that maps the stems of the words of text fields to the documents holding them."""
+    def __init__(self, weights: dict):
+        """Constructor method."""
+        self.weights = weights
+        self.entries = {}
+
+    def tokens(self, document: dict) -> set:
+        """Method that returns the stems of the indexed fields of a document."""
+        return {token for field in self.weights for token in tokenize(get_path(document, field))}
+
+    def add(self, seq: int, document: dict) -> None:
+        """Method that indexes a document."""
+        for token in self.tokens(document):
+            self.entries.setdefault(token, set()).add(seq)
+
+    def remove(self, seq: int, document: dict) -> None:
+        """Method that removes a document from the index."""
+        for token in self.tokens(document):
+            seqs = self.entries.get(token)
+            if seqs is not None:
+                seqs.discard(seq)
+                if not seqs:
+                    del self.entries[token]
+
+    def search(self, terms: set) -> set:
+        """Method that returns the documents holding any of the terms."""
+        found = set()
+        for term in terms:
+            found |= self.entries.get(term, set())
+        return found
+
+
+class Index:
+    """Class that holds the definition of an index and the structure that serves it."""
+    def __init__(self, document: dict):
+        """Constructor method."""
+        self.document = document
+        self.name = document['name']
+        self.key = list(document['key'].items())
+        self.unique = document.get('unique', False)
+        self.partial = document.get('partialFilterExpression')
+        if any(kind == 'text' for _, kind in self.key):
+            # a text index covers its text fields, with a weight of 1 unless given
+            self.kind, self.field = 'text', None
+            self.structure = TextIndex({field: document.get('weights', {}).get(field, 1) for field, kind in self.key if kind == 'text'})
+        elif self.unique:
+            self.kind, self.field = 'hash', self.key[0][0]
+            self.structure = HashIndex(self.field)
+        else:
+            # a compound index is served by a sorted index on its first field
+            self.kind, self.field = 'sorted', self.key[0][0]
+            self.structure = SortedIndex(self.field)
+
+    def covers(self, document: dict) -> bool:
+        """Method that checks whether a document belongs in the index, i.e. matches its partial filter."""
+        return self.partial is None or matches(document, self.partial)
+
+    def key_of(self, document: dict):
+        """Method that returns the unique key of a document, over every field of the index."""
+        return tuple(freeze(get_path(document, field)) for field, _ in self.key)
+
+    def info(self) -> dict:
+        """Method that describes the index like index_information does."""
+        if self.kind == 'text':
+            info = {'key': [('_fts', 'text'), ('_ftsx', 1)], 'weights': self.structure.weights}
+        else:
+            info = {'key': self.key}
+        if self.unique:
+            info['unique'] = True
+        if self.partial is not None:
+            info['partialFilterExpression'] = self.partial
+        return info
+
+
+
+# CURSOR CLASS
+
+class Cursor:
+    """Class that holds a query and runs it on first iteration, with the cursor methods used by the DAO."""
+    def __init__(self, collection, fltr: dict, projection: dict, sort = None, limit: int = 0, skip: int = 0):
+        """Constructor method."""
+        self.collection = collection
+        self.fltr = fltr or {}
+        self.projection = projection
+        self.sort_spec = normalize_sort(sort)
+        self.limit_count = limit
+        self.skip_count = skip
+        self.results = None
+
+    def sort(self, key_or_list, direction: int = None):
+        """Method that sets the sort of the query."""
+        self.sort_spec = [(key_or_list, direction or 1)] if isinstance(key_or_list, str) else normalize_sort(key_or_list)
+        return self
+
+    def limit(self, limit: int):
+        """Method that sets the most documents returned, 0 meaning all of them."""
+        self.limit_count = limit
+        return self
+
+    def skip(self, skip: int):
+        """Method that sets how many documents are skipped."""
+        self.skip_count = skip
+        return self
+
+    def hint(self, index):
+        """Method that accepts an index hint, the embedded planner picking its own index."""
+        return self
+
+    def batch_size(self, batch_size: int):
+        """Method that accepts a batch size, every result being local."""
+        return self
+
+    def close(self) -> None:
+        """Method that drops the results."""
+        self.results = []
+
+    def __iter__(self):
+        """Method that runs the query and iterates over its results."""
+        if self.results is None:
+            self.results = self.collection.run_query(self.fltr, self.projection, self.sort_spec, self.limit_count, self.skip_count)
+        return iter(self.results)
+
+
+
+# COLLECTION CLASS
+
+class EmbeddedCollection:
+    """Class that stores the documents of a collection in memory, with the pymongo Collection methods used by the DAO."""
+    def __init__(self, database, name: str):
+        """Constructor method."""
+        self.database = database
+        self.name = name
+        self.full_name = f'{database.name}.{name}'
+        self.lock = database.lock
+        # documents by sequence number, in insertion order, and the _id index
+        self.documents = {}
+        self.ids = {}
+        self.sequence = count()
+        self.indexes = {}
+
+    # reads
+
+    def find(self, filter: dict = None, projection: dict = None, batch_size: int = 0, sort = None, limit: int = 0, skip: int = 0, **kwargs) -> Cursor:
+        """Method that returns a cursor over the documents matching a filter."""
+        return Cursor(self, filter, projection, sort, limit, skip)
+
+    def find_one(self, filter: dict = None, projection: dict = None, **kwargs) -> dict or None:
+        """Method that returns the first document matching a filter, or None."""
+        results = self.run_query(filter or {}, projection, kwargs.get('sort'), 1, 0)
+        return results[0] if results else None
+
+    def find_raw(self, fltr: dict) -> list:
+        """Method that returns the stored documents matching a filter, for the pipeline stages to copy."""
+        with self.lock:
+            return [self.documents[seq] for seq in self._select(fltr)[0]]
+
+    def count_documents(self, filter: dict, **kwargs) -> int:
+        """Method that counts the documents matching a filter."""
+        with self.lock:
+            return len(self._select(filter)[0])
+
+    def estimated_document_count(self, **kwargs) -> int:
+        """Method that counts every document."""
+        return len(self.documents)
+
+    def distinct(self, key: str, filter: dict = None, **kwargs) -> list:
+        """Method that returns the distinct values of a field."""
+        values = {}
+        with self.lock:
+            for seq in self._select(filter or {})[0]:
+                value = get_path(self.documents[seq], key)
+                for item in (value if isinstance(value, list) else [value]):
+                    if item is not MISSING:
+                        values.setdefault(freeze(item), item)
+        return sorted(values.values(), key=sort_key)
+
+    def aggregate(self, pipeline: list, **kwargs) -> list:
+        """Method that runs an aggregation pipeline, its first $match (and $text) served by the indexes."""
+        pipeline = list(pipeline)
+        fltr = pipeline.pop(0)['$match'] if pipeline and '$match' in pipeline[0] else {}
+        with self.lock:
+            seqs, scores = self._select(fltr)
+            documents = [deepcopy(self.documents[seq]) for seq in seqs]
+        for document, score in zip(documents, scores or []):
+            document[SCORE_FIELD] = score
+        results = run_pipeline(self.database, documents, pipeline)
+        for document in results:
+            document.pop(SCORE_FIELD, None)
+        return results
+
+    def run_query(self, fltr: dict, projection: dict, sort, limit: int, skip: int) -> list:
+        """Method that runs a find query and returns copies of the projected results."""
+        with self.lock:
+            seqs, scores = self._select(fltr)
+            documents = [self.documents[seq] for seq in seqs]
+            if scores is not None:
+                documents = [{**document, SCORE_FIELD: score} for document, score in zip(documents, scores)]
+            if sort:
+                documents = sort_documents(list(documents), sort)
+            documents = documents[skip:skip + limit] if limit else documents[skip:]
+            return [project(document, projection) for document in documents]
+
+    # writes
+
+    def insert_one(self, document: dict, **kwargs) -> WriteResult:
+        """Method that inserts a document, adding an _id if it has none."""
+        with self.lock:
+            _id = self._insert(document)
+        return WriteResult(inserted_id=_id, inserted_ids=[_id], inserted_count=1)
+
+    def insert_many(self, documents: list, ordered: bool = True, **kwargs) -> WriteResult:
+        """Method that inserts documents, stopping at the first error if ordered and skipping the failed ones otherwise."""
+        ids, errors = [], []
+        with self.lock:
+            for i, document in enumerate(documents):
+                try:
+                    ids.append(self._insert(document))
+                except DuplicateKeyError as e:
+                    errors.append({'index': i, 'code': 11000, 'errmsg': str(e), 'op': document})
+                    if ordered:
+                        break
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': len(ids), 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'nUpserted': 0, 'upserted': [], 'writeConcernErrors': []})
+        return WriteResult(inserted_ids=ids, inserted_count=len(ids))
+
+    def update_one(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> WriteResult:
+        """Method that updates the first document matching a filter."""
+        with self.lock:
+            return self._update(filter, update, upsert, many=False)
+
+    def update_many(self, filter: dict, update: dict, upsert: bool = False, **kwargs) -> WriteResult:
+        """Method that updates every document matching a filter."""
+        with self.lock:
+            return self._update(filter, update, upsert, many=True)
+
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False, **kwargs) -> WriteResult:
+        """Method that replaces the first document matching a filter."""
+        with self.lock:
+            return self._update(filter, replacement, upsert, many=False)
+
+    def find_one_and_update(self, filter: dict, update: dict, projection: dict = None, return_document: bool = False, upsert: bool = False, **kwargs) -> dict or None:
+        """Method that updates the first document matching a filter and returns it as it was before, or after if 'return_document' is set."""
+        with self.lock:
+            seqs = self._select(filter)[0][:1]
+            if not seqs:
+                if not upsert:
+                    return None
+                seq = self.ids[freeze(self._insert(upsert_document(filter, update)))]
+                return project(self.documents[seq], projection) if return_document else None
+            before = project(self.documents[seqs[0]], projection)
+            self._apply(seqs[0], update)
+            return project(self.documents[seqs[0]], projection) if return_document else before
+
+    def delete_one(self, filter: dict, **kwargs) -> WriteResult:
+        """Method that deletes the first document matching a filter."""
+        with self.lock:
+            seqs = self._select(filter)[0][:1]
+            for seq in seqs:
+                self._delete(seq)
+        return WriteResult(deleted_count=len(seqs))
+
+    def delete_many(self, filter: dict, **kwargs) -> WriteResult:
+        """Method that deletes every document matching a filter."""
+        with self.lock:
+            seqs = self._select(filter)[0]
+            for seq in seqs:
+                self._delete(seq)
+        return WriteResult(deleted_count=len(seqs))
+
+    def bulk_write(self, requests: list, ordered: bool = True, **kwargs) -> WriteResult:
+        """Method that applies a list of pymongo write operations, stopping at the first error if ordered."""
+        totals = {'nInserted': 0, 'nMatched': 0, 'nModified': 0, 'nRemoved': 0, 'nUpserted': 0}
+        errors = []
+        with self.lock:
+            for i, request in enumerate(requests):
+                try:
+                    result = self._bulk_operation(request)
+                except (DuplicateKeyError, ValueError) as e:
+                    errors.append({'index': i, 'code': getattr(e, 'code', None), 'errmsg': str(e), 'op': request})
+                    if ordered:
+                        break
+                    continue
+                totals['nInserted'] += result.inserted_count
+                totals['nMatched'] += result.matched_count
+                totals['nModified'] += result.modified_count
+                totals['nRemoved'] += result.deleted_count
+                totals['nUpserted'] += result.upserted_count
+        if errors:
+            raise BulkWriteError({**totals, 'writeErrors': errors, 'upserted': [], 'writeConcernErrors': []})
+        return WriteResult(inserted_count=totals['nInserted'], matched_count=totals['nMatched'], modified_count=totals['nModified'], deleted_count=totals['nRemoved'])
+
+    def with_options(self, **kwargs):
+        """Method that accepts collection options, writes being applied in memory at once."""
+        return self
+
+    def drop(self, **kwargs) -> None:
+        """Method that removes every document and index."""
+        with self.lock:
+            self.documents.clear()
+            self.ids.clear()
+            self.indexes.clear()
+            self.database.journal('drop', self.name)
+
+    # indexes
+
+    def create_indexes(self, indexes: list, **kwargs) -> list:
+        """Method that builds pymongo IndexModel definitions over the stored documents."""
+        with self.lock:
+            for index in indexes:
+                self._create_index(dict(index.document))
+        return [index.document['name'] for index in indexes]
+
+    def index_information(self) -> dict:
+        """Method that describes the indexes by name, the _id index included."""
+        with self.lock:
+            return {ID_INDEX: {'key': [('_id', 1)]}, **{name: index.info() for name, index in self.indexes.items()}}
+
+    def list_indexes(self) -> list:
+        """Method that lists the indexes."""
+        return [{'name': name, **info} for name, info in self.index_information().items()]
+
+    def drop_index(self, name: str, **kwargs) -> None:
+        """Method that drops an index by name."""
+        with self.lock:
+            if name not in self.indexes:
+                raise OperationFailure(f'index not found with name [{name}]')
+            del self.indexes[name]
+            self.database.journal('drop_index', self.name, name=name)
+
+    # internals
+
+    def _select(self, fltr: dict) -> tuple:
+        """Method that returns the matching sequence numbers in insertion order, and their text scores for a $text query."""
+        fltr = fltr or {}
+        seqs = self._plan(fltr)
+        scores = None
+        if '$text' in fltr:
+            index = next((index for index in self.indexes.values() if index.kind == 'text'), None)
+            if index is None:
+                raise OperationFailure('text index required for $text query')
+            terms = set(tokenize(fltr['$text']['$search']))
+            found = index.structure.search(terms)
+            seqs = found if seqs is None else seqs & found
+            seqs = [seq for seq in sorted(seqs) if matches(self.documents[seq], fltr)]
+            scores = [text_score(self.documents[seq], terms, index.structure.weights) for seq in seqs]
+            return seqs, scores
+        if seqs is None:
+            return [seq for seq, document in self.documents.items() if matches(document, fltr)], None
+        return [seq for seq in sorted(seqs) if matches(self.documents[seq], fltr)], None
+
+    def _plan(self, fltr: dict) -> set or None:
+        """Method that narrows a query to the documents of the most selective usable index, or None for a full scan."""
+        best = None
+        for field, condition in fltr.items():
+            if field.startswith('$'):
+                continue
+            values = self._equality_values(condition)
+            if field == '_id' and values is not None:
+                return {self.ids[freeze(value)] for value in values if freeze(value) in self.ids}
+            for index in self.indexes.values():
+                if index.field != field or (index.partial is not None and not self._implies(condition, index.partial.get(field))):
+                    continue
+                if values is not None:
+                    found = index.structure.lookup(values)
+                elif isinstance(condition, dict) and index.kind == 'sorted' and any(operator in condition for operator in RANGE_OPERATORS):
+                    found = index.structure.range(condition)
+                else:
+                    continue
+                if best is None or len(found) < len(best):
+                    best = found
+        return best
+
+    @staticmethod
+    def _equality_values(condition) -> list or None:
+        """Method that returns the values an equality or $in condition looks for, or None for other conditions."""
+        if isinstance(condition, dict):
+            if set(condition) == {'$eq'}:
+                return [condition['$eq']]
+            if set(condition) == {'$in'}:
+                return list(condition['$in'])
+            if any(key.startswith('$') for key in condition):
+                return None
+        # arrays, regexes and nulls (which match missing fields) are left to the full match
+        if isinstance(condition, (list, type(None))) or type(condition).__name__ in ('Regex', 'Pattern'):
+            return None
+        return [condition]
+
+    @staticmethod
+    def _implies(condition, partial) -> bool:
+        """Method that checks whether a condition only matches documents covered by a partial index."""
+        # the partial filters used are {'$exists': True}, implied by any equality with a non-null value
+        return partial == {'$exists': True} and EmbeddedCollection._equality_values(condition) is not None and None not in EmbeddedCollection._equality_values(condition)
+
+    def _insert(self, document: dict, journal: bool = True):
+        """Method that stores a document, checking the unique indexes, and returns its _id."""
+        if '_id' not in document:
+            document['_id'] = ObjectId()
+        stored = deepcopy(document)
+        _id = freeze(stored['_id'])
+        if _id in self.ids:
+            raise self._duplicate(ID_INDEX, {'_id': stored['_id']})
+        self._check_unique(stored)
+        seq = next(self.sequence)
+        self.documents[seq] = stored
+        self.ids[_id] = seq
+        for index in self.indexes.values():
+            if index.covers(stored):
+                index.structure.add(seq, stored)
+        if journal:
+            self.database.journal('put', self.name, document=stored)
+        return stored['_id']
+
+    def _update(self, fltr: dict, update: dict, upsert: bool, many: bool) -> WriteResult:
+        """Method that applies an update to the first or every matching document, inserting one if none match and 'upsert' is set."""
+        seqs = self._select(fltr)[0]
+        seqs = seqs if many else seqs[:1]
+        if not seqs and upsert:
+            return WriteResult(upserted_id=self._insert(upsert_document(fltr, update)))
+        modified = sum(self._apply(seq, update) for seq in seqs)
+        return WriteResult(matched_count=len(seqs), modified_count=modified)
+
+    def _apply(self, seq: int, update: dict) -> bool:
+        """Method that updates a stored document and its index entries, undoing the update if it breaks a unique index."""
+        document = self.documents[seq]
+        changed = deepcopy(document)
+        if not apply_update(changed, update):
+            return False
+        if freeze(changed.get('_id')) != freeze(document.get('_id')):
+            raise ValueError('Performing an update on the path \'_id\' would modify the immutable field \'_id\'')
+        self._check_unique(changed, seq)
+        for index in self.indexes.values():
+            if index.covers(document):
+                index.structure.remove(seq, document)
+            if index.covers(changed):
+                index.structure.add(seq, changed)
+        self.documents[seq] = changed
+        self.database.journal('put', self.name, document=changed)
+        return True
+
+    def _delete(self, seq: int) -> None:
+        """Method that removes a stored document and its index entries."""
+        document = self.documents.pop(seq)
+        del self.ids[freeze(document['_id'])]
+        for index in self.indexes.values():
+            if index.covers(document):
+                index.structure.remove(seq, document)
+        self.database.journal('delete', self.name, _id=document['_id'])
+
+    def _check_unique(self, document: dict, seq: int = None) -> None:
+        """Method that raises a duplicate key error if a document breaks a unique index."""
+        for index in self.indexes.values():
+            if not index.unique or not index.covers(document):
+                continue
+            for other in index.structure.lookup([get_path(document, index.field)]):
+                if other != seq and index.key_of(self.documents[other]) == index.key_of(document):
+                    raise self._duplicate(index.name, {field: get_path(document, field) for field, _ in index.key})
+
+    def _duplicate(self, name: str, key: dict) -> DuplicateKeyError:
+        """Method that creates the duplicate key error MongoDB would raise."""
+        shown = ', '.join(f'{field}: {json_util.dumps(None if value is MISSING else value)}' for field, value in key.items())
+        return DuplicateKeyError(f'E11000 duplicate key error collection: {self.full_name} index: {name} dup key: {{ {shown} }}', 11000)
+
+    def _create_index(self, document: dict, journal: bool = True) -> None:
+        """Method that builds an index over the stored documents, failing if a unique index has duplicates."""
+        name = document['name']
+        if name in self.indexes:
+            return
+        index = Index(document)
+        for seq, stored in self.documents.items():
+            if not index.covers(stored):
+                continue
+            if index.unique and any(index.key_of(self.documents[other]) == index.key_of(stored) for other in index.structure.lookup([get_path(stored, index.field)])):
+                raise self._duplicate(name, {field: get_path(stored, field) for field, _ in index.key})
+            index.structure.add(seq, stored)
+        self.indexes[name] = index
+        if journal:
+            self.database.journal('index', self.name, index=document)
+
+    def _bulk_operation(self, request) -> WriteResult:
+        """Method that applies one pymongo write operation."""
+        # the operation classes keep their arguments in private attributes
+        if isinstance(request, InsertOne):
+            _id = self._insert(request._doc)
+            return WriteResult(inserted_id=_id, inserted_count=1)
+        if isinstance(request, (UpdateOne, ReplaceOne)):
+            return self._update(request._filter, request._doc, bool(request._upsert), many=False)
+        if isinstance(request, UpdateMany):
+            return self._update(request._filter, request._doc, bool(request._upsert), many=True)
+        if isinstance(request, (DeleteOne, DeleteMany)):
+            seqs = self._select(request._filter)[0]
+            seqs = seqs if isinstance(request, DeleteMany) else seqs[:1]
+            for seq in seqs:
+                self._delete(seq)
+            return WriteResult(deleted_count=len(seqs))
+        raise ValueError(f'Unsupported bulk write operation: {type(request).__name__}.')
+
+
+
+# DATABASE CLASS
+
+class EmbeddedDatabase:
+    """Class that holds the embedded collections, persisted to an append-only journal file if a path is given."""
+    def __init__(self, name: str, path: str = None):
+        """Constructor method."""
+        self.name = name
+        self.path = path
+        self.lock = RLock()
+        self.collections = {}
+        self.file = None
+        # the database is its own client, so the DAO can use either
+        self.client = self
+        if path:
+            self._load()
+
+    def __getitem__(self, name: str) -> EmbeddedCollection:
+        """Method that returns a collection, creating it on first use."""
+        with self.lock:
+            if name not in self.collections:
+                self.collections[name] = EmbeddedCollection(self, name)
+            return self.collections[name]
+
+    def get_collection(self, name: str, **kwargs) -> EmbeddedCollection:
+        """Method that returns a collection."""
+        return self[name]
+
+    def list_collection_names(self) -> list:
+        """Method that lists the collections holding documents."""
+        return [name for name, collection in self.collections.items() if collection.documents]
+
+    def command(self, *args, **kwargs):
+        """Method that rejects the server commands, which the embedded engine does not have."""
+        raise OperationFailure('Server commands are not supported by the embedded backend.')
+
+    def start_session(self, **kwargs):
+        """Method that rejects sessions, as the embedded engine has no transactions."""
+        raise OperationFailure('Transactions are not supported by the embedded backend.')
+
+    def journal(self, op: str, collection: str, **fields) -> None:
+        """Method that appends a write to the journal file."""
+        if self.file is not None:
+            self.file.write(json_util.dumps({'op': op, 'c': collection, **fields}) + '\n')
+            self.file.flush()
+
+    def compact(self) -> None:
+        """Method that rewrites the journal as one index and one put line per index and document."""
+        if not self.path:
+            return
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+            temporary = f'{self.path}.tmp'
+            with open(temporary, 'w', encoding='utf-8') as file:
+                for name, collection in self.collections.items():
+                    for index in collection.indexes.values():
+                        file.write(json_util.dumps({'op': 'index', 'c': name, 'index': index.document}) + '\n')
+                    for document in collection.documents.values():
+                        file.write(json_util.dumps({'op': 'put', 'c': name, 'document': document}) + '\n')
+            os.replace(temporary, self.path)
+            self.file = open(self.path, 'a', encoding='utf-8')
+
+    def close(self) -> None:
+        """Method that compacts and closes the journal."""
+        with self.lock:
+            if self.file is not None:
+                self.compact()
+                self.file.close()
+                self.file = None
+
+    def _load(self) -> None:
+        """Method that replays the journal, then compacts it if it grew long."""
+        lines = 0
+        if os.path.exists(self.path):
+            with open(self.path, encoding='utf-8') as file:
+                for line in file:
+                    if line.strip():
+                        self._replay(json_util.loads(line))
+                        lines += 1
+        self.file = open(self.path, 'a', encoding='utf-8')
+        if lines > COMPACT_THRESHOLD:
+            self.compact()
+
+    def _replay(self, entry: dict) -> None:
+        """Method that applies one journal line."""
+        collection = self[entry['c']]
+        if entry['op'] == 'put':
+            document = entry['document']
+            seq = collection.ids.get(freeze(document['_id']))
+            if seq is not None:
+                collection._delete(seq)
+            collection._insert(document, journal=False)
+        elif entry['op'] == 'delete':
+            seq = collection.ids.get(freeze(entry['_id']))
+            if seq is not None:
+                collection._delete(seq)
+        elif entry['op'] == 'index':
+            collection._create_index(entry['index'], journal=False)
+        elif entry['op'] == 'drop_index':
+            collection.indexes.pop(entry['name'], None)
+        elif entry['op'] == 'drop':
+            collection.documents.clear()
+            collection.ids.clear()
+            collection.indexes.clear()
+
+
+
+# CONNECTION CLASS
+
+class EmbeddedConnection(StorageBackend):
+    """Class that represents a connection to the in-process embedded engine."""
+    def __init__(self, settings: dict, publisherCollection: str = PUBLISHER_COLLECTION, bookCollection: str = BOOK_COLLECTION):
+        """Constructor method."""
+        # one engine per journal file (or per database name in memory) is shared by every connection
+        self.db = acquire_database(settings['dbname'], settings.get('embedded_path') or None)
+        self.publisher_collection = self.db[publisherCollection]
+        self.book_collection = self.db[bookCollection]
+
+    def getClient(self):
+        """Method that returns the client."""
+        return self.db.client
+
+    def getDB(self):
+        """Method that returns the database."""
+        return self.db
+
+    def getPublisherCollection(self):
+        """Method that returns the collection."""
+        return self.publisher_collection
+
+    def getBookCollection(self):
+        """Method that returns the collection."""
+        return self.book_collection
+
+    def close(self):
+        """Method that releases the engine, compacting its journal when the last connection is closed."""
+        release_database(self.db)
+
+
+
+# FUNCTIONS
+
+# the shared engines, keyed by their journal path or database name, with their number of users
+DATABASES = {}
+DATABASES_LOCK = RLock()
+
+def acquire_database(name: str, path: str = None) -> EmbeddedDatabase:
+    """Function that returns the shared engine of a journal file or in-memory database, opening it on first use."""
+    key = os.path.abspath(path) if path else name
+    with DATABASES_LOCK:
+        if key not in DATABASES:
+            DATABASES[key] = [EmbeddedDatabase(name, path), 0]
+        DATABASES[key][1] += 1
+        return DATABASES[key][0]
+
+def release_database(database: EmbeddedDatabase) -> None:
+    """Function that releases a shared engine, closing its journal when its last user releases it."""
+    with DATABASES_LOCK:
+        for key, (shared, users) in list(DATABASES.items()):
+            if shared is database:
+                if users <= 1:
+                    database.close()
+                    # an in-memory engine keeps its data for the rest of the process
+                    if database.path:
+                        del DATABASES[key]
+                    else:
+                        DATABASES[key][1] = 0
+                else:
+                    DATABASES[key][1] -= 1
+                return
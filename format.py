@@ -1,3 +1,15 @@
+# IMPORTS
+
+import re
+
+
+
+# CONSTANTS
+
+ANSI_ESCAPE = re.compile(r'\033\[[0-9;]*m')
+
+
+
 # FORMAT CLASS
 
 class Format:
@@ -53,3 +65,18 @@ class Format:
         if 'error' in format:
             output = Format.error(output)
         return output
+
+    @staticmethod
+    def plain(message: str) -> str:
+        """Method that strips the formatting from a message."""
+        return ANSI_ESCAPE.sub('', message)
+
+    @staticmethod
+    def is_warning(message: str) -> bool:
+        """Method that checks whether a message was created as a warning or an error."""
+        return message.startswith(('\033[93m', '\033[91m'))
+
+    @staticmethod
+    def is_error(message: str) -> bool:
+        """Method that checks whether a message was created as an error."""
+        return message.startswith('\033[91m')
@@ -0,0 +1,261 @@
+# IMPORTS
+
+from threading import Thread
+from pymongo import ASCENDING, TEXT
+from pymongo.operations import IndexModel, UpdateOne
+from format import Format
+from pymongo.errors import BulkWriteError
+from isbn import isbn_key, LEGACY_PREFIX
+
+
+
+# CONSTANTS
+
+INDEX_VERSION = 7
+META_COLLECTION = 'Meta'
+META_ID = 'indexes'
+PROGRESS_INTERVAL = 1.0
+# suffix of the name a changed index is built under before the old one is dropped
+TEMPORARY_SUFFIX = '_rebuild'
+# options of an existing index that are kept when it has to be put back
+RESTORED_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'weights', 'default_language', 'expireAfterSeconds', 'collation')
+MIGRATION_BATCH_SIZE = 1000
+BOOK_INDEXES = [
+    IndexModel([('ISBN', ASCENDING)], name='ISBN_1', unique=True),
+    IndexModel([('title', ASCENDING)], name='title_1'),
+    IndexModel([('published_by', ASCENDING)], name='published_by_1'),
+    IndexModel([('price', ASCENDING)], name='price_1'),
+    IndexModel([('year', ASCENDING)], name='year_1'),
+    IndexModel([('published_by', ASCENDING), ('title', ASCENDING)], name='published_by_1_title_1'),
+    IndexModel([('published_by', ASCENDING), ('year', ASCENDING)], name='published_by_1_year_1'),
+    IndexModel([('published_by', ASCENDING), ('price', ASCENDING)], name='published_by_1_price_1'),
+    IndexModel([('year', ASCENDING), ('price', ASCENDING)], name='year_1_price_1'),
+    IndexModel([('ISBN13', ASCENDING)], name='ISBN13_1', unique=True, partialFilterExpression={'ISBN13': {'$exists': True}}),
+    IndexModel([('previous_edition', ASCENDING)], name='previous_edition_1'),
+    IndexModel([('title', TEXT), ('published_by', TEXT)], name='title_text_published_by_text', weights={'title': 10, 'published_by': 2}, default_language='english'),
+]
+PUBLISHER_INDEXES = [
+    IndexModel([('name', ASCENDING)], name='name_1', unique=True),
+    IndexModel([('city', ASCENDING)], name='city_1'),
+]
+
+
+
+# MIGRATIONS
+
+def write_updates(bookCollection, updates, label: str, progress = None) -> dict:
+    """Function that applies (_id, changes) pairs in unordered batches and counts the books updated and the updates rejected as duplicates."""
+    counts = {'updated': 0, 'duplicates': 0}
+    def write(batch: list) -> None:
+        try:
+            counts['updated'] += bookCollection.bulk_write(batch, ordered=False).modified_count
+        except BulkWriteError as e:
+            # a key already held by another book (e.g. the ISBN-10 and ISBN-13 of the same book) is skipped, not fatal
+            counts['updated'] += e.details.get('nModified', 0)
+            counts['duplicates'] += len(e.details.get('writeErrors', []))
+        if progress:
+            progress(bookCollection.name, f'{counts["updated"]} {label}')
+    batch = []
+    for _id, changes in updates:
+        batch.append(UpdateOne({'_id': _id}, {'$set': changes}))
+        if len(batch) == MIGRATION_BATCH_SIZE:
+            write(batch)
+            batch = []
+    if batch:
+        write(batch)
+    return counts
+
+def backfill_isbn13(bookCollection, progress = None) -> None:
+    """Function that stores the lookup key on books that do not have one yet, a legacy key for ISBNs that fail validation."""
+    legacy = []
+    def updates():
+        for book in bookCollection.find({'ISBN13': {'$exists': False}, 'ISBN': {'$exists': True}}, {'ISBN': 1}):
+            key = isbn_key(book['ISBN'])
+            if key.startswith(LEGACY_PREFIX):
+                legacy.append(book['ISBN'])
+            yield book['_id'], {'ISBN13': key}
+    counts = write_updates(bookCollection, updates(), 'ISBN keys backfilled', progress)
+    if progress:
+        progress(bookCollection.name, f'{counts["updated"]} ISBN keys backfilled, {len(legacy)} legacy keys for invalid ISBNs, {counts["duplicates"]} duplicate ISBNs skipped')
+
+def normalize_previous_editions(bookCollection, progress = None) -> None:
+    """Function that rewrites every previous edition as the lookup key of its ISBN, so that it links to the ISBN13 of that edition."""
+    def updates():
+        for book in bookCollection.find({'previous_edition': {'$nin': [None, '']}}, {'previous_edition': 1}):
+            key = isbn_key(book['previous_edition'])
+            if key != book['previous_edition']:
+                yield book['_id'], {'previous_edition': key}
+    counts = write_updates(bookCollection, updates(), 'previous editions normalized', progress)
+    if progress:
+        progress(bookCollection.name, f'{counts["updated"]} previous editions normalized')
+
+def backfill_legacy_keys(bookCollection, progress = None) -> None:
+    """Function that keys the books left without a key by the first backfill, then normalizes the previous editions."""
+    backfill_isbn13(bookCollection, progress)
+    normalize_previous_editions(bookCollection, progress)
+
+# data migrations run before the indexes of the spec version they belong to
+MIGRATIONS = {
+    3: backfill_isbn13,
+    7: backfill_legacy_keys,
+}
+
+
+
+# INDEX MANAGER CLASS
+
+class IndexManager:
+    """Class that applies the declared index spec to the database once per spec version."""
+    def __init__(self, db, bookCollection, publisherCollection):
+        """Constructor method."""
+        # store the database objects
+        self.db = db
+        self.metaCollection = db[META_COLLECTION]
+        self.bookCollection = bookCollection
+        # pair each collection with its declared indexes
+        self.spec = [
+            (bookCollection, BOOK_INDEXES),
+            (publisherCollection, PUBLISHER_INDEXES),
+        ]
+
+    def get_applied_version(self) -> int:
+        """Method that returns the index spec version recorded in the database."""
+        meta = self.metaCollection.find_one({'_id': META_ID})
+        return meta['version'] if meta else 0
+
+    def is_current(self) -> bool:
+        """Method that checks whether the recorded index spec version is up to date."""
+        return self.get_applied_version() >= INDEX_VERSION
+
+    def missing_indexes(self) -> list:
+        """Method that returns the declared indexes that do not exist yet or whose definition changed, per collection."""
+        missing = []
+        for collection, indexes in self.spec:
+            existing = collection.index_information()
+            pending = []
+            for index in indexes:
+                name = index.document['name']
+                # an index with the declared name but a different definition is rebuilt, keeping the old one until then
+                if name not in existing or not self._matches(existing[name], index):
+                    pending.append((index, existing.get(name)))
+            if pending:
+                missing.append((collection, pending))
+        return missing
+
+    @staticmethod
+    def _matches(info: dict, index) -> bool:
+        """Method that checks whether an existing index matches its declared definition."""
+        # text indexes are stored under internal keys, so compare their weights instead
+        if 'weights' in info:
+            return info['weights'] == index.document.get('weights')
+        key = list(index.document['key'].items())
+        return list(info['key']) == key and info.get('unique', False) == index.document.get('unique', False)
+
+    def apply(self, force: bool = False, progress = None) -> str:
+        """Method that runs pending migrations, builds any missing declared indexes and records the spec version."""
+        # skip the index listing entirely if the spec version is already applied
+        applied = self.get_applied_version()
+        if not force and applied >= INDEX_VERSION:
+            return Format.info(f'Indexes are up to date (version {INDEX_VERSION}).')
+        # build the missing indexes
+        try:
+            # migrations are idempotent, so a forced apply reruns all of them
+            for version, migration in sorted(MIGRATIONS.items()):
+                if force or version > applied:
+                    migration(self.bookCollection, progress)
+            missing = self.missing_indexes()
+            for collection, indexes in missing:
+                new = [index for index, info in indexes if info is None]
+                if new:
+                    self._build(collection, new, progress)
+                for index, info in indexes:
+                    if info is not None:
+                        self._replace(collection, index, info, progress)
+            self.metaCollection.update_one({'_id': META_ID}, {'$set': {'version': INDEX_VERSION}}, upsert=True)
+        except Exception as e:
+            return Format.warning(str(e))
+        # report what was built
+        built = sum(len(indexes) for collection, indexes in missing)
+        return Format.info(f'Indexes applied (version {INDEX_VERSION}, {built} built).')
+
+    def _replace(self, collection, index, info: dict, progress = None) -> None:
+        """Method that rebuilds an index whose definition changed without leaving the collection unindexed if the build fails."""
+        name = index.document['name']
+        options = {option: value for option, value in index.document.items() if option not in ('key', 'name')}
+        # a new key pattern can be built next to the old index first (only one text index is allowed per collection)
+        if 'weights' not in info and list(info['key']) != list(index.document['key'].items()):
+            temporary = IndexModel(list(index.document['key'].items()), name=f'{name}{TEMPORARY_SUFFIX}', **options)
+            self._build(collection, [temporary], progress)
+            collection.drop_index(name)
+            self._build(collection, [index], progress)
+            collection.drop_index(temporary.document['name'])
+            return
+        # the server refuses a second index on the same key pattern, so the new definition is checked before the old index is dropped
+        if index.document.get('unique'):
+            self._check_unique(collection, index)
+        collection.drop_index(name)
+        try:
+            self._build(collection, [index], progress)
+        except Exception:
+            # put the old index back before reporting the failure
+            keys = [(field, TEXT) for field in info['weights']] if 'weights' in info else list(info['key'])
+            collection.create_indexes([IndexModel(keys, name=name, **{option: value for option, value in info.items() if option in RESTORED_OPTIONS})])
+            raise
+
+    @staticmethod
+    def _check_unique(collection, index) -> None:
+        """Method that raises an error if the documents covered by a unique index have duplicate keys."""
+        fields = [field for field, direction in index.document['key'].items()]
+        duplicates = list(collection.aggregate([
+            {'$match': index.document.get('partialFilterExpression', {})},
+            {'$group': {'_id': {field.replace('.', '_'): f'${field}' for field in fields}, 'count': {'$sum': 1}}},
+            {'$match': {'count': {'$gt': 1}}},
+            {'$limit': 1},
+        ], allowDiskUse=True))
+        if duplicates:
+            raise ValueError(f'Index {index.document["name"]} was not rebuilt: {duplicates[0]["count"]} documents of {collection.name} share the key {duplicates[0]["_id"]}.')
+
+    def _build(self, collection, indexes: list, progress = None) -> None:
+        """Method that builds indexes on a collection, polling the server for build progress."""
+        # without a progress callback there is nothing to poll
+        if progress is None:
+            collection.create_indexes(indexes)
+            return
+        # run the build in a worker thread so the progress can be polled meanwhile
+        errors = []
+        def build():
+            try:
+                collection.create_indexes(indexes)
+            except Exception as e:
+                errors.append(e)
+        worker = Thread(target=build, daemon=True)
+        worker.start()
+        while worker.is_alive():
+            worker.join(PROGRESS_INTERVAL)
+            if worker.is_alive():
+                progress(collection.name, self._current_progress(collection))
+        # re-raise any build failure in the calling thread
+        if errors:
+            raise errors[0]
+        progress(collection.name, 'done')
+
+    def _current_progress(self, collection) -> str:
+        """Method that returns the progress message of the running index build on a collection."""
+        try:
+            ops = self.db.client.admin.command({'currentOp': 1, 'command.createIndexes': collection.name})
+        except Exception:
+            return 'building'
+        for op in ops.get('inprog', []):
+            if 'progress' in op:
+                done, total = op['progress'].get('done', 0), op['progress'].get('total', 0)
+                return f'{done}/{total}' if total else op.get('msg', 'building')
+        return 'building'
+
+    def drop(self) -> None:
+        """Method that drops the declared indexes and forgets the recorded spec version."""
+        for collection, indexes in self.spec:
+            existing = collection.index_information().keys()
+            for index in indexes:
+                if index.document['name'] in existing:
+                    collection.drop_index(index.document['name'])
+        self.metaCollection.delete_one({'_id': META_ID})
@@ -0,0 +1,63 @@
+# IMPORTS
+
+import re
+
+
+
+# CONSTANTS
+
+SEPARATORS = re.compile(r'[\s-]')
+ISBN13_PREFIX = '978'
+# prefix of the keys of legacy ISBNs that fail validation, which can never clash with an ISBN-13
+LEGACY_PREFIX = 'legacy:'
+
+
+
+# FUNCTIONS
+
+def isbn10_check_digit(digits: str) -> str:
+    """Function that computes the check digit of the first 9 digits of an ISBN-10."""
+    total = sum((10 - i) * int(d) for i, d in enumerate(digits))
+    check = (11 - total % 11) % 11
+    return 'X' if check == 10 else str(check)
+
+def isbn13_check_digit(digits: str) -> str:
+    """Function that computes the check digit of the first 12 digits of an ISBN-13."""
+    total = sum((3 if i % 2 else 1) * int(d) for i, d in enumerate(digits))
+    return str((10 - total % 10) % 10)
+
+def normalize_isbn(isbn: str) -> str:
+    """Function that validates an ISBN-10 or ISBN-13 and returns its canonical ISBN-13 form."""
+    # strip hyphens and spaces and uppercase a trailing 'x'
+    isbn = SEPARATORS.sub('', str(isbn)).upper()
+    # validate and convert an ISBN-10
+    if len(isbn) == 10:
+        if not isbn[:9].isdigit() or not (isbn[9].isdigit() or isbn[9] == 'X'):
+            raise ValueError(f'ISBN {isbn} is not a valid ISBN-10.')
+        if isbn10_check_digit(isbn[:9]) != isbn[9]:
+            raise ValueError(f'ISBN {isbn} has an invalid check digit.')
+        body = ISBN13_PREFIX + isbn[:9]
+        return body + isbn13_check_digit(body)
+    # validate an ISBN-13
+    if len(isbn) == 13:
+        if not isbn.isdigit():
+            raise ValueError(f'ISBN {isbn} is not a valid ISBN-13.')
+        if isbn13_check_digit(isbn[:12]) != isbn[12]:
+            raise ValueError(f'ISBN {isbn} has an invalid check digit.')
+        return isbn
+    raise ValueError(f'ISBN {isbn} must have 10 or 13 digits.')
+
+def is_valid_isbn(isbn: str) -> bool:
+    """Function that checks whether a string is a valid ISBN-10 or ISBN-13."""
+    try:
+        normalize_isbn(isbn)
+        return True
+    except ValueError:
+        return False
+
+def isbn_key(isbn: str) -> str:
+    """Function that returns the lookup key of an ISBN: its ISBN-13 form, or for a legacy ISBN that fails validation, its stripped form behind a prefix."""
+    try:
+        return normalize_isbn(isbn)
+    except ValueError:
+        return LEGACY_PREFIX + SEPARATORS.sub('', str(isbn)).upper()
@@ -7,9 +7,19 @@
 
 
 
-# Import the main function from menu.py
-from menu import main
+# Start the startup clock before any other import
+import timing
 
-# Run the main function
+# Import the modules needed to pick the mode
+import sys
+from cli import COMMANDS, main as cli_main
+
+# Run a script mode command if one was given, otherwise the interactive menu
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    timing.mark('imports')
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        cli_main(sys.argv[1:])
+    else:
+        # Import the main function from menu.py
+        from menu import main
+        main()
\ No newline at end of file
@@ -4,7 +4,18 @@ import sys
 import shutil
 from time import sleep
 from book_dao import BookDAO
+from book_pager import BookPager, PAGE_SIZE
+from query_cache import QueryCache
+from metrics import Metrics, SLOW_QUERY_LOG
+from write_behind import WriteBehind
+from book_replica import BookReplica, REPLICA_FILE
+from concurrent.futures import Future
+from bulk_import import read_rows, write_rejections, IMPORT_BATCH_SIZE
+from bulk_export import EXPORT_FORMATS
+from table_renderer import TableRenderer, open_pager
 from format import Format
+import timing
+from isbn import normalize_isbn
 
 
 
@@ -13,13 +24,17 @@ from format import Format
 WELCOME_STRING = 'BOOK MANAGER'
 EXIT_STRING = 'THANK YOU FOR USING BOOK MANAGER'
 WIDTH = 100 if (len(sys.argv) > 1 and 'fixed-width' in sys.argv) else shutil.get_terminal_size()[0]
+OUTPUT_FORMAT = 'csv' if (len(sys.argv) > 1 and 'csv-output' in sys.argv) else 'plain' if (len(sys.argv) > 1 and 'plain-output' in sys.argv) else 'table'
+PAGER = len(sys.argv) > 1 and 'pager' in sys.argv
+SPLASH = sys.stdout.isatty() and not (len(sys.argv) > 1 and 'no-splash' in sys.argv)
 MENU_OPTIONS = {
     1: 'Add a new publisher',
     2: 'Add a new book',
     3: 'Edit an existing book',
     4: 'Delete a book',
     5: 'Search books',
-    6: 'Exit',
+    6: 'Reports',
+    7: 'Exit',
 }
 SEARCH_MENU_OPTIONS = {
     1: 'Search all books',
@@ -29,10 +44,32 @@ SEARCH_MENU_OPTIONS = {
     5: 'Search by price range',
     6: 'Search by year',
     7: 'Search by title and publisher',
+    8: 'Search by combined filters',
+    9: 'Show the editions of a book',
+    10: 'Search by publisher city or phone',
 }
-DAO = BookDAO()
+REPORT_MENU_OPTIONS = {
+    1: 'Books per publisher',
+    2: 'Books per publisher city',
+    3: 'Price statistics by year',
+    4: 'Price histogram',
+}
+DAO = BookDAO(
+    QueryCache() if (len(sys.argv) > 1 and 'cache' in sys.argv) else None,
+    metrics=Metrics(log_path=SLOW_QUERY_LOG) if (len(sys.argv) > 1 and 'metrics' in sys.argv) else None,
+    writer=WriteBehind() if (len(sys.argv) > 1 and 'write-behind' in sys.argv) else None,
+    replica=BookReplica(REPLICA_FILE) if (len(sys.argv) > 1 and 'replica' in sys.argv) else None,
+)
+# batched writes whose results have not been printed yet
+PENDING_WRITES = []
 HIDDEN = {
     69: 'Delete a publisher',
+    70: 'Apply indexes',
+    71: 'Import books or publishers from a file',
+    72: 'Export books and publishers to files',
+    73: 'Show metrics',
+    74: 'Sweep books without a publisher',
+    75: 'Show replica status',
 }
 
 
@@ -50,16 +87,16 @@ def handle_interrupt() -> None:
     sys.exit(0)
 
 def print_menu(which: str = 'main') -> None:
-    """Function that prints either the main menu or the search menu to the console according to the parameter 'which'."""
+    """Function that prints the main menu, the search menu or the report menu to the console according to the parameter 'which'."""
     # create the menu string
-    menu_string = 'Menu Options' if which == 'main' else 'Search Menu Options'
+    menu_string = 'Menu Options' if which == 'main' else 'Search Menu Options' if which == 'search' else 'Report Menu Options'
     menu_string_underlined = Format.format(menu_string, ('underline', 'info'))
     header_width = WIDTH - len(menu_string) + len(menu_string_underlined)
     output = f'\n{"":-^{WIDTH}}' if which == 'main' else '\n'
     output += f'{menu_string_underlined: ^{header_width}}\n' if which == 'main' else f'{menu_string_underlined: <{header_width}}\n'
     current_line = ''
     # add the menu options to the menu string
-    menu = MENU_OPTIONS if which == 'main' else SEARCH_MENU_OPTIONS
+    menu = MENU_OPTIONS if which == 'main' else SEARCH_MENU_OPTIONS if which == 'search' else REPORT_MENU_OPTIONS
     # create the actual menu string
     for key, value in menu.items():
         option = f'{key}. {value}    '
@@ -72,6 +109,19 @@ def print_menu(which: str = 'main') -> None:
     # print the menu
     print(output)
 
+def print_write(result: str or Future) -> None:
+    """Function that prints the result of a write, or that it was queued when writes are batched."""
+    if type(result) == Future:
+        PENDING_WRITES.append(result)
+        print(Format.info('\nQueued, the result will be shown once the batch is written.'))
+    else:
+        print(f'\n{result}')
+
+def print_written() -> None:
+    """Function that prints the results of the batched writes that have been written, in the order they were made."""
+    while PENDING_WRITES and PENDING_WRITES[0].done():
+        print(f'\n{PENDING_WRITES.pop(0).result()}')
+
 def remove_quotes_and_handle_nulls(s: str) -> str:
     """Function that removes quotes from a string."""
     # strip the string of extra leading and trailing whitespaces
@@ -90,19 +140,24 @@ def run(debug: bool = False) -> None:
     option = -1
     # run the program loop until the user exits
     while True:
+        # print the results of the batched writes written since the last option
+        print_written()
+        # print the warning of the background index verification, once it has failed
+        if (warning := DAO.wait_for_indexes(0)):
+            print(f'\n{warning}')
         # print the menu
         print_menu()
         # try getting the user's option
         try:
-            option = int(input(Format.info('Please select a function, type [1 - 6] and press enter: ')))
+            option = int(input(Format.info('Please select a function, type [1 - 7] and press enter: ')))
         except KeyboardInterrupt:
             handle_interrupt()
         except:
-            print(Format.format('\nInvalid option. Please enter a number from 1 to 6.', ('bold', 'error')))
+            print(Format.format('\nInvalid option. Please enter a number from 1 to 7.', ('bold', 'error')))
             continue
         # carry out the action
         if option not in MENU_OPTIONS.keys() and option not in HIDDEN.keys():
-            print(Format.format('\nInvalid option. Please enter a number between 1 and 6.', ('bold', 'error')))
+            print(Format.format('\nInvalid option. Please enter a number between 1 and 7.', ('bold', 'error')))
             continue
         elif option == 1:
             option1()
@@ -120,10 +175,31 @@ def run(debug: bool = False) -> None:
             option5()
             continue
         elif option == 6:
+            option6()
+            continue
+        elif option == 7:
             break
         elif option == 69:
             option69()
             continue
+        elif option == 70:
+            option70()
+            continue
+        elif option == 71:
+            option71()
+            continue
+        elif option == 72:
+            option72()
+            continue
+        elif option == 73:
+            option73()
+            continue
+        elif option == 74:
+            option74()
+            continue
+        elif option == 75:
+            option75()
+            continue
     # close the database connection
     DAO.close()
 
@@ -168,7 +244,7 @@ def option1() -> None:
             handle_interrupt()
         break
     # add publisher and print result
-    print(f'\n{DAO.add_publisher(name, phone, city)}')
+    print_write(DAO.add_publisher(name, phone, city))
 
 def option2() -> None:
     """Function that handles the 'add a new book' option."""
@@ -182,11 +258,11 @@ def option2() -> None:
             isbn = remove_quotes_and_handle_nulls(input('Book ISBN ("<" to go back): '))
             if isbn == '<':
                 return
-            isbn_as_int = int(isbn)
+            normalize_isbn(isbn)
         except KeyboardInterrupt:
             handle_interrupt()
         except ValueError:
-            print(Format.format('Book ISBN must be an integer.', ('bold', 'error')))
+            print(Format.format('Book ISBN must be a valid ISBN-10 or ISBN-13.', ('bold', 'error')))
             continue
         if isbn == '':
             print(Format.format('Book ISBN cannot be empty.', ('bold', 'error')))
@@ -241,11 +317,11 @@ def option2() -> None:
             if previous_edition == '':
                 previous_edition = None
                 break
-            previous_edition_as_int = int(previous_edition)
+            normalize_isbn(previous_edition)
         except KeyboardInterrupt:
             handle_interrupt()
         except ValueError:
-            print(Format.format('Book previous edition must be an integer.', ('bold', 'error')))
+            print(Format.format('Book previous edition must be a valid ISBN-10 or ISBN-13.', ('bold', 'error')))
             continue
         break
     # get price loop
@@ -265,7 +341,7 @@ def option2() -> None:
             continue
         break
     # add book and print result
-    print(f'\n{DAO.add_book(isbn, title, year, published_by, previous_edition, price)}')
+    print_write(DAO.add_book(isbn, title, year, published_by, previous_edition, price))
 
 def option3() -> None:
     """Function that handles the 'edit an existing book' option."""
@@ -279,16 +355,19 @@ def option3() -> None:
             isbn = remove_quotes_and_handle_nulls(input('Book ISBN ("<" to go back): '))
             if isbn == '<':
                 return
-            isbn_as_int = int(isbn)
         except KeyboardInterrupt:
             handle_interrupt()
-        except ValueError:
-            print(Format.format('Book ISBN must be an integer.', ('bold', 'error')))
-            continue
         if isbn == '':
             print(Format.format('Book ISBN cannot be empty.', ('bold', 'error')))
             continue
         break
+    # show the book, remembering the version it is edited from
+    current = DAO.search_books_by_ISBN(isbn)
+    if type(current) == str or current == []:
+        print(Format.format(f'\n{current}' if current else f'\nBook {isbn} not found.', ('bold', 'error')))
+        return
+    print_results(current)
+    version = current[0].get('version', 0)
     # get title loop if change title
     try:
         current = input('Change title? [y/n]: ')
@@ -349,11 +428,11 @@ def option3() -> None:
                 if previous_edition == '':
                     previous_edition = None
                     break
-                previous_edition_as_int = int(previous_edition)
+                normalize_isbn(previous_edition)
             except KeyboardInterrupt:
                 handle_interrupt()
             except ValueError:
-                print(Format.format('Book previous edition must be an integer.', ('bold', 'error')))
+                print(Format.format('Book previous edition must be a valid ISBN-10 or ISBN-13.', ('bold', 'error')))
                 continue
             if previous_edition == '':
                 print(Format.format('Book previous edition cannot be empty.', ('bold', 'error')))
@@ -374,8 +453,13 @@ def option3() -> None:
                 print(Format.format('Book price must be a float.', ('bold', 'error')))
                 continue
             break
-    # edit book and print result
-    print(f'\n{DAO.edit_book(isbn, title, year, published_by, previous_edition, price)}')
+    # edit book and print result, or the edited book
+    result = DAO.edit_book(isbn, title, year, published_by, previous_edition, price, version, return_book=True)
+    if type(result) == dict:
+        print(Format.info(f'\nBook {isbn} edited successfully.'))
+        print_results([result])
+    else:
+        print_write(result)
 
 def option4() -> None:
     """Function that handles the 'delete a book' option."""
@@ -389,18 +473,14 @@ def option4() -> None:
             isbn = remove_quotes_and_handle_nulls(input('Book ISBN ("<" to go back): '))
             if isbn == '<':
                 return
-            isbn_as_int = int(isbn)
         except KeyboardInterrupt:
             handle_interrupt()
-        except ValueError:
-            print(Format.format('Book ISBN must be an integer.', ('bold', 'error')))
-            continue
         if isbn == '':
             print(Format.format('Book ISBN cannot be empty.', ('bold', 'error')))
             continue
         break
     # delete book and print result
-    print(f'\n{DAO.delete_book(isbn)}')
+    print_write(DAO.delete_book(isbn))
 
 def option5() -> None:
     """Function that handles the 'search books' option."""
@@ -416,18 +496,18 @@ def option5() -> None:
         except KeyboardInterrupt:
             handle_interrupt()
         except:
-            print(Format.format('\nInvalid option. Please enter a number from 1 to 7.', ('bold', 'error')))
+            print(Format.format('\nInvalid option. Please enter a number from 1 to 10.', ('bold', 'error')))
             continue
         if option in SEARCH_MENU_OPTIONS.keys():
             break
         else:
-            print(Format.format('\nInvalid option. Please enter a number between 1 and 7.', ('bold', 'error')))
+            print(Format.format('\nInvalid option. Please enter a number between 1 and 10.', ('bold', 'error')))
             continue
     # carry out the action
     result = None
     if option == 1:
         print('\nSearching all books')
-        result = DAO.search_all_books()
+        result = DAO.search_all_books(page_size=PAGE_SIZE)
     elif option == 2:
         print('\nSearching by title')
         title = None
@@ -440,19 +520,15 @@ def option5() -> None:
                 print(Format.format('\nBook title cannot be empty.', ('bold', 'error')))
                 continue
             break
-        result = DAO.search_books_by_title(title)
+        result = DAO.search_books_by_title(title, page_size=PAGE_SIZE)
     elif option == 3:
         print('\nSearching by ISBN')
         isbn = None
         while True:
             try:
                 isbn = remove_quotes_and_handle_nulls(input('Book ISBN: '))
-                isbn_as_int = int(isbn)
             except KeyboardInterrupt:
                 handle_interrupt()
-            except ValueError:
-                print(Format.format('\nBook ISBN must be an integer.', ('bold', 'error')))
-                continue
             if isbn == '':
                 print(Format.format('\nBook ISBN cannot be empty.', ('bold', 'error')))
                 continue
@@ -470,7 +546,7 @@ def option5() -> None:
                 print(Format.format('\nBook publisher cannot be empty.', ('bold', 'error')))
                 continue
             break
-        result = DAO.search_books_by_publisher(publisher)
+        result = DAO.search_books_by_publisher(publisher, page_size=PAGE_SIZE)
     elif option == 5:
         print('\nSearching by price range')
         minimum, maximum = None, None
@@ -492,7 +568,7 @@ def option5() -> None:
                 print(Format.format('\nMaximum price must be a float.', ('bold', 'error')))
                 continue
             break
-        result = DAO.search_books_by_price_range(minimum, maximum)
+        result = DAO.search_books_by_price_range(minimum, maximum, page_size=PAGE_SIZE)
     elif option == 6:
         print('\nSearching by year')
         year = None
@@ -508,7 +584,7 @@ def option5() -> None:
                 print(Format.format('\nBook year must be 4 digits long.', ('bold', 'error')))
                 continue
             break
-        result = DAO.search_books_by_year(year)
+        result = DAO.search_books_by_year(year, page_size=PAGE_SIZE)
     elif option == 7:
         print('\nSearching by title and publisher')
         title, publisher = None, None
@@ -530,37 +606,187 @@ def option5() -> None:
                 print(Format.format('\nBook publisher cannot be empty.', ('bold', 'error')))
                 continue
             break
-        result = DAO.search_books_by_title_and_publisher(title, publisher)
-    # print the result
+        result = DAO.search_books_by_title_and_publisher(title, publisher, page_size=PAGE_SIZE)
+    elif option == 8:
+        print('\nSearching by combined filters (leave a filter empty to skip it)')
+        criteria = {}
+        # text filters
+        try:
+            criteria['title'] = remove_quotes_and_handle_nulls(input('Title keywords: '))
+            criteria['published_by'] = remove_quotes_and_handle_nulls(input('Publisher (exact name): '))
+        except KeyboardInterrupt:
+            handle_interrupt()
+        # numeric filters
+        for key, prompt, cast, message in (
+            ('year_min', 'From year: ', int, 'Year must be an integer.'),
+            ('year_max', 'To year: ', int, 'Year must be an integer.'),
+            ('price_min', 'Minimum price: ', float, 'Minimum price must be a float.'),
+            ('price_max', 'Maximum price: ', float, 'Maximum price must be a float.'),
+        ):
+            while True:
+                try:
+                    value = remove_quotes_and_handle_nulls(input(prompt))
+                    criteria[key] = cast(value) if value else None
+                except KeyboardInterrupt:
+                    handle_interrupt()
+                except ValueError:
+                    print(Format.format(f'\n{message}', ('bold', 'error')))
+                    continue
+                break
+        result = DAO.search_books(criteria, page_size=PAGE_SIZE)
+    elif option == 9:
+        print('\nShowing the editions of a book')
+        isbn = None
+        while True:
+            try:
+                isbn = remove_quotes_and_handle_nulls(input('Book ISBN: '))
+            except KeyboardInterrupt:
+                handle_interrupt()
+            break
+        result = DAO.get_edition_chain(isbn)
+    elif option == 10:
+        print('\nSearching by publisher city or phone (leave one empty to skip it)')
+        city, phone = None, None
+        while True:
+            try:
+                city = remove_quotes_and_handle_nulls(input('Publisher city: '))
+                phone = remove_quotes_and_handle_nulls(input('Publisher phone: '))
+            except KeyboardInterrupt:
+                handle_interrupt()
+            if city == '' and phone == '':
+                print(Format.format('\nPublisher city and phone cannot both be empty.', ('bold', 'error')))
+                continue
+            break
+        result = DAO.search_books_by_publisher_details(city, phone)
+        # show the publisher details as columns of their own
+        if type(result) == list:
+            result = [{**book, **{f'publisher_{field}': value for field, value in book.pop('publisher', {}).items() if field != 'name'}} for book in result]
+    # print the result one page at a time
+    if isinstance(result, BookPager):
+        page_results(result)
+    else:
+        print_results(result)
+    return
+
+def page_results(pager: BookPager) -> None:
+    """Function that prints the results of a search page by page, letting the user move between pages."""
+    # print the first page
+    try:
+        print_results(pager.next_page())
+    except Exception as e:
+        print(Format.format(f'\n{str(e)}', ('bold', 'error')))
+        return
+    # page loop
+    while pager.has_next() or pager.has_previous():
+        try:
+            choice = input(f'\nPage {pager.page_number} ("n" next, "p" previous, "a" all results, "<" to go back): ').strip().lower()
+        except KeyboardInterrupt:
+            handle_interrupt()
+        if choice == '<':
+            return
+        elif choice == 'n' and pager.has_next():
+            page = pager.next_page
+        elif choice == 'p' and pager.has_previous():
+            page = pager.previous_page
+        elif choice == 'a':
+            # stream every result instead of paging through them
+            columns = DAO.get_fields()
+            if type(columns) == str:
+                print(Format.format(f'\n{columns}', ('bold', 'error')))
+                continue
+            try:
+                render_rows(pager, columns, extra_columns=True)
+            except Exception as e:
+                print(Format.format(f'\n{str(e)}', ('bold', 'error')))
+            continue
+        else:
+            print(Format.format('\nInvalid choice.', ('bold', 'error')))
+            continue
+        try:
+            print_results(page())
+        except Exception as e:
+            print(Format.format(f'\n{str(e)}', ('bold', 'error')))
+            return
+
+def print_results(result: list or str) -> None:
+    """Function that prints a list of books as a table."""
     if result == None or result == []:
         print(Format.format('\nNo results found.', ('bold', 'info')))
     elif type(result) == str:
         print(Format.format(f'\n{result}', ('bold', 'error')))
     else:
-        columns = {}
         print(Format.format('\nSearch results:', ('bold', 'info')))
         column_data = DAO.get_fields()
         if type(column_data) == str:
             print(Format.format(f'\n{column_data}', ('bold', 'error')))
             return
+        # fields missing from the catalog but present in the sampled results still get a column
+        render_rows(result, column_data, extra_columns=True)
+
+def render_rows(rows, columns: list, extra_columns: bool = False) -> None:
+    """Function that streams rows through the table renderer, into the pager when it is enabled."""
+    width = WIDTH if (len(sys.argv) > 1 and 'adaptive-table' in sys.argv) else 0
+    pager = open_pager() if PAGER else None
+    out = pager.stdin if pager else sys.stdout
+    try:
+        TableRenderer(columns, out, OUTPUT_FORMAT, width, extra_columns=extra_columns).render(rows)
+    except BrokenPipeError:
+        # the pager was closed before every row was written
+        pass
+    finally:
+        if pager:
+            try:
+                pager.stdin.close()
+            except BrokenPipeError:
+                pass
+            pager.wait()
+
+def option6() -> None:
+    """Function that handles the 'reports' option."""
+    # print report menu
+    print_menu(which = 'reports')
+    # get user input
+    while True:
+        try:
+            option = input('\nReport ("<" to go back): ')
+            if option == '<':
+                return
+            option = int(option)
+        except KeyboardInterrupt:
+            handle_interrupt()
+        except:
+            print(Format.format('\nInvalid option. Please enter a number from 1 to 4.', ('bold', 'error')))
+            continue
+        if option in REPORT_MENU_OPTIONS.keys():
+            break
         else:
-            for field in column_data:
-                width = max([len(str(book[field])) for book in result] + [len(field)])
-                columns[field] = width
-            if len(sys.argv) > 1 and 'adaptive-table' in sys.argv:
-                total_width = sum(columns.values()) + len(columns) * 3 - 1
-                for key, value in columns.items():
-                    columns[key] = round(value / total_width * WIDTH)
-            output = ''
-            for key, value in columns.items():
-                output += f'{key: ^{value}} | '
-            print(Format.format(output[:-3], ('bold', 'main')))
-        for book in result:
-            output = ''
-            for field in book:
-                output += f'{str(book[field]): ^{columns[field]}} | '
-            print(output[:-3])
-    return
+            print(Format.format('\nInvalid option. Please enter a number between 1 and 4.', ('bold', 'error')))
+            continue
+    # run the report on the server and print the aggregated rows
+    if option == 1:
+        print_report(DAO.report_books_per_publisher(), ['publisher', 'books', 'avg_price'])
+    elif option == 2:
+        print_report(DAO.report_books_per_city(), ['city', 'publishers', 'books'])
+    elif option == 3:
+        print_report(DAO.report_price_by_year(), ['year', 'books', 'priced', 'min', 'avg', 'max', 'p50', 'p90', 'p99'])
+    elif option == 4:
+        result = DAO.report_price_histogram()
+        if type(result) == str:
+            print_report(result, [])
+            return
+        stats = result['stats']
+        print(Format.format(f'\n{stats.get("books", 0)} books, {stats.get("priced", 0)} with a price (min {stats.get("min")}, avg {stats.get("avg")}, max {stats.get("max")})', ('bold', 'info')))
+        print_report(result['buckets'], ['price', 'books'])
+
+def print_report(result: list or str, columns: list) -> None:
+    """Function that prints the rows of a report as a table."""
+    if result == None or result == []:
+        print(Format.format('\nNo books to report on.', ('bold', 'info')))
+    elif type(result) == str:
+        print(Format.format(f'\n{result}', ('bold', 'error')))
+    else:
+        print()
+        render_rows(result, columns)
 
 def option69() -> None:
     """Function that handles the 'delete a publisher' option."""
@@ -580,18 +806,241 @@ def option69() -> None:
             print('Publisher name cannot be empty.')
             continue
         break
+    # get cascade loop
+    cascade, reassign_to = None, None
+    while True:
+        try:
+            choice = remove_quotes_and_handle_nulls(input('Books of the publisher ("k" keep, "d" delete, "r" reassign): ')).lower()
+        except KeyboardInterrupt:
+            handle_interrupt()
+        if choice not in ('k', 'd', 'r'):
+            print(Format.format('\nInvalid choice.', ('bold', 'error')))
+            continue
+        cascade = {'k': None, 'd': 'delete', 'r': 'reassign'}[choice]
+        break
+    # get new publisher loop
+    while cascade == 'reassign':
+        try:
+            reassign_to = remove_quotes_and_handle_nulls(input('New publisher name: '))
+        except KeyboardInterrupt:
+            handle_interrupt()
+        if reassign_to == '':
+            print(Format.format('\nNew publisher name cannot be empty.', ('bold', 'error')))
+            continue
+        break
     # delete publisher and print result
-    print(f'\n{DAO.delete_publisher(name)}')
+    print(f'\n{DAO.delete_publisher(name, cascade, reassign_to)}')
+
+def option70() -> None:
+    """Function that handles the 'apply indexes' option."""
+    # print the header
+    print(Format.main('Hidden: Apply indexes'))
+    # rebuild any missing indexes, printing the build progress as it goes
+    def progress(collection: str, status: str) -> None:
+        print(Format.info(f'Building indexes on {collection}: {status}'))
+    print(f'\n{DAO.create_indexes(force=True, progress=progress)}')
+
+def option71() -> None:
+    """Function that handles the 'import books or publishers from a file' option."""
+    # print the header
+    print(Format.main('Hidden: Import books or publishers from a file'))
+    # set variables to None
+    kind, path, batch_size, start = None, None, None, None
+    # get kind loop
+    while True:
+        try:
+            kind = remove_quotes_and_handle_nulls(input('Import books or publishers? [b/p] ("<" to go back): ')).lower()
+            if kind == '<':
+                return
+        except KeyboardInterrupt:
+            handle_interrupt()
+        if kind not in ('b', 'p'):
+            print(Format.format('Please enter b or p.', ('bold', 'error')))
+            continue
+        break
+    # get path loop
+    while True:
+        try:
+            path = remove_quotes_and_handle_nulls(input('CSV or JSONL file path ("<" to go back): '))
+            if path == '<':
+                return
+        except KeyboardInterrupt:
+            handle_interrupt()
+        if path == '':
+            print(Format.format('File path cannot be empty.', ('bold', 'error')))
+            continue
+        break
+    # get batch size loop
+    while True:
+        try:
+            batch_size = remove_quotes_and_handle_nulls(input(f'Batch size (default {IMPORT_BATCH_SIZE}): '))
+            batch_size = int(batch_size) if batch_size else IMPORT_BATCH_SIZE
+        except KeyboardInterrupt:
+            handle_interrupt()
+        except ValueError:
+            print(Format.format('Batch size must be an integer.', ('bold', 'error')))
+            continue
+        if batch_size < 1:
+            print(Format.format('Batch size must be positive.', ('bold', 'error')))
+            continue
+        break
+    # get start offset loop
+    while True:
+        try:
+            start = remove_quotes_and_handle_nulls(input('Resume after row (default 0): '))
+            start = int(start) if start else 0
+        except KeyboardInterrupt:
+            handle_interrupt()
+        except ValueError:
+            print(Format.format('Row must be an integer.', ('bold', 'error')))
+            continue
+        break
+    # import the rows, printing the progress after each batch
+    def progress(report: dict) -> None:
+        print(Format.info(f'Rows handled: {report["offset"]}, inserted: {report["inserted"]}, rejected: {len(report["rejected"])}'), end='\r', flush=True)
+    importer = DAO.import_books if kind == 'b' else DAO.import_publishers
+    report = importer(read_rows(path), batch_size, start, progress)
+    print()
+    # write the rejected rows report
+    if report['rejected']:
+        write_rejections(f'{path}.rejected.csv', report['rejected'])
+        print(Format.warning(f'{len(report["rejected"])} rows rejected, see {path}.rejected.csv'))
+    if report['error']:
+        print(Format.format(f'\nImport stopped: {report["error"]}\nResume after row {report["offset"]}.', ('bold', 'error')))
+    else:
+        print(Format.info(f'\n{report["inserted"]} rows imported.'))
+
+def option72() -> None:
+    """Function that handles the 'export books and publishers to files' option."""
+    # print the header
+    print(Format.main('Hidden: Export books and publishers to files'))
+    # set variables to None
+    out_dir, fmt, partitions = None, None, None
+    # get directory loop
+    while True:
+        try:
+            out_dir = remove_quotes_and_handle_nulls(input('Output directory ("<" to go back): '))
+            if out_dir == '<':
+                return
+        except KeyboardInterrupt:
+            handle_interrupt()
+        if out_dir == '':
+            print(Format.format('Output directory cannot be empty.', ('bold', 'error')))
+            continue
+        break
+    # get format loop
+    while True:
+        try:
+            fmt = remove_quotes_and_handle_nulls(input(f'Format [{"/".join(EXPORT_FORMATS)}] (default {EXPORT_FORMATS[0]}): ')).lower() or EXPORT_FORMATS[0]
+        except KeyboardInterrupt:
+            handle_interrupt()
+        if fmt not in EXPORT_FORMATS:
+            print(Format.format(f'Format must be one of {", ".join(EXPORT_FORMATS)}.', ('bold', 'error')))
+            continue
+        break
+    # get partitions loop
+    while True:
+        try:
+            partitions = remove_quotes_and_handle_nulls(input('Book partitions (default 1): '))
+            partitions = int(partitions) if partitions else 1
+        except KeyboardInterrupt:
+            handle_interrupt()
+        except ValueError:
+            print(Format.format('Partitions must be an integer.', ('bold', 'error')))
+            continue
+        if partitions < 1:
+            print(Format.format('Partitions must be positive.', ('bold', 'error')))
+            continue
+        break
+    # export both collections and print the result
+    for manifest in (DAO.export_books(out_dir, fmt, partitions), DAO.export_publishers(out_dir, fmt)):
+        if type(manifest) == str:
+            print(f'\n{manifest}')
+        else:
+            print(Format.info(f'\n{manifest["collection"]}: {manifest["rows"]} rows in {len(manifest["shards"])} files.'))
+
+def option73() -> None:
+    """Function that handles the 'show metrics' option."""
+    # print the header
+    print(Format.main('Hidden: Show metrics'))
+    if DAO.metrics is None:
+        print(Format.format('\nMetrics are disabled. Run with the metrics argument to enable them.', ('bold', 'error')))
+        return
+    # print one line per method
+    snapshot = DAO.metrics.snapshot()
+    print(Format.format(f'\n{"method":<40}{"calls":>8}{"errors":>8}{"results":>10}{"mean ms":>12}{"max ms":>12}', ('bold', 'main')))
+    for name, method in snapshot['methods'].items():
+        print(f'{name:<40}{method["calls"]:>8}{method["errors"]:>8}{method["results"]:>10}{method["mean_ms"]:>12}{method["max_ms"]:>12}')
+    print(Format.info(f'\nSlow queries (over {snapshot["slow_query_ms"]} ms): {snapshot["slow_queries"]}'))
+
+def option74() -> None:
+    """Function that handles the 'sweep books without a publisher' option."""
+    # print the header
+    print(Format.main('Hidden: Sweep books without a publisher'))
+    # find the orphaned books first
+    report = DAO.sweep_orphans()
+    if type(report) == str:
+        print(f'\n{report}')
+        return
+    if not report['books']:
+        print(Format.format('\nEvery book has a publisher.', ('bold', 'info')))
+        return
+    for name, books in report['publishers'].items():
+        print(f'{name}: {books} books')
+    print(Format.info(f'\n{report["books"]} books of {len(report["publishers"])} missing publishers.'))
+    # get the fix
+    while True:
+        try:
+            choice = remove_quotes_and_handle_nulls(input('Fix them ("d" delete, "r" reassign, "<" to go back): ')).lower()
+            if choice == '<':
+                return
+            reassign_to = remove_quotes_and_handle_nulls(input('New publisher name: ')) if choice == 'r' else None
+        except KeyboardInterrupt:
+            handle_interrupt()
+        if choice not in ('d', 'r') or reassign_to == '':
+            print(Format.format('\nInvalid choice.', ('bold', 'error')))
+            continue
+        break
+    def progress(report: dict) -> None:
+        print(Format.info(f'{report["fixed"]} books fixed'))
+    # fix the books and print the result
+    report = DAO.sweep_orphans('delete' if choice == 'd' else 'reassign', reassign_to, progress=progress)
+    if type(report) == str:
+        print(f'\n{report}')
+    else:
+        print(Format.info(f'\n{report["fixed"]} of {report["books"]} books fixed.'))
+
+def option75() -> None:
+    """Function that handles the 'show replica status' option."""
+    # print the header
+    print(Format.main('Hidden: Show replica status'))
+    if DAO.replica is None:
+        print(Format.format('\nThe replica is disabled. Run with the replica argument to enable it.', ('bold', 'error')))
+        return
+    # print the state and counters
+    stats = DAO.replica.stats()
+    state = 'ready' if stats['ready'] else 'warming up, searches use the server'
+    print(Format.info(f'\nReplica {state}: {stats["books"]} books, {stats["changes"]} changes applied, {stats["reloads"]} full loads.'))
+    if stats['age_seconds'] is not None:
+        print(Format.info(f'Loaded {stats["age_seconds"]} seconds ago.'))
+    if stats['error']:
+        print(Format.warning(f'Last change stream error: {stats["error"]}'))
 
 def main() -> None:
     # print welcome message
     print(Format.format(f'\n\n\n{"":*^{WIDTH}}', ('bold', 'main')))
     welcome = f'{WELCOME_STRING:-^{WIDTH}}'
-    for i in range(1, WIDTH + 1):
-        print(Format.format(welcome[:i], ('bold', 'main')), end='\r', flush=True)
-        sleep(1 / WIDTH)
-    print()
-    # run the program
+    # animate the welcome message only on an interactive terminal
+    if SPLASH:
+        for i in range(1, WIDTH + 1):
+            print(Format.format(welcome[:i], ('bold', 'main')), end='\r', flush=True)
+            sleep(1 / WIDTH)
+        print()
+    else:
+        print(Format.format(welcome, ('bold', 'main')))
+    # report the startup time and run the program
+    timing.mark('menu')
+    timing.report()
     run()
     # print exit message
     print(Format.format(f'\n\n{EXIT_STRING:-^{WIDTH}}\n{"":*^{WIDTH}}\n\n', ('bold', 'main')))
@@ -0,0 +1,182 @@
+# IMPORTS
+
+import os
+import random
+import logging
+from bisect import bisect_left
+from functools import wraps
+from threading import Thread, Lock, Event
+from time import perf_counter
+from format import Format
+
+
+
+# CONSTANTS
+
+# upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = [0.5, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, float('inf')]
+SLOW_QUERY_MS = 100
+EXPLAIN_SAMPLE_RATE = 0.1
+# sampled slow queries waiting to be explained, beyond which new samples are logged without explain statistics
+EXPLAIN_QUEUE_SIZE = 100
+SLOW_QUERY_LOG = 'slow_queries.log'
+LOGGER = logging.getLogger('bookmanager.slow_query')
+# the slow queries go to the file given to Metrics, never to stderr through logging's fallback handler
+LOGGER.addHandler(logging.NullHandler())
+
+
+
+# FUNCTIONS
+
+def instrumented(method):
+    """Function that decorates a BookDAO method to record its latency, result count and errors when metrics are enabled."""
+    name = method.__name__
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        # without metrics the only overhead is this check
+        metrics = self.metrics
+        if metrics is None:
+            return method(self, *args, **kwargs)
+        start = perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+        except Exception:
+            metrics.record(name, perf_counter() - start, None, True)
+            raise
+        error = type(result) == str and Format.is_warning(result)
+        metrics.record(name, perf_counter() - start, len(result) if type(result) == list else None, error)
+        return result
+    return wrapper
+
+def query_shape(value):
+    """Function that replaces the values of a filter with their type names, keeping its operators and fields."""
+    if isinstance(value, dict):
+        return {key: query_shape(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [query_shape(item) for item in value]
+    return type(value).__name__
+
+def find_index_names(plan: dict) -> list:
+    """Function that returns the names of the indexes used by a query plan."""
+    names = [plan['indexName']] if 'indexName' in plan else []
+    for child in [plan.get('inputStage')] + plan.get('inputStages', []):
+        if child:
+            names += find_index_names(child)
+    return names
+
+
+
+# METRICS CLASS
+
+class Metrics:
+    """Class that collects per-method latency histograms and logs slow queries."""
+    def __init__(self, slow_ms: float = SLOW_QUERY_MS, sample_rate: float = EXPLAIN_SAMPLE_RATE, log_path: str = None):
+        """Constructor method."""
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        self.lock = Lock()
+        self.methods = {}
+        self.slow_queries = 0
+        # sampled slow queries are explained by a background thread, off the request path
+        self.explains = []
+        self.wake = Event()
+        self.thread = None
+        if log_path:
+            self._log_to(log_path)
+
+    @staticmethod
+    def _log_to(path: str) -> None:
+        """Method that writes the slow query log to a file, once per file."""
+        path = os.path.abspath(path)
+        if any(isinstance(handler, logging.FileHandler) and handler.baseFilename == path for handler in LOGGER.handlers):
+            return
+        handler = logging.FileHandler(path, encoding='utf-8', delay=True)
+        handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+        LOGGER.addHandler(handler)
+        LOGGER.setLevel(logging.WARNING)
+
+    def record(self, name: str, seconds: float, results: int or None, error: bool) -> None:
+        """Method that records one call of a method."""
+        ms = seconds * 1000
+        with self.lock:
+            method = self.methods.get(name)
+            if method is None:
+                method = self.methods[name] = {'calls': 0, 'errors': 0, 'results': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'buckets': [0] * len(BUCKETS_MS)}
+            method['calls'] += 1
+            method['errors'] += bool(error)
+            method['results'] += results or 0
+            method['total_ms'] += ms
+            method['max_ms'] = max(method['max_ms'], ms)
+            method['buckets'][bisect_left(BUCKETS_MS, ms)] += 1
+
+    def record_query(self, collection, fltr: dict, sort: list, limit: int, seconds: float) -> None:
+        """Method that logs a query slower than the threshold, with explain statistics for a sample of them."""
+        ms = seconds * 1000
+        if ms < self.slow_ms:
+            return
+        with self.lock:
+            self.slow_queries += 1
+        entry = {'collection': collection.name, 'filter': query_shape(fltr), 'ms': round(ms, 3)}
+        # a sampled query is logged once the background thread has explained it
+        if random.random() < self.sample_rate:
+            with self.lock:
+                if len(self.explains) < EXPLAIN_QUEUE_SIZE:
+                    self.explains.append((entry, collection, fltr, sort, limit))
+                    if self.thread is None:
+                        self.thread = Thread(target=self._explain_queued, daemon=True)
+                        self.thread.start()
+                    self.wake.set()
+                    return
+        LOGGER.warning('slow query %s', entry)
+
+    def _explain_queued(self) -> None:
+        """Method that explains and logs the sampled slow queries as they are queued."""
+        while True:
+            self.wake.wait()
+            with self.lock:
+                explains, self.explains = self.explains, []
+                self.wake.clear()
+            for entry, collection, fltr, sort, limit in explains:
+                entry.update(self.explain(collection, fltr, sort, limit))
+                LOGGER.warning('slow query %s', entry)
+
+    @staticmethod
+    def explain(collection, fltr: dict, sort: list, limit: int) -> dict:
+        """Method that returns the documents examined and returned, and the indexes used, by a query."""
+        command = {'find': collection.name, 'filter': fltr}
+        if sort:
+            command['sort'] = dict(sort)
+        if limit:
+            command['limit'] = limit
+        try:
+            explained = collection.database.command('explain', command, verbosity='executionStats')
+        except Exception as e:
+            return {'explain_error': str(e)}
+        stats = explained.get('executionStats', {})
+        return {
+            'docs_examined': stats.get('totalDocsExamined'),
+            'keys_examined': stats.get('totalKeysExamined'),
+            'returned': stats.get('nReturned'),
+            'indexes': find_index_names(explained.get('queryPlanner', {}).get('winningPlan', {})),
+        }
+
+    def snapshot(self) -> dict:
+        """Method that returns a copy of the collected metrics with mean latencies and labeled buckets."""
+        with self.lock:
+            methods = {}
+            for name, method in self.methods.items():
+                methods[name] = {
+                    'calls': method['calls'],
+                    'errors': method['errors'],
+                    'results': method['results'],
+                    'mean_ms': round(method['total_ms'] / method['calls'], 4),
+                    'max_ms': round(method['max_ms'], 4),
+                    'buckets_ms': {str(bound): count for bound, count in zip(BUCKETS_MS, method['buckets'])},
+                }
+            return {'methods': methods, 'slow_queries': self.slow_queries, 'slow_query_ms': self.slow_ms}
+
+    def reset(self) -> None:
+        """Method that clears the collected metrics."""
+        with self.lock:
+            self.methods.clear()
+            self.slow_queries = 0
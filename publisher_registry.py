@@ -0,0 +1,52 @@
+# IMPORTS
+
+from threading import Lock
+
+
+
+# PUBLISHER REGISTRY CLASS
+
+class PublisherRegistry:
+    """Class that keeps the names of the publishers in memory, loaded once and updated by the publisher writes."""
+    def __init__(self):
+        """Constructor method."""
+        self.lock = Lock()
+        self.names = set()
+        self.loaded = False
+
+    def load(self, collection) -> None:
+        """Method that reads every publisher name from the collection."""
+        names = {publisher['name'] for publisher in collection.find({}, {'_id': 0, 'name': 1}) if 'name' in publisher}
+        # names added while loading (e.g. queued by the write-behind writer) are kept
+        with self.lock:
+            self.names |= names
+            self.loaded = True
+
+    def exists(self, collection, name: str) -> bool:
+        """Method that checks whether a publisher exists, querying the collection only for names it does not know."""
+        if not self.loaded:
+            self.load(collection)
+        with self.lock:
+            if name in self.names:
+                return True
+        # the publisher may have been added by another process since the names were loaded
+        if collection.find_one({'name': name}, {'_id': 1}) is None:
+            return False
+        self.add(name)
+        return True
+
+    def add(self, name: str) -> None:
+        """Method that records an added publisher."""
+        with self.lock:
+            self.names.add(name)
+
+    def remove(self, name: str) -> None:
+        """Method that records a deleted publisher."""
+        with self.lock:
+            self.names.discard(name)
+
+    def invalidate(self) -> None:
+        """Method that forgets the names so that the next check loads them again."""
+        with self.lock:
+            self.names = set()
+            self.loaded = False
@@ -1,6 +1,12 @@
 # IMPORTS
 
+import os
+import json
+from threading import Lock
+from urllib.parse import quote_plus
 from pymongo import MongoClient
+from pymongo.errors import ConfigurationError
+from storage_backend import StorageBackend
 
 
 
@@ -13,25 +19,127 @@ PORT = '27017'
 DBNAME = 'bookmanager'
 PUBLISHER_COLLECTION = 'Publisher'
 BOOK_COLLECTION = 'Book'
+CONFIG_ENV = 'BOOKMANAGER_CONFIG'
+ENV_PREFIX = 'BOOKMANAGER_'
+# settings and their defaults, each overridable by a config file entry or a BOOKMANAGER_<NAME> environment variable
+DEFAULT_SETTINGS = {
+    'user': USER,
+    'password': PASSWORD,
+    'hosts': HOST,
+    'port': PORT,
+    'dbname': DBNAME,
+    'auth_source': 'admin',
+    'max_pool_size': 100,
+    'min_pool_size': 0,
+    'connect_timeout_ms': 20000,
+    'socket_timeout_ms': 0,
+    'server_selection_timeout_ms': 30000,
+    'compressors': '',
+    'write_concern': '',
+    'read_concern': '',
+    'replica_set': '',
+    # 'mongodb' or 'embedded', the in-process engine persisted to 'embedded_path' (in memory if empty)
+    'backend': 'mongodb',
+    'embedded_path': '',
+}
+# the shared clients, keyed by their URI and options
+CLIENTS = {}
+CLIENTS_LOCK = Lock()
+
+
+
+# FUNCTIONS
+
+def load_settings() -> dict:
+    """Function that loads the connection settings from the defaults, the config file and the environment."""
+    settings = dict(DEFAULT_SETTINGS)
+    # the JSON config file named by BOOKMANAGER_CONFIG overrides the defaults
+    path = os.environ.get(CONFIG_ENV)
+    if path:
+        with open(path, encoding='utf-8') as file:
+            settings.update({key: value for key, value in json.load(file).items() if key in DEFAULT_SETTINGS})
+    # environment variables override the config file
+    for key, default in DEFAULT_SETTINGS.items():
+        name = ENV_PREFIX + key.upper()
+        value = os.environ.get(name)
+        if value is not None:
+            try:
+                settings[key] = type(default)(value)
+            except ValueError:
+                raise ConfigurationError(f'Invalid value {value!r} for {name}: expected {"an integer" if type(default) == int else "a string"} like the default {default!r}.')
+    return settings
+
+def build_uri(settings: dict) -> str:
+    """Function that builds the connection URI, adding the port to every host that does not have one."""
+    hosts = [host.strip() for host in str(settings['hosts']).split(',') if host.strip()]
+    hosts = ','.join(host if ':' in host else f'{host}:{settings["port"]}' for host in hosts)
+    credentials = f'{quote_plus(settings["user"])}:{quote_plus(settings["password"])}@' if settings['user'] else ''
+    return f'mongodb://{credentials}{hosts}/?authSource={settings["auth_source"]}'
+
+def client_options(settings: dict) -> dict:
+    """Function that turns the settings into MongoClient options."""
+    options = {
+        'maxPoolSize': int(settings['max_pool_size']),
+        'minPoolSize': int(settings['min_pool_size']),
+        'connectTimeoutMS': int(settings['connect_timeout_ms']),
+        'socketTimeoutMS': int(settings['socket_timeout_ms']) or None,
+        'serverSelectionTimeoutMS': int(settings['server_selection_timeout_ms']),
+    }
+    # optional options are only passed when set
+    if settings['compressors']:
+        options['compressors'] = settings['compressors']
+    if settings['write_concern']:
+        w = str(settings['write_concern'])
+        options['w'] = int(w) if w.isdigit() else w
+    if settings['read_concern']:
+        options['readConcernLevel'] = settings['read_concern']
+    if settings['replica_set']:
+        options['replicaSet'] = settings['replica_set']
+    return options
+
+def acquire_client(uri: str, options: dict) -> MongoClient:
+    """Function that returns the shared client for a URI and options, creating it on first use."""
+    key = (uri, tuple(sorted(options.items())))
+    with CLIENTS_LOCK:
+        if key not in CLIENTS:
+            CLIENTS[key] = [MongoClient(uri, **options), 0]
+        CLIENTS[key][1] += 1
+        return CLIENTS[key][0]
+
+def release_client(client: MongoClient) -> None:
+    """Function that releases a shared client, closing it when its last user releases it."""
+    with CLIENTS_LOCK:
+        for key, (shared, users) in list(CLIENTS.items()):
+            if shared is client:
+                if users <= 1:
+                    del CLIENTS[key]
+                    client.close()
+                else:
+                    CLIENTS[key][1] -= 1
+                return
 
 
 
 # CONNECTION CLASS
 
-class DBConnection:
+class DBConnection(StorageBackend):
     """Class that represents a database connection."""
-    def __init__(self, user: str = USER, password: str = PASSWORD, host: str = HOST, port: str = PORT, dbname: str = DBNAME, publisherCollection: str = PUBLISHER_COLLECTION, bookCollection: str = BOOK_COLLECTION):
+    def __init__(self, user: str = None, password: str = None, host: str = None, port: str = None, dbname: str = None, publisherCollection: str = PUBLISHER_COLLECTION, bookCollection: str = BOOK_COLLECTION, settings: dict = None):
         """Constructor method."""
-        # connect to the database
-        self.client = MongoClient(f'mongodb://{user}:{password}@{host}')
-        self.db = self.client[dbname]
+        # load the settings, letting the arguments override them
+        self.settings = dict(settings or load_settings())
+        overrides = {'user': user, 'password': password, 'hosts': host, 'port': port, 'dbname': dbname}
+        self.settings.update({key: value for key, value in overrides.items() if value is not None})
+        # connect to the database through the shared client
+        self.client = acquire_client(build_uri(self.settings), client_options(self.settings))
+        self.db = self.client[self.settings['dbname']]
         self.publisher_collection = self.db[publisherCollection]
         self.book_collection = self.db[bookCollection]
 
     def getClient(self):
         """Method that returns the client."""
         return self.client
-    
+
     def getDB(self):
         """Method that returns the database."""
         return self.db
@@ -39,11 +147,11 @@ class DBConnection:
     def getPublisherCollection(self):
         """Method that returns the collection."""
         return self.publisher_collection
-    
+
     def getBookCollection(self):
         """Method that returns the collection."""
         return self.book_collection
-    
+
     def close(self):
-        """Method that closes the connection to the database."""
-        self.client.close()
+        """Method that releases the connection to the database, closing the shared client if no one else uses it."""
+        release_client(self.client)
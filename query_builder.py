@@ -0,0 +1,180 @@
+# IMPORTS
+
+from isbn import isbn_key
+
+
+
+# CONSTANTS
+
+CRITERIA = ('title', 'ISBN', 'published_by', 'year', 'year_min', 'year_max', 'price_min', 'price_max', 'previous_edition')
+PUBLISHER_FIELDS = ('city', 'phone')
+EDITION_DIRECTIONS = ('both', 'previous', 'next')
+# most editions followed in each direction
+EDITION_DEPTH = 50
+SORT_FIELDS = ('ISBN', 'title', 'year', 'published_by', 'price', 'relevance')
+# compound indexes in order of preference, with the criteria each one serves (equality fields first)
+INDEX_PLANS = [
+    ('published_by_1_year_1', ('published_by',), ('year', 'year_min', 'year_max')),
+    ('published_by_1_price_1', ('published_by',), ('price_min', 'price_max')),
+    ('year_1_price_1', ('year',), ('price_min', 'price_max')),
+    ('published_by_1_title_1', ('published_by',), ()),
+    ('year_1', (), ('year', 'year_min', 'year_max')),
+    ('price_1', (), ('price_min', 'price_max')),
+]
+
+
+
+# FUNCTIONS
+
+def clean_criteria(criteria: dict) -> dict:
+    """Function that drops the empty criteria and rejects the unknown ones."""
+    criteria = {key: value for key, value in criteria.items() if value not in (None, '')}
+    unknown = [key for key in criteria if key not in CRITERIA]
+    if unknown:
+        raise ValueError(f'Unknown search criteria: {", ".join(unknown)}.')
+    return criteria
+
+def build_filter(criteria: dict) -> dict:
+    """Function that composes the criteria into one server-side filter."""
+    fltr = {}
+    if 'title' in criteria:
+        fltr['$text'] = {'$search': criteria['title']}
+    if 'ISBN' in criteria:
+        fltr['ISBN13'] = isbn_key(criteria['ISBN'])
+    if 'previous_edition' in criteria:
+        fltr['previous_edition'] = isbn_key(criteria['previous_edition'])
+    if 'published_by' in criteria:
+        fltr['published_by'] = criteria['published_by']
+    # an exact year wins over a year range
+    if 'year' in criteria:
+        fltr['year'] = int(criteria['year'])
+    elif 'year_min' in criteria or 'year_max' in criteria:
+        fltr['year'] = bounds(criteria.get('year_min'), criteria.get('year_max'), int)
+    if 'price_min' in criteria or 'price_max' in criteria:
+        fltr['price'] = bounds(criteria.get('price_min'), criteria.get('price_max'), float)
+    return fltr
+
+def bounds(low, high, cast) -> dict:
+    """Function that creates an inclusive range condition from optional bounds."""
+    condition = {}
+    if low not in (None, ''):
+        condition['$gte'] = cast(low)
+    if high not in (None, ''):
+        condition['$lte'] = cast(high)
+    return condition
+
+def build_sort(sort: list, criteria: dict) -> list or None:
+    """Function that turns (field, direction) pairs into a sort, relevance meaning the text score."""
+    if not sort:
+        # text searches are ranked by relevance unless another sort is asked for
+        return [('score', {'$meta': 'textScore'})] if 'title' in criteria else None
+    result = []
+    for field, direction in sort:
+        if field not in SORT_FIELDS:
+            raise ValueError(f'Cannot sort by {field}.')
+        if field == 'relevance':
+            if 'title' not in criteria:
+                raise ValueError('Sorting by relevance needs title keywords.')
+            result.append(('score', {'$meta': 'textScore'}))
+        else:
+            result.append((field, 1 if direction >= 0 else -1))
+    return result
+
+def build_projection(fields: list) -> dict:
+    """Function that creates the projection of the requested fields, or of every stored field if none are given."""
+    if not fields:
+        return {'_id': 0, 'ISBN13': 0}
+    return {'_id': 0, **{field: 1 for field in fields}}
+
+def build_publisher_join(fltr: dict, publisher_collection: str, sort: list = None, limit: int = 0) -> list:
+    """Function that creates the pipeline of the books matching a filter, each with the details of its publisher."""
+    pipeline = [{'$match': fltr}]
+    if sort:
+        pipeline.append({'$sort': dict(sort)})
+    # limit before the join, so only the returned books look up their publisher
+    if limit:
+        pipeline.append({'$limit': limit})
+    pipeline += [
+        {'$lookup': {'from': publisher_collection, 'localField': 'published_by', 'foreignField': 'name', 'as': 'publisher'}},
+        # publisher names are unique, and books of a missing publisher are kept without details
+        {'$unwind': {'path': '$publisher', 'preserveNullAndEmptyArrays': True}},
+        {'$project': {'_id': 0, 'ISBN13': 0, 'publisher._id': 0}},
+    ]
+    return pipeline
+
+def build_publisher_books(publisher_fltr: dict, book_collection: str, limit: int = 0) -> list:
+    """Function that creates the pipeline of the books of the publishers matching a filter, starting from the publishers."""
+    pipeline = [
+        {'$match': publisher_fltr},
+        {'$lookup': {'from': book_collection, 'localField': 'name', 'foreignField': 'published_by', 'as': 'book'}},
+        {'$unwind': '$book'},
+        {'$replaceRoot': {'newRoot': {'$mergeObjects': ['$book', {'publisher': {'name': '$name', 'phone': '$phone', 'city': '$city'}}]}}},
+        {'$project': {'_id': 0, 'ISBN13': 0}},
+    ]
+    if limit:
+        pipeline.append({'$limit': limit})
+    return pipeline
+
+def build_edition_chain(ISBN13: str, collection: str, depth: int = EDITION_DEPTH, direction: str = 'both') -> list:
+    """Function that creates the pipeline following the previous_edition links of a book backwards and forwards on the server."""
+    if direction not in EDITION_DIRECTIONS:
+        raise ValueError(f'Unknown edition direction: {direction}.')
+    if depth < 1:
+        raise ValueError('Edition depth must be at least 1.')
+    # $graphLookup never visits a book twice, so a cycle of editions ends the walk instead of looping
+    walk = {'from': collection, 'maxDepth': depth - 1, 'depthField': 'depth'}
+    pipeline = [{'$match': {'ISBN13': ISBN13}}]
+    if direction in ('both', 'previous'):
+        # the previous editions are found through the unique ISBN13 index
+        pipeline.append({'$graphLookup': {**walk, 'startWith': '$previous_edition', 'connectFromField': 'previous_edition', 'connectToField': 'ISBN13', 'as': 'previous'}})
+    if direction in ('both', 'next'):
+        # the next editions are found through the previous_edition index
+        pipeline.append({'$graphLookup': {**walk, 'startWith': '$ISBN13', 'connectFromField': 'ISBN13', 'connectToField': 'previous_edition', 'as': 'next'}})
+    pipeline.append({'$project': {'_id': 0, 'previous._id': 0, 'next._id': 0}})
+    return pipeline
+
+def order_edition_chain(book: dict) -> list:
+    """Function that flattens the result of an edition chain pipeline into a list from the oldest edition to the newest."""
+    ISBN13 = book['ISBN13']
+    # in a cycle the book itself, and the books before it, are reached again, so each book is kept only once
+    previous = [edition for edition in book.pop('previous', []) if edition.get('ISBN13') != ISBN13]
+    seen = {ISBN13} | {edition.get('ISBN13') for edition in previous}
+    following = [edition for edition in book.pop('next', []) if edition.get('ISBN13') not in seen]
+    previous.sort(key=lambda edition: -edition['depth'])
+    following.sort(key=lambda edition: (edition['depth'], edition.get('year') or 0, edition.get('ISBN13')))
+    chain = previous + [book] + following
+    for edition in chain:
+        edition.pop('depth', None)
+        edition.pop('ISBN13', None)
+    return chain
+
+def choose_index(criteria: dict) -> str or None:
+    """Function that picks the compound index serving the most criteria, or None to let the server decide."""
+    # a text search always runs on the text index
+    if 'title' in criteria or 'ISBN' in criteria:
+        return None
+    best, best_score = None, 0
+    for name, equalities, ranges in INDEX_PLANS:
+        if not all(field in criteria for field in equalities):
+            continue
+        score = len(equalities) * 2 + any(field in criteria for field in ranges)
+        if score > best_score:
+            best, best_score = name, score
+    return best
+
+def build_matcher(criteria: dict, fltr: dict):
+    """Function that creates a predicate telling whether a written book could enter the results of the criteria."""
+    def could_match(book: dict) -> bool:
+        # a field missing from a partial edit keeps its old value, which may match
+        for field, condition in fltr.items():
+            # stemming makes an exact text check impractical, so it always counts as a possible match
+            if field == '$text' or field not in book:
+                continue
+            elif isinstance(condition, dict):
+                value = book[field]
+                if value is None or ('$gte' in condition and value < condition['$gte']) or ('$lte' in condition and value > condition['$lte']):
+                    return False
+            elif book[field] != condition:
+                return False
+        return True
+    return could_match
@@ -0,0 +1,109 @@
+# IMPORTS
+
+from collections import OrderedDict
+from copy import deepcopy
+from threading import Lock
+from time import monotonic
+
+
+
+# CONSTANTS
+
+CACHE_SIZE = 256
+CACHE_TTL = 60.0
+
+
+
+# CACHE ENTRY CLASS
+
+class CacheEntry:
+    """Class that holds a cached query result and what it depends on."""
+    def __init__(self, value: list, expires: float, matcher, isbns: set, publishers: set):
+        """Constructor method."""
+        self.value = value
+        self.expires = expires
+        # predicate telling whether a written book could enter the result
+        self.matcher = matcher
+        # books and publishers the result already contains
+        self.isbns = isbns
+        self.publishers = publishers
+
+
+
+# CACHE CLASS
+
+class QueryCache:
+    """Class that caches query results with LRU eviction, a TTL and write invalidation."""
+    def __init__(self, size: int = CACHE_SIZE, ttl: float = CACHE_TTL):
+        """Constructor method."""
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # bumped by every invalidation, so that a result read before one is not cached after it
+        self.generation = 0
+
+    def get(self, key: tuple) -> list or None:
+        """Method that returns a cached result, or None if it is missing or expired."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry.expires < monotonic():
+                if entry is not None:
+                    del self.entries[key]
+                self.misses += 1
+                return None
+            # mark the entry as most recently used
+            self.entries.move_to_end(key)
+            self.hits += 1
+            # the caller gets its own books, so changing them never changes the cache
+            return deepcopy(entry.value)
+
+    def current_generation(self) -> int:
+        """Method that returns the invalidation generation, to be taken before reading a result that is then put."""
+        with self.lock:
+            return self.generation
+
+    def put(self, key: tuple, value: list, matcher, isbns: set, publishers: set, generation: int = None) -> None:
+        """Method that caches a result, evicting the least recently used entries beyond 'size'."""
+        value = deepcopy(value)
+        with self.lock:
+            # a write invalidated the cache since the result was read, so the result may be stale
+            if generation is not None and generation != self.generation:
+                return
+            self.entries[key] = CacheEntry(value, monotonic() + self.ttl, matcher, isbns, publishers)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, book: dict = None, ISBN13: str = None, publisher: str = None) -> None:
+        """Method that drops the entries a write could have changed: those the written book could now enter and those holding the book or publisher."""
+        with self.lock:
+            self.generation += 1
+            stale = [
+                key for key, entry in self.entries.items()
+                if (book is not None and entry.matcher(book))
+                or (ISBN13 is not None and ISBN13 in entry.isbns)
+                or (publisher is not None and publisher in entry.publishers)
+            ]
+            for key in stale:
+                del self.entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self) -> None:
+        """Method that drops every cached entry."""
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        """Method that returns the cache counters."""
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
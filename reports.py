@@ -0,0 +1,90 @@
+# IMPORTS
+
+from pymongo_connector import PUBLISHER_COLLECTION
+
+
+
+# CONSTANTS
+
+REPORTS = ('publishers', 'cities', 'years', 'prices')
+PERCENTILES = (50, 90, 99)
+# upper bounds of the default price histogram buckets, the last one catching everything above
+PRICE_BOUNDARIES = [0, 10, 20, 30, 40, 50, 75, 100, 200]
+
+
+
+# FUNCTIONS
+
+def books_per_publisher(limit: int = 0) -> list:
+    """Function that creates the pipeline counting the books and averaging the prices of each publisher, largest first."""
+    pipeline = [
+        {'$group': {'_id': '$published_by', 'books': {'$sum': 1}, 'avg_price': {'$avg': '$price'}}},
+        {'$sort': {'books': -1, '_id': 1}},
+    ]
+    if limit:
+        pipeline.append({'$limit': limit})
+    pipeline.append({'$project': {'_id': 0, 'publisher': '$_id', 'books': 1, 'avg_price': {'$round': ['$avg_price', 2]}}})
+    return pipeline
+
+def books_per_city(publisher_collection: str = PUBLISHER_COLLECTION) -> list:
+    """Function that creates the pipeline counting the books and publishers of each publisher city."""
+    return [
+        # count the books of each publisher first, so the join runs once per publisher instead of once per book
+        {'$group': {'_id': '$published_by', 'books': {'$sum': 1}}},
+        {'$lookup': {'from': publisher_collection, 'localField': '_id', 'foreignField': 'name', 'as': 'publisher'}},
+        {'$group': {
+            '_id': {'$ifNull': [{'$first': '$publisher.city'}, None]},
+            'books': {'$sum': '$books'},
+            'publishers': {'$sum': 1},
+        }},
+        {'$sort': {'books': -1, '_id': 1}},
+        {'$project': {'_id': 0, 'city': '$_id', 'books': 1, 'publishers': 1}},
+    ]
+
+def price_by_year(percentiles: tuple = PERCENTILES) -> list:
+    """Function that creates the pipeline of the price count, min, avg, max and nearest-rank percentiles of each year."""
+    project = {'_id': 0, 'year': '$_id', 'books': 1, 'priced': 1, 'min': 1, 'max': 1, 'avg': {'$round': ['$avg', 2]}}
+    for p in percentiles:
+        # index of the nearest rank, 0 for a year without prices
+        rank = {'$max': [{'$subtract': [{'$ceil': {'$multiply': [p / 100, '$priced']}}, 1]}, 0]}
+        project[f'p{p}'] = {'$arrayElemAt': ['$prices', rank]}
+    return [
+        {'$group': {
+            '_id': '$year',
+            'books': {'$sum': 1},
+            'min': {'$min': '$price'},
+            'avg': {'$avg': '$price'},
+            'max': {'$max': '$price'},
+            # books without a price are left out of the percentiles
+            'prices': {'$push': '$price'},
+        }},
+        {'$set': {'prices': {'$sortArray': {'input': {'$filter': {'input': '$prices', 'cond': {'$isNumber': '$$this'}}}, 'sortBy': 1}}}},
+        {'$set': {'priced': {'$size': '$prices'}}},
+        {'$project': project},
+        {'$sort': {'year': 1}},
+    ]
+
+def price_histogram(boundaries: list = None) -> list:
+    """Function that creates the pipeline of the overall price statistics and the book count of each price bucket in one $facet."""
+    boundaries = sorted(boundaries or PRICE_BOUNDARIES)
+    return [
+        {'$facet': {
+            'stats': [
+                {'$group': {'_id': None, 'books': {'$sum': 1}, 'priced': {'$sum': {'$cond': [{'$isNumber': '$price'}, 1, 0]}}, 'min': {'$min': '$price'}, 'avg': {'$avg': '$price'}, 'max': {'$max': '$price'}}},
+                {'$project': {'_id': 0, 'books': 1, 'priced': 1, 'min': 1, 'max': 1, 'avg': {'$round': ['$avg', 2]}}},
+            ],
+            'buckets': [
+                {'$match': {'price': {'$type': 'number'}}},
+                {'$bucket': {'groupBy': '$price', 'boundaries': boundaries + [float('inf')], 'default': 'below', 'output': {'books': {'$sum': 1}}}},
+            ],
+        }},
+    ]
+
+def format_buckets(buckets: list, boundaries: list = None) -> list:
+    """Function that labels the price buckets with their ranges, including the empty ones."""
+    boundaries = sorted(boundaries or PRICE_BOUNDARIES)
+    counts = {bucket['_id']: bucket['books'] for bucket in buckets}
+    labeled = [{'price': f'< {boundaries[0]}', 'books': counts['below']}] if 'below' in counts else []
+    for low, high in zip(boundaries, boundaries[1:] + [None]):
+        labeled.append({'price': f'{low} - {high}' if high is not None else f'>= {low}', 'books': counts.get(low, 0)})
+    return labeled
@@ -0,0 +1,67 @@
+# IMPORTS
+
+from threading import Lock
+from embedded_query import type_name
+
+
+
+# CONSTANTS
+
+SAMPLE_SIZE = 1000
+# fields shown first, in the order books are created with
+FIELD_ORDER = ['ISBN', 'title', 'year', 'published_by', 'price', 'previous_edition']
+HIDDEN_FIELDS = ('_id', 'ISBN13')
+
+
+
+# SCHEMA CATALOG CLASS
+
+class SchemaCatalog:
+    """Class that keeps the union of the fields of a collection and their types, sampled once and updated on writes."""
+    def __init__(self):
+        """Constructor method."""
+        self.lock = Lock()
+        self.types = {}
+        self.loaded = False
+
+    def load(self, collection, sample_size: int = SAMPLE_SIZE) -> None:
+        """Method that samples the collection on the server to learn its fields and their BSON types."""
+        pipeline = [
+            {'$sample': {'size': sample_size}},
+            {'$project': {'fields': {'$objectToArray': '$$ROOT'}}},
+            {'$unwind': '$fields'},
+            {'$group': {'_id': '$fields.k', 'types': {'$addToSet': {'$type': '$fields.v'}}}},
+        ]
+        sampled = {field['_id']: set(field['types']) for field in collection.aggregate(pipeline)}
+        with self.lock:
+            for field, types in sampled.items():
+                self.types.setdefault(field, set()).update(types)
+            self.loaded = True
+
+    def observe(self, document: dict) -> None:
+        """Method that adds the fields of a written document to the catalog, under the BSON type names the server sample uses."""
+        with self.lock:
+            for field, value in document.items():
+                self.types.setdefault(field, set()).add(type_name(value))
+
+    def invalidate(self) -> None:
+        """Method that forgets the catalog so that the next use samples the collection again."""
+        with self.lock:
+            self.types.clear()
+            self.loaded = False
+
+    def fields(self) -> list:
+        """Method that returns the visible fields, the usual ones first in creation order."""
+        with self.lock:
+            return self._fields()
+
+    def describe(self) -> dict:
+        """Method that returns the visible fields with the types seen for each of them."""
+        with self.lock:
+            return {field: sorted(self.types[field]) for field in self._fields()}
+
+    def _fields(self) -> list:
+        """Method that orders the visible fields, to be called with the lock held."""
+        known = [field for field in FIELD_ORDER if field in self.types]
+        extra = sorted(field for field in self.types if field not in FIELD_ORDER and field not in HIDDEN_FIELDS)
+        return known + extra
@@ -0,0 +1,310 @@
+# IMPORTS
+
+import json
+import argparse
+from threading import Lock
+from urllib.parse import urlparse, parse_qs, unquote
+from concurrent.futures import ThreadPoolExecutor
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from book_dao import BookDAO
+from book_pager import BookPager, PAGE_SIZE
+from bulk_import import validate_book, validate_publisher, clean
+from isbn import normalize_isbn
+from format import Format
+from metrics import Metrics, SLOW_QUERY_MS, SLOW_QUERY_LOG
+
+
+
+# CONSTANTS
+
+HOST = '127.0.0.1'
+PORT = 8080
+WORKERS = 16
+REQUEST_TIMEOUT = 30
+# how long an idle keep-alive connection holds its worker waiting for the next request
+KEEP_ALIVE_TIMEOUT = 2
+MAX_PAGE_SIZE = 1000
+MAX_BODY_SIZE = 1024 * 1024
+
+
+
+# SERVER CLASSES
+
+class PooledHTTPServer(HTTPServer):
+    """Class that serves HTTP requests on a fixed pool of worker threads."""
+    def __init__(self, address: tuple, handler, dao: BookDAO, workers: int = WORKERS, timeout: int = REQUEST_TIMEOUT, keep_alive: float = KEEP_ALIVE_TIMEOUT):
+        """Constructor method."""
+        super().__init__(address, handler)
+        # every worker shares the DAO and so the connection pool
+        self.dao = dao
+        self.request_timeout = timeout
+        self.keep_alive_timeout = keep_alive
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        # connections accepted but not yet picked up by a worker
+        self.waiting = 0
+        self.waiting_lock = Lock()
+
+    def process_request(self, request, client_address) -> None:
+        """Method that hands a connection to the worker pool."""
+        with self.waiting_lock:
+            self.waiting += 1
+        self.pool.submit(self.process_request_thread, request, client_address)
+
+    def process_request_thread(self, request, client_address) -> None:
+        """Method that handles a connection in a worker thread."""
+        with self.waiting_lock:
+            self.waiting -= 1
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self) -> None:
+        """Method that stops the workers and closes the server."""
+        super().server_close()
+        self.pool.shutdown(wait=True)
+
+
+class BookRequestHandler(BaseHTTPRequestHandler):
+    """Class that maps HTTP requests to BookDAO operations."""
+    # keep connections alive between requests
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self) -> None:
+        """Method that applies the request timeout to the connection."""
+        self.timeout = self.server.request_timeout
+        super().setup()
+
+    def handle(self) -> None:
+        """Method that handles the requests of a connection, closing it once idle so that it does not hold a worker."""
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection and self.wait_for_request():
+            self.handle_one_request()
+
+    def wait_for_request(self) -> bool:
+        """Method that waits briefly for the next request on a kept-alive connection, and not at all while other connections wait for a worker."""
+        if self.server.waiting:
+            return False
+        # a request already read into the buffer is returned at once
+        self.connection.settimeout(self.server.keep_alive_timeout)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def do_GET(self) -> None:
+        """Method that handles the search and metrics requests."""
+        url = urlparse(self.path)
+        # export the metrics snapshot
+        if url.path == '/metrics':
+            metrics = self.server.dao.metrics
+            return self.send_json(200, metrics.snapshot()) if metrics else self.send_json(404, {'error': 'Metrics are disabled.'})
+        if url.path != '/books':
+            return self.send_json(404, {'error': 'Not found.'})
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        # run the search
+        try:
+            page_size = max(1, min(int(query.get('page_size', PAGE_SIZE)), MAX_PAGE_SIZE))
+            result = search(self.server.dao, query, page_size)
+        except ValueError as e:
+            return self.send_json(400, {'error': str(e)})
+        if type(result) == str:
+            return self.send_json(error_status(result), {'error': Format.plain(result)})
+        # stream every result as JSON lines
+        if query.get('stream') in ('1', 'true'):
+            return self.send_stream(result)
+        # send one page, with the token of the next one
+        if isinstance(result, BookPager):
+            try:
+                if query.get('after'):
+                    result.resume(query['after'])
+            except Exception as e:
+                return self.send_json(400, {'error': f'Invalid page token: {e}'})
+            try:
+                books = result.next_page()
+            except Exception as e:
+                return self.send_json(error_status(BookDAO._failure(e)), {'error': str(e)})
+            return self.send_json(200, {'books': books, 'next': result.token()})
+        return self.send_json(200, {'books': result, 'next': None})
+
+    def do_POST(self) -> None:
+        """Method that handles the add book and add publisher requests."""
+        path, body = urlparse(self.path).path, self.read_json()
+        if body is None:
+            return
+        if path == '/books':
+            try:
+                book = validate_book(body)
+            except ValueError as e:
+                return self.send_json(400, {'error': str(e)})
+            message = self.server.dao.add_book(book['ISBN'], book['title'], book['year'], book['published_by'], book.get('previous_edition'), book['price'])
+        elif path == '/publishers':
+            try:
+                publisher = validate_publisher(body)
+            except ValueError as e:
+                return self.send_json(400, {'error': str(e)})
+            message = self.server.dao.add_publisher(publisher['name'], publisher['phone'], publisher['city'])
+        else:
+            return self.send_json(404, {'error': 'Not found.'})
+        self.send_message(message, 201)
+
+    def do_PATCH(self) -> None:
+        """Method that handles the edit book requests."""
+        parts = urlparse(self.path).path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] != 'books':
+            return self.send_json(404, {'error': 'Not found.'})
+        body = self.read_json()
+        if body is None:
+            return
+        try:
+            changes = parse_edit(body)
+        except ValueError as e:
+            return self.send_json(400, {'error': str(e)})
+        # answer with the edited book
+        result = self.server.dao.edit_book(unquote(parts[1]), **changes, return_book=True)
+        if type(result) == dict:
+            return self.send_json(200, {'book': result})
+        self.send_message(result)
+
+    def do_DELETE(self) -> None:
+        """Method that handles the delete book and delete publisher requests."""
+        parts = urlparse(self.path).path.strip('/').split('/')
+        if len(parts) != 2 or parts[0] not in ('books', 'publishers'):
+            return self.send_json(404, {'error': 'Not found.'})
+        key = unquote(parts[1])
+        if parts[0] == 'books':
+            return self.send_message(self.server.dao.delete_book(key))
+        # ?cascade=delete, or ?cascade=reassign&reassign_to=<name>, also handles the books of the publisher
+        query = {name: values[-1] for name, values in parse_qs(urlparse(self.path).query).items()}
+        self.send_message(self.server.dao.delete_publisher(key, query.get('cascade'), query.get('reassign_to')))
+
+    def read_json(self) -> dict or None:
+        """Method that reads the JSON body of a request, answering with an error if it is invalid."""
+        length = int(self.headers.get('Content-Length', 0))
+        if length > MAX_BODY_SIZE:
+            self.send_json(413, {'error': 'Request body too large.'})
+            return None
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json(400, {'error': 'Request body must be JSON.'})
+            return None
+        if type(body) != dict:
+            self.send_json(400, {'error': 'Request body must be a JSON object.'})
+            return None
+        return body
+
+    def send_message(self, message: str, status: int = 200) -> None:
+        """Method that sends a DAO message, as an error if it is a warning."""
+        if Format.is_warning(message):
+            self.send_json(error_status(message), {'error': Format.plain(message)})
+        else:
+            self.send_json(status, {'message': Format.plain(message)})
+
+    def send_json(self, status: int, data: dict) -> None:
+        """Method that sends a JSON response."""
+        body = json.dumps(data, default=str).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_stream(self, books) -> None:
+        """Method that streams books as chunked JSON lines."""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        # a failure after the headers are sent can only end the stream early
+        try:
+            for book in books:
+                line = (json.dumps(book, default=str) + '\n').encode('utf-8')
+                self.wfile.write(f'{len(line):x}\r\n'.encode('ascii') + line + b'\r\n')
+        except Exception:
+            self.close_connection = True
+        self.wfile.write(b'0\r\n\r\n')
+
+    def log_message(self, format: str, *args) -> None:
+        """Method that silences the per-request log."""
+        pass
+
+
+
+# FUNCTIONS
+
+def error_status(message: str) -> int:
+    """Function that returns the HTTP status of a DAO warning: 500 if the database failed, 400 if it refused the request."""
+    return 500 if Format.is_error(message) else 400
+
+def parse_edit(body: dict) -> dict:
+    """Function that validates the fields of an edit request and returns the edit_book arguments."""
+    changes = {field: clean(body.get(field)) for field in ('title', 'year', 'published_by', 'previous_edition', 'price')}
+    if changes['year']:
+        changes['year'] = int(changes['year'])
+        if len(f'{changes["year"]}') != 4:
+            raise ValueError('Book year must be 4 digits long.')
+    if changes['previous_edition']:
+        normalize_isbn(changes['previous_edition'])
+    changes['price'] = round(float(changes['price']), 2) if changes['price'] else None
+    changes = {field: value if value != '' else None for field, value in changes.items()}
+    # the version the book is expected to be at, for optimistic concurrency
+    version = clean(body.get('version'))
+    changes['version'] = int(version) if version not in (None, '') else None
+    return changes
+
+def search(dao: BookDAO, query: dict, page_size: int) -> list or BookPager or str:
+    """Function that runs the search mode selected by the query parameters."""
+    title, isbn, publisher = query.get('title'), query.get('isbn'), query.get('publisher')
+    year, min_price, max_price = query.get('year'), query.get('min_price'), query.get('max_price')
+    # an exact publisher or a year range selects the combined search
+    if query.get('published_by') or query.get('year_min') or query.get('year_max'):
+        criteria = {
+            'title': title, 'ISBN': isbn, 'published_by': query.get('published_by'), 'year': year,
+            'year_min': query.get('year_min'), 'year_max': query.get('year_max'), 'price_min': min_price, 'price_max': max_price,
+        }
+        return dao.search_books(criteria, page_size=page_size)
+    if isbn:
+        return dao.search_books_by_ISBN(isbn)
+    if title and publisher:
+        return dao.search_books_by_title_and_publisher(title, publisher, page_size=page_size)
+    if title:
+        return dao.search_books_by_title(title, page_size=page_size)
+    if publisher:
+        return dao.search_books_by_publisher(publisher, page_size=page_size)
+    if min_price is not None or max_price is not None:
+        return dao.search_books_by_price_range(float(min_price or 0), float(max_price or 'inf'), page_size=page_size)
+    if year:
+        return dao.search_books_by_year(int(year), page_size=page_size)
+    return dao.search_all_books(page_size=page_size)
+
+def serve(host: str = HOST, port: int = PORT, workers: int = WORKERS, timeout: int = REQUEST_TIMEOUT, metrics: Metrics = None, keep_alive: float = KEEP_ALIVE_TIMEOUT) -> None:
+    """Function that runs the HTTP server until it is interrupted."""
+    dao = BookDAO(metrics=metrics)
+    server = PooledHTTPServer((host, port), BookRequestHandler, dao, workers, timeout, keep_alive)
+    print(Format.info(f'Serving on http://{host}:{port} with {workers} workers.'))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        dao.close()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Book Manager HTTP JSON API.')
+    parser.add_argument('--host', default=HOST)
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--workers', type=int, default=WORKERS)
+    parser.add_argument('--timeout', type=int, default=REQUEST_TIMEOUT)
+    parser.add_argument('--keep-alive', dest='keep_alive', type=float, default=KEEP_ALIVE_TIMEOUT, help='seconds an idle connection is kept open')
+    parser.add_argument('--metrics', action='store_true', help='collect metrics, served at /metrics, and log slow queries')
+    parser.add_argument('--slow-ms', dest='slow_ms', type=float, default=SLOW_QUERY_MS)
+    parser.add_argument('--slow-log', dest='slow_log', default=SLOW_QUERY_LOG, help='file the slow queries are logged to')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.timeout, Metrics(args.slow_ms, log_path=args.slow_log) if args.metrics else None, args.keep_alive)
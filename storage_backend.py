@@ -0,0 +1,52 @@
+# IMPORTS
+
+from abc import ABC, abstractmethod
+
+
+
+# CONSTANTS
+
+# the 'backend' setting values, MongoDB being the default
+BACKENDS = ('mongodb', 'embedded')
+
+
+
+# STORAGE BACKEND CLASS
+
+class StorageBackend(ABC):
+    """Class that represents a storage backend, i.e. a connection whose collections have the pymongo Collection methods used by the DAO."""
+    @abstractmethod
+    def getClient(self):
+        """Method that returns the client."""
+
+    @abstractmethod
+    def getDB(self):
+        """Method that returns the database."""
+
+    @abstractmethod
+    def getPublisherCollection(self):
+        """Method that returns the collection."""
+
+    @abstractmethod
+    def getBookCollection(self):
+        """Method that returns the collection."""
+
+    @abstractmethod
+    def close(self):
+        """Method that releases the connection."""
+
+
+
+# FUNCTIONS
+
+def open_connection(settings: dict) -> StorageBackend:
+    """Function that opens a connection to the backend named by the 'backend' setting."""
+    backend = settings.get('backend') or BACKENDS[0]
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown backend "{backend}", expected one of: {", ".join(BACKENDS)}.')
+    # the backends are imported on use, so the embedded one is only loaded when asked for
+    if backend == 'embedded':
+        from embedded_store import EmbeddedConnection
+        return EmbeddedConnection(settings)
+    from pymongo_connector import DBConnection
+    return DBConnection(settings=settings)
@@ -0,0 +1,125 @@
+# IMPORTS
+
+import io
+import os
+import sys
+import csv
+import shlex
+import subprocess
+from itertools import islice, chain
+from format import Format
+
+
+
+# CONSTANTS
+
+RENDER_FORMATS = ('table', 'plain', 'csv')
+# rows read ahead to size the columns, the rest are streamed with those widths
+SAMPLE_ROWS = 200
+MAX_CELL_WIDTH = 40
+ELLIPSIS = '…'
+# rows joined into one write to the output
+FLUSH_ROWS = 500
+DEFAULT_PAGER = 'less -FRSX'
+
+
+
+# FUNCTIONS
+
+def truncate(value: str, width: int) -> str:
+    """Function that shortens a cell to 'width' characters, marking the cut with an ellipsis."""
+    return value if len(value) <= width else value[:max(width - 1, 0)] + ELLIPSIS
+
+def open_pager(out=None):
+    """Function that starts the pager named by $PAGER (or less) and returns the process, or None if there is no terminal or no pager."""
+    out = out or sys.stdout
+    if not out.isatty():
+        return None
+    try:
+        return subprocess.Popen(shlex.split(os.environ.get('PAGER', DEFAULT_PAGER)), stdin=subprocess.PIPE, encoding='utf-8', errors='replace')
+    except OSError:
+        return None
+
+
+
+# TABLE RENDERER CLASS
+
+class TableRenderer:
+    """Class that prints rows as a table, CSV or plain text while they are read, in one pass and with buffered writes."""
+    def __init__(self, columns: list, out=None, fmt: str = 'table', width: int = 0, max_cell_width: int = MAX_CELL_WIDTH, sample_rows: int = SAMPLE_ROWS, extra_columns: bool = False):
+        """Constructor method."""
+        if fmt not in RENDER_FORMATS:
+            raise ValueError(f'Unknown output format: {fmt}.')
+        self.columns = list(columns)
+        # fields of the sampled rows missing from the columns get a column of their own
+        self.extra_columns = extra_columns
+        self.out = out or sys.stdout
+        self.fmt = fmt
+        # with a width the columns are scaled to fill it, otherwise they fit their contents
+        self.width = width
+        self.max_cell_width = max_cell_width
+        self.sample_rows = sample_rows
+
+    def render(self, rows) -> int:
+        """Method that writes every row and returns how many were written."""
+        rows = iter(rows)
+        # size the columns, and find the extra ones, from the first rows only
+        sample = list(islice(rows, self.sample_rows))
+        if self.extra_columns:
+            self.columns += [field for field in dict.fromkeys(field for row in sample for field in row) if field not in self.columns]
+        if self.fmt == 'csv':
+            return self._render_csv(chain(sample, rows))
+        widths = self.size(sample)
+        buffer, count = [self._header(widths)], 0
+        for row in chain(sample, rows):
+            buffer.append(self._line(row, widths))
+            count += 1
+            if len(buffer) >= FLUSH_ROWS:
+                self._write(buffer)
+                buffer = []
+        self._write(buffer)
+        return count
+
+    def size(self, sample: list) -> dict:
+        """Method that computes the width of each column from a sample of rows."""
+        widths = {}
+        for column in self.columns:
+            longest = max([len(str(row.get(column, ''))) for row in sample] + [0])
+            widths[column] = max(min(longest, self.max_cell_width), len(column))
+        if self.width:
+            total = sum(widths.values()) + len(widths) * 3 - 1
+            widths = {column: max(round(value / total * self.width), 1) for column, value in widths.items()}
+        return widths
+
+    def _header(self, widths: dict) -> str:
+        """Method that creates the header line."""
+        header = ' | '.join(f'{truncate(column, width): ^{width}}' for column, width in widths.items())
+        return Format.format(header, ('bold', 'main')) if self.fmt == 'table' else header
+
+    @staticmethod
+    def _line(row: dict, widths: dict) -> str:
+        """Method that creates the line of a row, cutting the cells wider than their column."""
+        return ' | '.join(f'{truncate(str(row.get(column, "")), width): ^{width}}' for column, width in widths.items())
+
+    def _render_csv(self, rows) -> int:
+        """Method that writes the rows as CSV, with every cell in full."""
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, self.columns, restval='', extrasaction='ignore')
+        writer.writeheader()
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+            if count % FLUSH_ROWS == 0:
+                self.out.write(buffer.getvalue())
+                buffer.seek(0)
+                buffer.truncate()
+        self.out.write(buffer.getvalue())
+        self.out.flush()
+        return count
+
+    def _write(self, lines: list) -> None:
+        """Method that writes a block of lines with a single call."""
+        if lines:
+            self.out.write('\n'.join(lines) + '\n')
+            self.out.flush()
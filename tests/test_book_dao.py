@@ -0,0 +1,109 @@
+# IMPORTS
+
+from uuid import uuid4
+import pytest
+from book_dao import BookDAO
+from book_pager import BookPager
+from write_behind import WriteBehind
+from format import Format
+from benchmarks.data import make_isbn
+
+
+
+# FIXTURES
+
+@pytest.fixture
+def dao():
+    """Fixture that returns a BookDAO on a fresh in-memory embedded database, with its indexes applied."""
+    dao = BookDAO(settings={'backend': 'embedded', 'dbname': f'test_{uuid4().hex}', 'embedded_path': ''})
+    dao.connect()
+    assert dao.wait_for_indexes() is None
+    dao.add_publisher('Pen Books', '1234567890', 'Austin')
+    dao.add_publisher('Ink House', '1234567890', 'Boston')
+    yield dao
+    dao.close()
+
+def add_books(dao: BookDAO, count: int, published_by: str = 'Pen Books') -> list:
+    """Function that adds books with increasing years and prices and returns their ISBNs."""
+    ISBNs = [make_isbn(i) for i in range(count)]
+    for i, ISBN in enumerate(ISBNs):
+        assert not Format.is_warning(dao.add_book(ISBN, f'Book {i:03d}', 1990 + i % 20, published_by, None, 5.0 + i))
+    return ISBNs
+
+
+
+# TESTS
+
+def test_add_and_duplicate_book(dao):
+    ISBN = make_isbn(1)
+    assert not Format.is_warning(dao.add_book(ISBN, 'Learning Python', 2001, 'Pen Books', None, 30.0))
+    assert dao.search_books_by_ISBN(ISBN)[0]['title'] == 'Learning Python'
+    # the same ISBN, and a publisher that does not exist, are refused
+    assert Format.is_warning(dao.add_book(ISBN, 'Learning Python', 2001, 'Pen Books', None, 30.0))
+    assert Format.is_warning(dao.add_book(make_isbn(2), 'Other', 2001, 'Missing Press', None, 30.0))
+    assert len(dao.search_all_books()) == 1
+
+def test_edit_with_version_conflict(dao):
+    ISBN = add_books(dao, 1)[0]
+    edited = dao.edit_book(ISBN, 'New Title', None, None, None, None, version=0, return_book=True)
+    assert edited['title'] == 'New Title' and edited['version'] == 1
+    # an edit expecting the old version is refused and changes nothing
+    conflict = dao.edit_book(ISBN, 'Stale Title', None, None, None, None, version=0)
+    assert Format.is_warning(conflict) and 'edited by someone else' in conflict
+    assert dao.search_books_by_ISBN(ISBN)[0]['title'] == 'New Title'
+    assert Format.is_warning(dao.edit_book(make_isbn(99), 'Title', None, None, None, None))
+
+def test_delete_book(dao):
+    ISBNs = add_books(dao, 2)
+    assert not Format.is_warning(dao.delete_book(ISBNs[0]))
+    assert dao.search_books_by_ISBN(ISBNs[0]) == []
+    assert len(dao.search_all_books()) == 1
+
+def test_text_price_and_year_searches(dao):
+    add_books(dao, 30)
+    dao.add_book(make_isbn(100), 'Learning Python', 2005, 'Ink House', None, 42.0)
+    # text searches match stemmed words, best matches first
+    assert [book['title'] for book in dao.search_books_by_title('learn')] == ['Learning Python']
+    assert dao.search_books_by_title_and_publisher('learn', 'ink')[0]['ISBN'] == make_isbn(100)
+    assert dao.search_books_by_title_and_publisher('learn', 'pen') == []
+    # price ranges and years include their bounds
+    assert sorted(book['price'] for book in dao.search_books_by_price_range(10.0, 12.0)) == [10.0, 11.0, 12.0]
+    assert sorted(book['title'] for book in dao.search_books_by_year(1995)) == ['Book 005', 'Book 025']
+
+@pytest.mark.parametrize('sort', [None, [('price', -1)], [('year', 1), ('title', -1)]])
+def test_keyset_paging_forward_and_back(dao, sort):
+    add_books(dao, 45)
+    expected = dao.search_books({'published_by': 'Pen Books'}, sort=sort, projection=['title'])
+    pager = dao.search_books({'published_by': 'Pen Books'}, sort=sort, projection=['title'], page_size=10)
+    assert isinstance(pager, BookPager)
+    pages = [pager.next_page()]
+    while pager.has_next():
+        pages.append(pager.next_page())
+    assert [len(page) for page in pages] == [10, 10, 10, 10, 5]
+    assert [book for page in pages for book in page] == expected
+    # walking back returns the same pages, and a token resumes after its page
+    for number in range(len(pages) - 2, -1, -1):
+        assert pager.previous_page() == pages[number]
+    assert not pager.has_previous()
+    assert pager.next_page() == pages[1]
+    resumed = dao.search_books({'published_by': 'Pen Books'}, sort=sort, projection=['title'], page_size=10)
+    resumed.resume(pager.token())
+    assert resumed.next_page() == pages[2]
+
+def test_cascade_delete_and_reassign(dao):
+    add_books(dao, 3)
+    dao.add_book(make_isbn(50), 'Inked', 2000, 'Ink House', None, 10.0)
+    message = dao.delete_publisher('Pen Books', cascade='delete')
+    assert 'its 3 books deleted' in message
+    assert dao.search_books({'published_by': 'Pen Books'}) == []
+    dao.add_publisher('Pen Books', '1234567890', 'Austin')
+    message = dao.delete_publisher('Ink House', cascade='reassign', reassign_to='Pen Books')
+    assert '1 books reassigned' in message
+    assert dao.search_books_by_ISBN(make_isbn(50))[0]['published_by'] == 'Pen Books'
+    assert dao.sweep_orphans('report')['books'] == 0
+
+def test_cascade_delete_applies_queued_writes(dao):
+    dao.writer = WriteBehind()
+    dao.add_book(make_isbn(1), 'Queued', 2000, 'Pen Books', None, 10.0)
+    assert 'its 1 books deleted' in dao.delete_publisher('Pen Books', cascade='delete')
+    assert dao.sweep_orphans('report')['books'] == 0
@@ -0,0 +1,20 @@
+# IMPORTS
+
+import pytest
+from pymongo.errors import ConfigurationError
+from pymongo_connector import load_settings
+
+
+
+# TESTS
+
+def test_environment_overrides_are_converted(monkeypatch):
+    monkeypatch.setenv('BOOKMANAGER_MAX_POOL_SIZE', '12')
+    monkeypatch.setenv('BOOKMANAGER_DBNAME', 'books')
+    settings = load_settings()
+    assert settings['max_pool_size'] == 12 and settings['dbname'] == 'books'
+
+def test_invalid_environment_value_names_the_variable(monkeypatch):
+    monkeypatch.setenv('BOOKMANAGER_MAX_POOL_SIZE', 'ten')
+    with pytest.raises(ConfigurationError, match='BOOKMANAGER_MAX_POOL_SIZE'):
+        load_settings()
@@ -0,0 +1,28 @@
+# IMPORTS
+
+from bson.objectid import ObjectId
+from embedded_store import EmbeddedDatabase
+from schema_catalog import SchemaCatalog
+
+
+
+# TESTS
+
+def test_observe_uses_the_type_names_of_the_sample():
+    collection = EmbeddedDatabase('schema')['Book']
+    collection.insert_one({'ISBN': '9780000000002', 'title': 'Data', 'year': 2000, 'price': 9.5, 'tags': ['a'], 'meta': {'a': 1}})
+    collection.insert_one({'ISBN': '9780000000019', 'title': 'Systems', 'year': 2001, 'price': None, 'used': True})
+    catalog = SchemaCatalog()
+    catalog.load(collection)
+    loaded = catalog.describe()
+    catalog.observe({'_id': ObjectId(), 'ISBN': '9780000000026', 'title': 'Theory', 'year': 2002, 'price': 12.0, 'tags': ['b'], 'meta': {}, 'used': False})
+    catalog.observe({'ISBN': '9780000000033', 'title': 'Practice', 'year': 2003, 'price': None})
+    # observing documents of the sampled types adds no type
+    assert catalog.describe() == loaded
+    assert loaded['price'] == ['double', 'null']
+    assert loaded['year'] == ['int']
+
+def test_observe_names_new_types_like_the_server():
+    catalog = SchemaCatalog()
+    catalog.observe({'ISBN': '9780000000002', 'year': 2 ** 40, 'price': None, 'used': True, 'tags': [], 'meta': {}})
+    assert catalog.describe() == {'ISBN': ['string'], 'year': ['long'], 'price': ['null'], 'meta': ['object'], 'tags': ['array'], 'used': ['bool']}
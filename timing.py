@@ -0,0 +1,32 @@
+# IMPORTS
+
+import os
+import sys
+import json
+from time import perf_counter
+
+
+
+# CONSTANTS
+
+# set when this module is first imported, which main.py does before anything else
+START = perf_counter()
+TIMING_ENV = 'BOOKMANAGER_TIMING'
+MARKS = {}
+
+
+
+# FUNCTIONS
+
+def mark(name: str) -> None:
+    """Function that records the time elapsed since startup under a name, keeping the first record."""
+    MARKS.setdefault(name, round((perf_counter() - START) * 1000, 3))
+
+def enabled() -> bool:
+    """Function that checks whether startup timings should be reported."""
+    return os.environ.get(TIMING_ENV, '') not in ('', '0')
+
+def report() -> None:
+    """Function that prints the recorded startup timings, in milliseconds, as a JSON line on stderr."""
+    if enabled():
+        sys.stderr.write(json.dumps({'startup_ms': MARKS}) + '\n')
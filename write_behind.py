@@ -0,0 +1,126 @@
+# IMPORTS
+
+from concurrent.futures import Future
+from threading import Thread, Lock, Event
+from pymongo.errors import BulkWriteError
+from pymongo.write_concern import WriteConcern
+from format import Format
+
+
+
+# CONSTANTS
+
+WRITE_BATCH_SIZE = 500
+FLUSH_INTERVAL = 1.0
+
+
+
+# WRITE BEHIND CLASS
+
+class WriteBehind:
+    """Class that queues single-document writes and applies them in bulk_write batches, by size or after an interval."""
+    def __init__(self, batch_size: int = WRITE_BATCH_SIZE, flush_interval: float = FLUSH_INTERVAL, write_concern: dict = None):
+        """Constructor method."""
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # e.g. {'w': 1, 'j': False}, the collection's own write concern if not given
+        self.write_concern = WriteConcern(**write_concern) if write_concern else None
+        # queued (collection, operation, message, future) tuples, in submission order
+        self.pending = []
+        self.lock = Lock()
+        # only one batch is written at a time, so the writes keep their order
+        self.flush_lock = Lock()
+        self.wake = Event()
+        self.closed = False
+        self.thread = None
+        self.flushes = 0
+        self.written = 0
+
+    def submit(self, collection, operation, message: str) -> Future:
+        """Method that queues a write and returns a future resolved with 'message', or a warning, once it is written."""
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError('The writer is closed.')
+            self.pending.append((collection, operation, message, future))
+            full = len(self.pending) >= self.batch_size
+            # the flusher starts with the first write
+            if self.thread is None:
+                self.thread = Thread(target=self._run, daemon=True)
+                self.thread.start()
+        if full:
+            self.wake.set()
+        return future
+
+    def flush(self) -> int:
+        """Method that writes every queued operation and returns how many were written."""
+        with self.flush_lock:
+            with self.lock:
+                pending, self.pending = self.pending, []
+            if not pending:
+                return 0
+            # consecutive writes to the same collection share a bulk_write
+            start = 0
+            for end in range(1, len(pending) + 1):
+                if end == len(pending) or pending[end][0] is not pending[start][0]:
+                    self._write(pending[start:end])
+                    start = end
+            self.flushes += 1
+            self.written += len(pending)
+            return len(pending)
+
+    def close(self) -> None:
+        """Method that stops the flusher and writes the operations still queued."""
+        with self.lock:
+            self.closed = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.flush()
+
+    def stats(self) -> dict:
+        """Method that returns the writer counters."""
+        with self.lock:
+            return {'queued': len(self.pending), 'flushes': self.flushes, 'written': self.written}
+
+    def _run(self) -> None:
+        """Method that flushes when a batch is full or the interval has passed, until the writer is closed."""
+        while True:
+            self.wake.wait(self.flush_interval)
+            self.wake.clear()
+            try:
+                self.flush()
+            except Exception:
+                # the futures of a failed batch already hold the error
+                pass
+            with self.lock:
+                if self.closed:
+                    return
+
+    def _write(self, batch: list) -> None:
+        """Method that writes a batch to one collection in order, resolving the future of every operation."""
+        collection = batch[0][0]
+        if self.write_concern is not None:
+            collection = collection.with_options(write_concern=self.write_concern)
+        while batch:
+            try:
+                collection.bulk_write([operation for _, operation, _, _ in batch], ordered=True)
+                failed = len(batch)
+            except BulkWriteError as e:
+                # a write concern error leaves no write error to blame, so it is the result of every write of the batch
+                if not e.details.get('writeErrors'):
+                    errors = e.details.get('writeConcernErrors') or [{}]
+                    for _, _, _, future in batch:
+                        future.set_result(Format.warning(errors[0].get('errmsg', str(e))))
+                    return
+                # an ordered batch stops at its first error: the writes before it are applied, the ones after it are retried
+                error = e.details['writeErrors'][0]
+                failed = error['index']
+                batch[failed][3].set_result(Format.warning(error.get('errmsg', 'Write error.')))
+            except Exception as e:
+                for _, _, _, future in batch:
+                    future.set_result(Format.warning(str(e)))
+                return
+            for _, _, message, future in batch[:failed]:
+                future.set_result(message)
+            batch = batch[failed + 1:]